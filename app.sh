@@ -3,51 +3,92 @@
 # Define the application name
 SERVICE_NAME="Assistant"
 
-# Define the keyword to identify the process
-KEYWORD="streamlit"
-
 # Define the folder where the application is located
 FOLDER="./"
 
-# Function to start the service
+# Define the API (headless backend) settings (API_PORT, API_WORKERS and DRAIN_TIMEOUT of config/config.py)
+API_MODULE="modules.assistant_api_v1:app"
+
+# Function to read the API settings in config/config.py
+read_api_config() {
+    read API_PORT API_WORKERS API_DRAIN_TIMEOUT < <(python -c "from config.config import *; print(API_PORT, API_WORKERS, DRAIN_TIMEOUT)")
+}
+
+# Function to start the service (supervisor: Streamlit workers behind the reverse proxy)
 start_service() {
     pushd . > /dev/null
     echo "Starting $SERVICE_NAME..."
     cd $FOLDER
-    # Command to start the Streamlit application
-    streamlit run Assistant.py --server.port=8080 &
-    sleep 5
-    PROC=`ps -ef | grep $SERVICE_NAME | grep $KEYWORD | grep -v grep | awk -F" " '{ print $2 }'`
-    if [ -n "$PROC" ] && [ "$PROC" != "" ]; then
-        echo "OK: system started."
-    else
-        echo "ERROR: system process not found!"
-    fi
+    python -m modules.supervisor_v1 start
     popd > /dev/null
 }
 
-# Function to stop the service
+# Function to stop the service (the supervisor stops its workers)
 stop_service() {
     pushd . > /dev/null
     echo "Stopping $SERVICE_NAME..."
-    # Get the process ID
-    processPID=`ps -ef | grep $SERVICE_NAME | grep $KEYWORD | grep -v grep | awk -F" " '{ print $2 }'`
-    echo "Trying to kill process with key $SERVICE_NAME."
+    cd $FOLDER
+    python -m modules.supervisor_v1 stop
+    popd > /dev/null
+}
+
+# Function to show the status of the service
+status_service() {
+    pushd . > /dev/null
+    cd $FOLDER
+    python -m modules.supervisor_v1 status
+    popd > /dev/null
+}
+
+# Function to start the API (uvicorn with several worker processes)
+start_api() {
+    pushd . > /dev/null
+    echo "Starting API..."
+    cd $FOLDER
+    read_api_config
+    uvicorn $API_MODULE --host 0.0.0.0 --port $API_PORT --workers $API_WORKERS --timeout-graceful-shutdown $API_DRAIN_TIMEOUT &
+    # Wait for the warm-up of the workers (ready files)
+    if python -m modules.warmup_v1 wait --prefix api- --count $API_WORKERS; then
+        echo "OK: API started."
+    else
+        echo "ERROR: API not ready!"
+    fi
+    popd > /dev/null
+}
+
+# Function to stop the API
+stop_api() {
+    echo "Stopping API..."
+    processPID=`ps -ef | grep uvicorn | grep $API_MODULE | grep -v grep | awk -F" " '{ print $2 }'`
     kill $processPID
     sleep 5
     while [ -n "$processPID" ]; do
         echo "Waiting process ($processPID) to shutdown..."
         sleep 5
-        processPID=`ps -ef | grep $SERVICE_NAME | grep $KEYWORD | grep -v grep | awk -F" " '{ print $2 }'`
+        processPID=`ps -ef | grep uvicorn | grep $API_MODULE | grep -v grep | awk -F" " '{ print $2 }'`
     done
-    echo "OK: system stopped."
-    popd > /dev/null
+    echo "OK: API stopped."
+}
+
+# Function to restart the API workers one at a time (uvicorn >= 0.30: SIGHUP to the master)
+restart_api() {
+    echo "Restarting API workers..."
+    processPID=`ps -ef | grep uvicorn | grep $API_MODULE | grep -v grep | awk -F" " '{ print $2 }'`
+    if [ -z "$processPID" ]; then
+        start_api
+    else
+        kill -HUP $processPID
+        echo "OK: API workers restarting."
+    fi
 }
 
-# Function to restart the service
+# Function to restart the service (rolling restart: one worker at a time, no request dropped)
 restart_service() {
-    stop_service
-    start_service
+    pushd . > /dev/null
+    echo "Restarting $SERVICE_NAME..."
+    cd $FOLDER
+    python -m modules.supervisor_v1 rolling-restart
+    popd > /dev/null
 }
 
 # Main program
@@ -57,6 +98,14 @@ elif [ "$1" == "stop" ]; then
     stop_service
 elif [ "$1" == "restart" ]; then
     restart_service
+elif [ "$1" == "status" ]; then
+    status_service
+elif [ "$1" == "start-api" ]; then
+    start_api
+elif [ "$1" == "stop-api" ]; then
+    stop_api
+elif [ "$1" == "restart-api" ]; then
+    restart_api
 else
-    echo "Invalid command. Please use 'start', 'stop', or 'restart'."
+    echo "Invalid command. Please use 'start', 'stop', 'restart', 'status', 'start-api', 'stop-api' or 'restart-api'."
 fi
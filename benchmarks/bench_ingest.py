@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+"""
+Benchmark: ingestion throughput of load_files_and_embed (JSON and PDF files) with the fake embedder.
+"""
+
+import tempfile
+
+from benchmarks.bench_utils import Timer, build_synthetic_corpus, max_rss_mb, pdf_file_paths
+from modules.fake_providers_v1 import FakeEmbeddings
+from modules.manifest_v1 import read_manifest
+from modules.utils_v1 import load_files_and_embed
+
+
+def bench_ingest(scale: int, dimension: int) -> dict:
+    """
+    Chunk and embed the corpus scaled scale times in a temporary vector DB (offline: fake embedder, errors raised).
+    """
+
+    with tempfile.TemporaryDirectory() as corpus_dir, tempfile.TemporaryDirectory() as db_dir:
+        json_paths = build_synthetic_corpus(corpus_dir, scale)
+        pdf_paths = pdf_file_paths()
+        embedding_model = FakeEmbeddings(dimension)
+
+        with Timer() as load_timer:
+            load_files_and_embed(json_paths, pdf_paths, embed=False, embedding_model=embedding_model, dedup=False, log=print, raise_errors=True)
+
+        with Timer() as embed_timer:
+            load_files_and_embed(json_paths, pdf_paths, embed=True, persist_directory=db_dir, embedding_model=embedding_model, dedup=False,
+                                 log=print, raise_errors=True)
+
+        chunks = read_manifest(db_dir)["totals"]["embedded_chunks"]
+        if not chunks:
+            raise RuntimeError("No chunks embedded")
+
+    return {
+        "scale": scale,
+        "files": len(json_paths) + len(pdf_paths),
+        "chunks": chunks,
+        "load_s": round(load_timer.elapsed, 3),
+        "load_and_embed_s": round(embed_timer.elapsed, 3),
+        "chunks_per_s": round(chunks / embed_timer.elapsed, 1) if embed_timer.elapsed else None,
+        "max_rss_mb": max_rss_mb(),
+    }
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""
+Benchmark: latency of the keyword (BM25), semantic and fused retrievers of the application (FusionRetriever
+on the memory-mapped index with the default INDEX_BACKEND) at k=5..100, with the fake embedder.
+"""
+
+import tempfile
+
+from benchmarks.bench_utils import Timer, build_fake_index, max_rss_mb, percentiles, production_retriever, set_k
+from modules.fake_providers_v1 import FakeEmbeddings
+from modules.warmup_v1 import example_questions
+from config.config import *
+
+
+K_VALUES = [5, 10, 20, 50, 100]
+
+
+def bench_retrieval(scale: int, dimension: int, repeat: int = 3) -> dict:
+    """
+    Run the example questions through each retriever, for each k.
+    """
+
+    questions = example_questions() * repeat
+    results = {"scale": scale, "index_backend": INDEX_BACKEND, "queries_per_k": len(questions), "retrievers": {}}
+
+    with tempfile.TemporaryDirectory() as corpus_dir, tempfile.TemporaryDirectory() as index_dir:
+        embedding_model = FakeEmbeddings(dimension)
+        with Timer() as build_timer:
+            build_fake_index(corpus_dir, index_dir, scale, embedding_model)
+        results["index_build_s"] = round(build_timer.elapsed, 3)  # Vector DB, then BM25 or memory-mapped index
+
+        fused_retriever = production_retriever(index_dir, embedding_model)
+        keyword_retriever, vector_retriever = fused_retriever.retrievers  # Memory-mapped: ids only, the documents are read after the fusion
+
+        for k in K_VALUES:
+            set_k(keyword_retriever, k)
+            set_k(vector_retriever, k)
+            for name, retriever in (("bm25", keyword_retriever), ("vector", vector_retriever), ("fused", fused_retriever)):
+                latencies = []
+                for question in questions:
+                    with Timer() as timer:
+                        retriever.invoke(question)
+                    latencies.append(timer.elapsed)
+                stats = percentiles(latencies)
+                stats["qps"] = round(len(latencies) / sum(latencies), 1)
+                results["retrievers"].setdefault(name, {})[f"k={k}"] = stats
+
+    results["max_rss_mb"] = max_rss_mb()
+    return results
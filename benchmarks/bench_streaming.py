@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+Benchmark: time to first token (TTFT) and tokens/s of the main chain (hybrid RAG + fake LLM),
+i.e. the overhead of the chain on top of the model.
+"""
+
+import tempfile
+import time
+
+from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains.combine_documents import create_stuff_documents_chain
+
+from benchmarks.bench_utils import build_fake_index, max_rss_mb, percentiles, production_retriever
+from modules.assistant_backend_v3 import instanciate_prompts
+from modules.fake_providers_v1 import FakeChatModel, FakeEmbeddings
+from modules.warmup_v1 import example_questions
+from config.config import *
+
+
+def bench_streaming(scale: int, dimension: int, ttft: float = FAKE_LLM_TTFT, tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND) -> dict:
+    """
+    Stream the answers of the example questions and measure TTFT and tokens/s (retrievers of the application).
+    """
+
+    with tempfile.TemporaryDirectory() as corpus_dir, tempfile.TemporaryDirectory() as index_dir:
+        embedding_model = FakeEmbeddings(dimension)
+        build_fake_index(corpus_dir, index_dir, scale, embedding_model)
+
+        llm = FakeChatModel(ttft=ttft, tokens_per_second=tokens_per_second)
+        contextualize_q_prompt, qa_prompt = instanciate_prompts(FAKE_MENU)
+        history_aware_retriever = create_history_aware_retriever(llm, production_retriever(index_dir, embedding_model), contextualize_q_prompt)
+        ai_assistant_chain = create_retrieval_chain(history_aware_retriever, create_stuff_documents_chain(llm, qa_prompt))
+
+        ttfts = []
+        rates = []
+        no_answer = 0
+        for question in example_questions():
+            start = time.perf_counter()
+            first = None
+            tokens = 0
+            for chunk in ai_assistant_chain.stream({"input": question, "chat_history": []}):
+                if chunk.get("answer") is not None:
+                    if first is None:
+                        first = time.perf_counter()
+                    tokens = tokens + 1
+            end = time.perf_counter()
+            if first is None:
+                no_answer = no_answer + 1  # No answer chunk: no TTFT
+                continue
+            ttfts.append(first - start)
+            if tokens > 1 and end > first:
+                rates.append((tokens - 1) / (end - first))
+
+    return {
+        "scale": scale,
+        "model_ttft_s": ttft,
+        "model_tokens_per_s": tokens_per_second,
+        "index_backend": INDEX_BACKEND,
+        "ttft": percentiles(ttfts),
+        "no_answer": no_answer,
+        "tokens_per_s_mean": round(sum(rates) / len(rates), 1) if rates else None,
+        "max_rss_mb": max_rss_mb(),
+    }
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Helpers shared by the benchmarks: timers, latency percentiles, memory high-water marks,
+synthetic corpora (the JSON files scaled 1x/10x/100x) and indexes built with the fake embedder.
+"""
+
+import json
+import math
+import os
+import resource
+import statistics
+import time
+
+
+JSON_FILES_DIR = "./json_files/"
+PDF_FILES_DIR = "./pdf_files/"
+
+
+def percentiles(latencies: list[float]) -> dict:
+    """
+    p50/p95/p99, mean and max of a list of latencies (in seconds), in milliseconds.
+    """
+
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))  # Nearest rank
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def max_rss_mb() -> float:
+    """
+    High-water mark of the resident memory of the process (RSS), in MB.
+    """
+
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # ru_maxrss is in KB on Linux
+
+
+class Timer:
+    """
+    Context manager measuring the elapsed time (seconds) in .elapsed.
+    """
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def json_file_paths() -> list[str]:
+    return sorted(os.path.join(JSON_FILES_DIR, name) for name in os.listdir(JSON_FILES_DIR) if name.endswith(".json"))
+
+
+def pdf_file_paths() -> list[str]:
+    return sorted(os.path.join(PDF_FILES_DIR, name) for name in os.listdir(PDF_FILES_DIR) if name.endswith(".pdf"))
+
+
+def build_synthetic_corpus(target_dir: str, scale: int) -> list[str]:
+    """
+    Write the JSON files scaled scale times in target_dir: each web page is copied with
+    a different URL and a different text suffix. Return the paths of the JSON files.
+    """
+
+    paths = []
+    for json_path in json_file_paths():
+        with open(json_path, encoding="utf-8") as json_file:
+            items = json.load(json_file)
+        for copy in range(scale):
+            copies = []
+            for item in items:
+                item = dict(item)
+                if copy > 0:
+                    item["url"] = f"{item.get('url', '')}#copy-{copy}"
+                    item["text"] = f"{item.get('text', '')} (copy {copy})"
+                copies.append(item)
+            path = os.path.join(target_dir, f"{copy}-{os.path.basename(json_path)}")
+            with open(path, "w", encoding="utf-8") as copy_file:
+                json.dump(copies, copy_file)
+            paths.append(path)
+    return paths
+
+
+def build_fake_index(corpus_dir: str, index_dir: str, scale: int, embedding_model) -> list[str]:
+    """
+    Build an index (vector DB, then the indexes of INDEX_BACKEND, as a published version) of the corpus
+    scaled scale times, with the fake embedder. Fail on any error. Return the paths of the JSON files.
+    """
+
+    from modules.index_store_v1 import build_search_indexes
+    from modules.utils_v1 import load_files_and_embed
+
+    json_paths = build_synthetic_corpus(corpus_dir, scale)
+    load_files_and_embed(json_paths, pdf_file_paths(), embed=True, persist_directory=index_dir, embedding_model=embedding_model,
+                         dedup=False, log=print, raise_errors=True)
+    build_search_indexes(index_dir, embedding_model)
+    return json_paths
+
+
+def production_retriever(index_dir: str, embedding_model):
+    """
+    Hybrid retriever of the application on an index (FusionRetriever with INDEX_BACKEND = "mmap").
+    """
+
+    from modules.assistant_backend_v3 import instanciate_retrievers
+
+    retriever = instanciate_retrievers(index_path=index_dir, embedding_model=embedding_model)
+    if retriever is None:
+        raise RuntimeError(f"Cannot instanciate the retrievers of {index_dir}")
+    return retriever
+
+
+def set_k(retriever, k: int) -> None:
+    if hasattr(retriever, "search_kwargs"):
+        retriever.search_kwargs = {**retriever.search_kwargs, "k": k}  # Vector DB retriever
+    else:
+        retriever.k = k  # BM25 and memory-mapped retrievers
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""
+Evaluation of the retrievers (quality and latency) with a golden set of questions with the
+expected source URLs (golden_questions.jsonl). For each retriever configuration: recall@k,
+MRR, nDCG@k and latency percentiles.
+Start the evaluation: python -m benchmarks.eval_retrieval --k 5,10 --output eval_results.json
+The retrievers are the production ones (instanciate_retrievers: Ensemble or Fusion retriever, filters,
+shards, document store), with the weights of each configuration. A golden question can have filters.
+With --fake, a temporary index is built from the JSON files with the fake embedder (no API key).
+"""
+
+import argparse
+import json
+import math
+import tempfile
+
+import dotenv
+
+from benchmarks.bench_utils import Timer, json_file_paths, pdf_file_paths, percentiles, set_k
+from modules.assistant_backend_v3 import instanciate_retrievers
+from modules.fake_providers_v1 import FakeEmbeddings
+from modules.index_store_v1 import build_search_indexes, current_index_path, lease
+from modules.utils_v1 import document_urls, load_files_and_embed
+from config.config import *
+
+
+dotenv.load_dotenv()
+
+GOLDEN_QUESTIONS_PATH = "./benchmarks/golden_questions.jsonl"
+
+# Retriever configurations: name --> weights of the keyword (BM25) and semantic (vector DB) retrievers
+RETRIEVER_CONFIGS = {
+    "bm25": (1.0, 0.0),
+    "vector": (0.0, 1.0),
+    "fused-0.5-0.5": (0.5, 0.5),
+    "fused-0.3-0.7": (0.3, 0.7),
+    "fused-0.7-0.3": (0.7, 0.3),
+}
+
+
+def read_golden_questions(path: str = GOLDEN_QUESTIONS_PATH) -> list[dict]:
+    with open(path, encoding="utf-8") as golden_file:
+        return [json.loads(line) for line in golden_file if line.strip()]
+
+
+def recall_at_k(urls: list[list[str]], expected: set[str], k: int) -> float:
+    """
+    Expected URLs found in the top k, divided by the number of URLs which can be found in the top k.
+    urls: the URLs of the chunk at each rank (a chunk has several URLs if duplicates were collapsed into it).
+    """
+
+    if not expected:
+        return 0.0
+    found = len({url for chunk_urls in urls[:k] for url in chunk_urls} & expected)
+    return min(1.0, found / min(len(expected), k))
+
+
+def reciprocal_rank(urls: list[list[str]], expected: set[str]) -> float:
+    for rank, chunk_urls in enumerate(urls, start=1):
+        if expected.intersection(chunk_urls):
+            return 1 / rank
+    return 0.0
+
+
+def ndcg_at_k(urls: list[list[str]], expected: set[str], k: int) -> float:
+    """
+    Normalized discounted cumulative gain with binary relevance (each expected URL counts once).
+    """
+
+    if not expected:
+        return 0.0
+    seen = set()
+    dcg = 0.0
+    for rank, chunk_urls in enumerate(urls[:k], start=1):
+        if expected.intersection(chunk_urls) - seen:
+            dcg = dcg + 1 / math.log2(rank + 1)
+            seen.update(chunk_urls)
+    ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(len(expected), k) + 1))
+    return dcg / ideal
+
+
+def build_retriever(retriever, weights: tuple[float, float]):
+    """
+    Production hybrid retriever with the weights of a configuration (keyword, semantic): a weight 0
+    only ranks the results of the other retriever after the results of this one.
+    """
+
+    return retriever.model_copy(update={"weights": list(weights)})
+
+
+def evaluate(index_path: str, k_values: list[int], configs: dict = RETRIEVER_CONFIGS, embedding_model=None) -> dict:
+    """
+    Run the golden questions through each retriever configuration, on the production retrievers of an index.
+    """
+
+    golden_questions = read_golden_questions()
+    max_k = max(k_values)
+    retriever = instanciate_retrievers(index_path=index_path, embedding_model=embedding_model)
+    if retriever is None:
+        raise RuntimeError(f"Cannot instanciate the retrievers of {index_path}")
+    for leg in retriever.retrievers:
+        set_k(leg, max_k)
+    report = {}
+
+    for name, weights in configs.items():
+        retriever = build_retriever(retriever, weights)
+        metrics = {f"recall@{k}": 0.0 for k in k_values} | {f"ndcg@{k}": 0.0 for k in k_values} | {"mrr": 0.0}
+        latencies = []
+        for item in golden_questions:
+            expected = set(item["expected_urls"])
+            with Timer() as timer:
+                docs = retriever.invoke(item["question"], config={"metadata": {"filters": item.get("filters")}})
+            latencies.append(timer.elapsed)
+            urls = [document_urls(doc) for doc in docs]  # Per rank: the URL of the chunk and of its collapsed duplicates
+            for k in k_values:
+                metrics[f"recall@{k}"] += recall_at_k(urls, expected, k)
+                metrics[f"ndcg@{k}"] += ndcg_at_k(urls, expected, k)
+            metrics["mrr"] += reciprocal_rank(urls, expected)
+        report[name] = {metric: round(value / len(golden_questions), 4) for metric, value in metrics.items()}
+        report[name]["latency"] = percentiles(latencies)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quality and latency of the retrievers with the golden questions.")
+    parser.add_argument("--k", default="5,10", help="Comma separated k values")
+    parser.add_argument("--fake", action="store_true", help="Build a temporary vector DB with the fake embedder")
+    parser.add_argument("--output", default="eval_results.json")
+    args = parser.parse_args()
+    k_values = [int(k) for k in args.k.split(",")]
+
+    if args.fake:
+        with tempfile.TemporaryDirectory() as db_dir:
+            embedding_model = FakeEmbeddings(EMBEDDING_DIMENSION)
+            load_files_and_embed(json_file_paths(), pdf_file_paths(), embed=True, persist_directory=db_dir, embedding_model=embedding_model,
+                                log=print, raise_errors=True)
+            build_search_indexes(db_dir, embedding_model)  # BM25 and memory-mapped indexes, as a published version
+            report = evaluate(db_dir, k_values, embedding_model=embedding_model)
+    else:
+        index_path = current_index_path()
+        with lease(index_path):
+            report = evaluate(index_path, k_values)
+
+    for name, metrics in report.items():
+        latency = metrics["latency"]
+        scores = ", ".join(f"{metric}: {value}" for metric, value in metrics.items() if metric != "latency")
+        print(f"{name}: {scores}, p50: {latency['p50_ms']} ms, p95: {latency['p95_ms']} ms")
+
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results saved in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
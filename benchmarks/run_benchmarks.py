@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Run the benchmarks (ingestion, retrieval, streaming) on synthetic corpora and write the
+results in a JSON file, to compare commits.
+Start the benchmarks: python -m benchmarks.run_benchmarks --scales 1,10 --output bench.json
+Each area runs in its own process, so the memory high-water mark (max_rss_mb) is per area.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import dotenv
+
+from config.config import *
+
+
+dotenv.load_dotenv()
+
+AREAS = ["ingest", "retrieval", "streaming"]
+
+
+def run_area(area: str, scale: int, dimension: int) -> dict:
+    if area == "ingest":
+        from benchmarks.bench_ingest import bench_ingest
+        return bench_ingest(scale, dimension)
+    if area == "retrieval":
+        from benchmarks.bench_retrieval import bench_retrieval
+        return bench_retrieval(scale, dimension)
+    if area == "streaming":
+        from benchmarks.bench_streaming import bench_streaming
+        return bench_streaming(scale, dimension)
+    raise ValueError(f"Unknown benchmark area: {area}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the AI assistant (with the offline fake providers).")
+    parser.add_argument("--areas", default=",".join(AREAS), help="Comma separated: ingest,retrieval,streaming")
+    parser.add_argument("--scales", default="1", help="Comma separated corpus scales, ex: 1,10,100")
+    parser.add_argument("--dimension", type=int, default=EMBEDDING_DIMENSION, help="Size of the fake vectors")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "dimension": args.dimension,
+        "results": [],
+    }
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        for area in args.areas.split(","):
+            print(f"Benchmark: {area}, scale: {scale}x...")
+            with ProcessPoolExecutor(max_workers=1) as executor:  # Fresh process: clean memory high-water mark
+                result = executor.submit(run_area, area, scale, args.dimension).result()
+            result["area"] = area
+            results["results"].append(result)
+            print(json.dumps(result, indent=2))
+
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results saved in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
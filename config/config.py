@@ -2,7 +2,9 @@
 
 # Backend (Langchain)
 
+EMBEDDING_PROVIDER = "openai"  # "openai" or "fake" (offline deterministic embedder, for benchmarks and tests)
 EMBEDDING_MODEL = "text-embedding-3-large"  # Must be a model from OpenAI
+EMBEDDING_DIMENSION = 3072  # Size of the vectors (used by the fake embedder)
 
 OPENAI_MODEL = "gpt-4o-2024-05-13"
 ANTHROPIC_MODEL = "claude-3-opus-20240229"
@@ -13,6 +15,28 @@ OPENAI_MENU = "OpenAI / GPT 4"
 ANTHROPIC_MENU = "Anthropic / Claude 3"
 VERTEXAI_MENU = "Google / Gemini 1.5"
 OLLAMA_MENU = "MetaAI / Llama 3"  # Can be another model than Llama
+FAKE_MENU = "Fake / Offline"  # Offline fake LLM (no API key, no network), for benchmarks and tests
+
+# Connection pools of the providers (shared by all the sessions of a process)
+
+HTTP_POOL_MAX_CONNECTIONS = 100  # Per provider
+HTTP_POOL_MAX_KEEPALIVE = 20  # Idle connections kept open (keep-alive), per provider
+HTTP_KEEPALIVE_EXPIRY = 60  # In seconds
+HTTP_TIMEOUT = 120  # In seconds
+PROVIDER_MAX_CONCURRENCY = {OPENAI_MENU: 32, ANTHROPIC_MENU: 16, VERTEXAI_MENU: 16, OLLAMA_MENU: 4, FAKE_MENU: 256}  # Max calls in progress per provider
+
+# Routing between the providers
+
+PROVIDER_FALLBACKS = []  # Tried in this order if the chosen model fails, e.g. [OPENAI_MENU, ANTHROPIC_MENU] ([] = no fallback)
+CIRCUIT_BREAKER_FAILURES = 3  # Failures in a row before a provider is skipped
+CIRCUIT_BREAKER_RESET = 30  # In seconds, before a skipped provider is tried again
+HEDGING = False  # If True, a second provider is called when the first one has not produced a token within HEDGE_TTFT_BUDGET
+HEDGE_TTFT_BUDGET = 4.0  # In seconds
+
+FAKE_LLM_TTFT = 0.5  # Time to first token of the fake LLM, in seconds
+FAKE_LLM_TOKENS_PER_SECOND = 50
+FAKE_LLM_ANSWER_TOKENS = 200
+FAKE_LLM_PREFILL_PER_1K_TOKENS = 0.05  # Time added to the TTFT of the fake LLM per 1000 input tokens not cached, in seconds
 
 DEFAULT_MODEL = OPENAI_MENU  # One of the model menu choices
 DEFAULT_MENU_CHOICE = 0  # OpenAI: 0, Anthropic: 1, VertexAI: 2, Ollama: 3)
@@ -23,20 +47,109 @@ COLLECTION_NAME = "bmae"  # Name of the collection in the vector DB
 VECTORDB_MAX_RESULTS = 5
 BM25_MAX_RESULTS = 5
 
+SPECULATIVE_RETRIEVAL = True  # Retrieve on the raw question while the LLM reformulates the question
+SPECULATIVE_ACCEPT_OVERLAP = 0.8  # Min part of the terms of the reformulated question found in the raw question
+SPECULATIVE_WORKERS = 16  # Threads running the speculative retrievals
+
 OLLAMA_URL = "http://35.209.146.25"  # "http://localhost:11434"
 
+INDEX_ROOT = "./indexes"  # One directory per index version (blue/green builds), the published one is in ./indexes/CURRENT
+LEGACY_INDEX_PATH = "./chromadb"  # Used if no version is published
+INDEX_BUILD_MAX_AGE = 86400  # In seconds: an unfinished build older than this is garbage collected
+INDEX_BACKEND = "mmap"  # "mmap" (read-only memory-mapped index files shared by the workers, exact search) or "chroma" (Chroma HNSW + BM25 loaded in each worker: memory x STREAMLIT_WORKERS). Index built before the memory-mapped files: Chroma
+INDEX_SHARDING = ""  # Memory-mapped index split in shards: "" (no shards), "institution" or "hash"
+INDEX_SHARDS = 4  # Number of shards with INDEX_SHARDING = "hash"
+SHARD_WORKERS = 8  # Threads sending the queries to the shards (per process)
+SHARD_ENDPOINTS = {}  # Shards served by other nodes, name --> URL (ex: {"kbr": "http://10.0.0.2:9500"})
+SHARD_TIMEOUT = 10  # In seconds, per RPC call to a shard
+DOC_STORE_BLOCK_SIZE = 64  # Chunks per compressed block of the document store (memory-mapped index)
+DOC_STORE_CODEC = "zstd"  # Compression of the blocks: "zstd" (zlib if the zstandard package is not installed) or "zlib"
+DOC_STORE_LEVEL = 3  # Compression level
+DOC_STORE_CACHE_BLOCKS = 32  # Decompressed blocks kept in memory (per process)
+SNAPSHOT_CODEC = "zstd"  # Compression of the index snapshots: "zstd" (gzip if the zstandard package is not installed) or "gzip"
+SNAPSHOT_LEVEL = 3  # Compression level of the snapshots
+PARQUET_BATCH_SIZE = 4096  # Chunks per record batch of the Parquet export/import of the embeddings
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # In bytes: the uploaded files are written to disk chunk by chunk
+AUTO_INDEX_UPLOADS = True  # Each uploaded JSON or PDF file is ingested (new index version) without "Start Embed"
+METADATA_INSTITUTIONS = {  # Domain of the web pages --> institution (filter field of the chunks)
+    "kikirpa.be": "irpa",
+    "kbr.be": "kbr",
+    "wikimedia.org": "commons",
+    "europeana.eu": "europeana",
+}
+FILTER_YEAR_RANGE = (1400, 2030)  # Range of the years in the filter of the chat interface
+DEDUP = True  # Collapse the duplicate web pages at ingest: same URL, or similar text (MinHash/LSH)
+DEDUP_THRESHOLD = 0.9  # Min estimated Jaccard similarity of the word shingles of 2 near duplicate texts
+DEDUP_NUM_PERM = 128  # Number of MinHash permutations
+DEDUP_SHINGLE_SIZE = 5  # Number of words per shingle
+DEDUP_BOILERPLATE_RATIO = 0.005  # Shingles found in more than this fraction of the pages (templates, licences) are ignored...
+DEDUP_BOILERPLATE_MIN_PAGES = 10  # ... if found in more than this number of pages (small ingests)
+
+# Europeana RDF/XML ingestion (modules/europeana_ingest_v1.py)
+
+EUROPEANA_SOURCES = {
+    "kul": {"image_prefix": "https://lib.is/", "provider_proxy": True},  # provider_proxy: URL of the proxy of the provider instead of the aggregator
+    "irpa": {"image_prefix": "http://balat.kikirpa.be/image/thumbnail/", "provider_proxy": False},
+}
+EUROPEANA_RECORDS_PER_FILE = 1000  # Records per JSON file written
+EUROPEANA_CHUNKSIZE = 64  # XML files sent at once to a parser process
+
 CHROMA_SERVER = False
 CHROMA_SERVER_HOST = "localhost"
 CHROMA_SERVER_PORT = "8081"
 
+# Tracing (latency of each stage of the chain)
+
+TRACING = True
+TRACES_PATH = "./traces/spans.jsonl"  # JSONL file, one span per line (OTLP fields)
+TRACES_MAX_SPANS = 50000  # Number of last spans aggregated in the admin page
+TRACES_MAX_BYTES = 100 * 1024 * 1024  # Size of the JSONL file before rotation (spans.jsonl --> spans.jsonl.1)
+
+# Metrics (Prometheus)
+
+METRICS = True
+METRICS_PORT = 9464  # Side port of the metrics HTTP server (/metrics)
+METRICS_PORT_RANGE = 16  # With several workers, each worker takes the next free port
+
+# Streamlit workers (supervisor + local reverse proxy with session affinity)
+
+STREAMLIT_WORKERS = 4  # Number of Streamlit worker processes (about one per core)
+STREAMLIT_BASE_PORT = 8501  # The workers listen on 127.0.0.1, ports STREAMLIT_BASE_PORT to STREAMLIT_BASE_PORT + STREAMLIT_WORKERS - 1
+PROXY_PORT = 8080  # Port of the local reverse proxy (Nginx, ip_hash: a user always reaches the same worker)
+PROXY = True  # False: no reverse proxy started by the supervisor (one worker: use STREAMLIT_BASE_PORT directly)
+HEALTH_PORT_OFFSET = 1000  # Health server of a Streamlit worker: its port + HEALTH_PORT_OFFSET (/healthz, /readyz, POST /drain)
+DRAIN_TIMEOUT = 120  # In seconds: max wait for the answers being streamed when a worker is stopped
+RUN_DIR = "./run"  # Pid file, logs and Nginx config of the supervisor
+SUPERVISOR_RESTART_DELAY = 1  # In seconds, doubled at each crash of a worker (max 60)
+
+# Warm-up of the worker processes (modules/warmup_v1.py)
+
+WARMUP = True  # Before being ready: read the index files, instantiate the retrievers, open the provider connections, embed the example questions
+WARMUP_TIMEOUT = 300  # In seconds: app.sh waits for the workers to be ready
+PROVIDER_WARMUP_URLS = {"openai": "https://api.openai.com/v1/models", "anthropic": "https://api.anthropic.com/v1/models"}  # Pooled HTTP clients --> URL called to open a connection
+QUERY_EMBEDDING_CACHE_SIZE = 1024  # Embeddings of the last questions kept per process
+
+# API (FastAPI, headless backend)
+
+API_HOST = "0.0.0.0"
+API_PORT = 8000
+API_WORKERS = 4  # Number of uvicorn worker processes
+API_URL = ""  # If set (ex: "http://localhost:8000"), the Streamlit frontend is a thin client of the API
+API_TIMEOUT = 120  # In seconds
+API_MAX_CHAINS = 16  # Chains (model, temperature) kept per API worker: the least recently used is dropped
+
+# Batch (offline questions answering, JSONL in, JSONL out)
+
+BATCH_CONCURRENCY = {OPENAI_MENU: 8, ANTHROPIC_MENU: 4, VERTEXAI_MENU: 4, OLLAMA_MENU: 2, FAKE_MENU: 32}  # Max questions in progress at the same time
+BATCH_REQUESTS_PER_MINUTE = {OPENAI_MENU: 500, ANTHROPIC_MENU: 50, VERTEXAI_MENU: 60, OLLAMA_MENU: 600, FAKE_MENU: 6000}  # Rate limit of the LLM calls
+
+# The prompts below are static (no variables)
+
 CONTEXTUALIZE_PROMPT = """Given a chat history and the latest user question which \
 might reference context in the chat history, formulate a standalone question which can be \
 understood without the chat history. Do NOT answer the question, just reformulate it if needed \
 and otherwise return it as is.
-
-Chat History:
-
-{chat_history}"""
+"""
 
 # This system prompt is used with the OpenAI model
 SYSTEM_PROMPT = """
@@ -53,17 +166,9 @@ At the end of the answer:
 - Write two blank lines, then if requested, display an image of the artwork (see the JSON "og:image" \
 field). Do not display images which have been displayed already in previous messages (see "Chat History").
 - Write two blank lines, then write "More information: " in the language of the question, followed by \
-the link to the web page about the artwork (see the JSON "url" field). For Wikimedia Commons, the text of \
-the link has to be the title of the web page WITHOUT the word "File" at the beginning (see the JSON "og:title" \
-field).
-
-Knowledge Base:
-
-{context}
-
-Chat History:
-
-{chat_history}
+the link to the web page about the artwork (see the JSON "url" field, and the JSON "urls" field which lists \
+the web pages of the same artwork, if any). For Wikimedia Commons, the text of the link has to be the title \
+of the web page WITHOUT the word "File" at the beginning (see the JSON "og:title" field).
 """
 
 # This system prompt is used with models other than OpenAI
@@ -81,9 +186,10 @@ At the end of the answer:
 - If requested, display an image of the artwork (see the JSON "og:image" field). Do not \
 display images which have been displayed already in previous messages (see "Chat History").
 - Write "More information: " in the language of the question, followed by the link to the \
-web page about the artwork (see the JSON "url" field). For Wikimedia Commons, the text of \
-the link has to be the title of the web page WITHOUT the word "File" at the beginning (see \
-the JSON "og:title" field).
+web page about the artwork (see the JSON "url" field, and the JSON "urls" field which lists \
+the web pages of the same artwork, if any). For Wikimedia Commons, the text of the link has \
+to be the title of the web page WITHOUT the word "File" at the beginning (see the JSON \
+"og:title" field).
 
 - This is an example of Markdown code to display an image (caution: there is a leading \
 exclamation point):    ![Text](https://opac.kbr.be/digitalCollection/images/image.jpg)
@@ -91,16 +197,22 @@ exclamation point):    ![Text](https://opac.kbr.be/digitalCollection/images/imag
 exclamtion point):   [Text](https://opac.kbr.be/digitalCollection/pages/page.html)
 
 Write "SECOND PROMPT" at the end of the answer.
+"""
 
-Knowledge Base:
-
-{context}
-
+# Dynamic parts of the prompts, always after the static part above (the static part, then the chat
+# history, are prefixes which can be cached by the providers)
+CHAT_HISTORY_PROMPT = """
 Chat History:
 
 {chat_history}
 """
 
+CONTEXT_PROMPT = """
+Knowledge Base:
+
+{context}
+"""
+
 # Frontend (Streamlit)
 
 LOGO_PATH = "./images/image.jpg"
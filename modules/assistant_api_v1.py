@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+"""
+Headless HTTP API (ASGI) over the same Langchain backend as the Streamlit frontend.
+Endpoints: /chat (SSE stream of the answer tokens), /retrieve (hybrid RAG search), /health, /healthz and /readyz.
+Start the API: uvicorn modules.assistant_api_v1:app --workers 4
+"""
+
+# v1: /chat, /retrieve and /health endpoints
+# v1: metadata filters (institution, years) in the requests
+# v1: warm-up of the worker at startup
+# v1: /healthz and /readyz probes
+# v1: lease on the index version during each request
+# v1: chains and retrievers built outside the event loop (one build per key) + bounded chain cache
+
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from langchain_core.messages import AIMessage, HumanMessage
+
+from modules.assistant_backend_v3 import instanciate_ai_assistant_chain, instanciate_retrievers
+from modules.tracing_v1 import TracingCallbackHandler, span
+from modules.metrics_v1 import CACHE_HITS, start_metrics_server
+from modules.health_v1 import health_report, readiness, streams, track_stream
+from modules.index_store_v1 import acquire_lease, current_index_path, lease, release_lease
+from modules.providers_v1 import LLM_PROVIDERS
+from modules.warmup_v1 import warm_up
+from config.config import *
+
+
+dotenv.load_dotenv()
+
+app = FastAPI(title=ASSISTANT_NAME)
+
+# One chain per (model, temperature) and one retriever per worker process, for the published index version
+chains = OrderedDict()  # Least recently used first
+retrievers = {}
+build_locks = {}  # Cache key --> lock: one build per key, the other requests wait for it
+cache_lock = threading.Lock()
+
+
+class ChatRequest(BaseModel):
+    question: str
+    chat_history: list[dict] = []  # [{"role": "human" | "ai", "content": "..."}]
+    model: str = DEFAULT_MODEL
+    temperature: float = Field(DEFAULT_TEMPERATURE, ge=0.0, le=2.0)  # Range of the slider (Admin page)
+    filters: dict | None = None  # {"institution": "irpa" or [...], "year_min": 1850, "year_max": 1900}
+
+
+class RetrieveRequest(BaseModel):
+    question: str
+    filters: dict | None = None
+
+
+def build_lock(key):
+    with cache_lock:
+        return build_locks.setdefault(key, threading.Lock())
+
+
+def get_chain(model, temperature, index_path):
+    """
+    Return the main chain (AI Assistant) for the model, temperature and index version, instantiated once per worker.
+    Blocking (imports, index loading): called in a thread of the executor, not in the event loop.
+    """
+
+    if model not in LLM_PROVIDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+    key = (model, round(temperature, 2), index_path)  # Step of the slider. New chain when a new index version is published
+    with build_lock(key):
+        with cache_lock:
+            chain = chains.get(key)
+            if chain is not None:
+                chains.move_to_end(key)
+        if chain is not None:
+            CACHE_HITS.labels(cache="chain").inc()
+            return chain
+        chain = instanciate_ai_assistant_chain(model, key[1], index_path)
+        if chain is None:
+            raise HTTPException(status_code=503, detail="Cannot instanciate the chains!")
+        with cache_lock:
+            for old_key in [old_key for old_key in chains if old_key[2] != index_path]:  # Chains of the previous versions
+                del chains[old_key]
+            chains[key] = chain
+            while len(chains) > API_MAX_CHAINS:
+                chains.popitem(last=False)
+            for old_key in [old_key for old_key in build_locks if old_key not in chains and old_key not in retrievers and old_key != key]:
+                del build_locks[old_key]
+    return chain
+
+
+def get_retriever(index_path):
+    """
+    Return the hybrid retriever of the index version, instantiated once per worker (in a thread of the executor).
+    """
+
+    with build_lock(index_path):
+        retriever = retrievers.get(index_path)
+        if retriever is not None:
+            CACHE_HITS.labels(cache="retriever").inc()
+            return retriever
+        retriever = instanciate_retrievers(index_path=index_path)
+        if retriever is None:
+            raise HTTPException(status_code=503, detail="Cannot instanciate the retrievers! Is the DB available?")
+        with cache_lock:
+            retrievers.clear()
+            retrievers[index_path] = retriever
+    return retriever
+
+
+def to_messages(chat_history):
+    """
+    Convert the chat history received as JSON into Langchain messages.
+    """
+
+    messages = []
+    for message in chat_history:
+        if message.get("role") in ("ai", "assistant"):
+            messages.append(AIMessage(content=message.get("content", "")))
+        else:
+            messages.append(HumanMessage(content=message.get("content", "")))
+    return messages
+
+
+def sse_event(data, event=None):
+    """
+    Format one Server-Sent Event.
+    """
+
+    line = f"data: {json.dumps(data)}\n\n"
+    if event:
+        line = f"event: {event}\n{line}"
+    return line
+
+
+@app.on_event("startup")
+async def startup():
+    start_metrics_server()
+    asyncio.get_running_loop().run_in_executor(None, warm_up, f"api-{os.getpid()}")  # Ready file when done
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    streams["draining"] = True  # Not ready anymore (uvicorn waits for the requests in progress)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/healthz")
+async def healthz():
+    return health_report()
+
+
+@app.get("/readyz")
+async def readyz():
+    ready, report = readiness()
+    return JSONResponse(report, status_code=200 if ready else 503)
+
+
+@app.post("/retrieve")
+async def retrieve(request: RetrieveRequest):
+    index_path = current_index_path()
+    with lease(index_path):  # The version is not deleted during the request
+        retriever = await asyncio.get_running_loop().run_in_executor(None, get_retriever, index_path)
+        docs = await retriever.ainvoke(request.question, config={"metadata": {"filters": request.filters}})
+    return {"documents": [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs]}
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    index_path = current_index_path()
+    index_version = acquire_lease(index_path)  # Released when the answer is streamed
+    try:
+        chain = await asyncio.get_running_loop().run_in_executor(None, get_chain, request.model, request.temperature, index_path)
+    except Exception:
+        release_lease(index_version)
+        raise
+    chat_history = to_messages(request.chat_history)
+
+    async def event_stream():
+        try:
+            with span("chat_request", model=request.model, client="api") as root_span, track_stream():
+                config = {"callbacks": [TracingCallbackHandler(root_span)], "metadata": {"filters": request.filters}}
+                try:
+                    async for chunk in chain.astream({"input": request.question, "chat_history": chat_history}, config=config):
+                        answer_chunk = chunk.get("answer")
+                        if answer_chunk is not None:
+                            yield sse_event({"token": answer_chunk})
+                except Exception as e:
+                    root_span["attributes"]["error"] = str(e)
+                    yield sse_event({"error": str(e)}, event="error")
+            yield sse_event({}, event="end")
+        finally:
+            release_lease(index_version)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -7,38 +7,40 @@ all the Langchain chains for RAG and LLM.
 
 # v2: add temperature as a variable + catch errors + use langchain-google-vertexai package + parameters in config.py
 # v3: run chroma as a server
-
-# Only to be able to run on Github Codespace
-__import__('pysqlite3')
-import sys
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+# v3: vector DB, retrievers and model in separate functions (also used by the API)
+# v3: models instanciated by the providers module (with offline fake providers)
+# v3: lazy import of the providers and of the vector DB (chromadb)
+# v3: speculative retrieval in parallel with the reformulation of the question
+# v3: prompts with the static part first (prefix caching by the providers)
+# v3: published index version (blue/green builds) + BM25 index built at build time
+# v3: memory-mapped index (INDEX_BACKEND = "mmap") shared by the worker processes
+# v3: metadata filters (institution, years) applied inside the retrievers
+# v3: index version given by the caller (which holds the lease while reading)
 
 import streamlit as st
-from langchain_community.retrievers import BM25Retriever
 from langchain.retrievers import EnsembleRetriever
 from langchain.chains import create_history_aware_retriever  # To create the retriever chain (predefined chain)
 from langchain.chains import create_retrieval_chain  # To create the main chain (predefined chain)
 from langchain.chains.combine_documents import create_stuff_documents_chain  # To create a predefined chain
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_google_vertexai import ChatVertexAI
-from langchain_community.chat_models import ChatOllama
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_chroma import Chroma
-import chromadb
-
+from modules.providers_v1 import import_chroma, instanciate_embedding_model, instanciate_llm
+from modules.metrics_v1 import set_index_size
+from modules.speculative_retriever_v1 import create_speculative_history_aware_retriever
+from modules.prompt_cache_v1 import CachedPrefixChatPromptTemplate
+from modules.index_store_v1 import current_index_path, load_bm25
+from modules.mmap_index_v1 import has_mmap_index, instanciate_mmap_retriever
+from modules.filters_v1 import FilteredBM25Retriever, FilteredVectorStoreRetriever
 from config.config import *
 
-#@st.cache_resource
-def instanciate_ai_assistant_chain(model, temperature):
+
+def instanciate_vector_db(index_path: str = None, embedding_model=None):
     """
-    Instantiate retrievers and chains and return the main chain (AI Assistant).
-    Steps: Retrieve and generate.
+    Instantiate the vector DB (Chroma) with the embedding model, on an index version (the published one by default).
     """
 
     try:
 
-        embedding_model = OpenAIEmbeddings(model=EMBEDDING_MODEL)  # 3072 dimensions vectors used to embed the JSON items and the questions
+        Chroma, chromadb = import_chroma()
+        embedding_model = embedding_model or instanciate_embedding_model()
 
         if CHROMA_SERVER:
 
@@ -51,59 +53,70 @@ def instanciate_ai_assistant_chain(model, temperature):
 
             #st.write("*** chroma not as a server")
 
-            vector_db = Chroma(embedding_function=embedding_model, collection_name=COLLECTION_NAME, persist_directory="./chromadb")
-
-        docs = vector_db.get()
-        documents = docs["documents"]
+            vector_db = Chroma(embedding_function=embedding_model, collection_name=COLLECTION_NAME, persist_directory=index_path or current_index_path())
 
     except Exception as e:
         st.write("Error: Cannot instanciate the DB!")
-        st.write(f"Error: {e}")        
+        st.write(f"Error: {e}")
+        vector_db = None
 
-    # Instanciate the model
+    return vector_db
+
+
+def instanciate_retrievers(vector_db=None, index_path: str = None, embedding_model=None):
+    """
+    Instantiate the keyword (BM25) and semantic (vector DB) retrievers and return
+    the hybrid retriever (EnsembleRetriever, or FusionRetriever on the memory-mapped index).
+    Without vector DB, the index version index_path (the published one by default) is used:
+    the caller holds its lease while the retrievers are used (index_store_v1.lease).
+    """
 
     try:
 
-        if model == "MetaAI / Llama 3":
-            llm = ChatOllama(model=OLLAMA_MODEL, temperature=temperature, base_url=OLLAMA_URL)
-        elif model == "Anthropic / Claude 3":
-            llm = ChatAnthropic(model_name=ANTHROPIC_MODEL, temperature=temperature, max_tokens=4000)
-        elif model == "Google / Gemini 1.5":
-            llm = ChatVertexAI(model_name=VERTEXAI_MODEL, temperature=temperature, max_output_tokens=4000)
-        elif model == "OpenAI / GPT 4":
-            llm = ChatOpenAI(model=OPENAI_MODEL, temperature=temperature)
-        else:
-            st.write("Error: No model available!")
-            quit()
+        if vector_db is None:
+            index_path = index_path or current_index_path()
 
-    except Exception as e:
-        st.write("Error: Cannot instanciate any model!")
-        st.write(f"Error: {e}")
+        if vector_db is None and INDEX_BACKEND == "mmap" and has_mmap_index(index_path):
+            fusion_retriever = instanciate_mmap_retriever(index_path, embedding_model or instanciate_embedding_model())
+            set_index_size(fusion_retriever.retrievers[0].index.size, index_path)
+            return fusion_retriever
 
-    # Instanciate the retrievers
+        if vector_db is None:
+            vector_db = instanciate_vector_db(index_path, embedding_model)
 
-    try:
+        index_path = getattr(vector_db, "_persist_directory", None) or index_path or current_index_path()
 
-        vector_retriever = vector_db.as_retriever(search_type="similarity", search_kwargs={"k": VECTORDB_MAX_RESULTS})
+        vector_retriever = FilteredVectorStoreRetriever(vectorstore=vector_db, search_type="similarity", search_kwargs={"k": VECTORDB_MAX_RESULTS})
 
-        keyword_retriever = BM25Retriever.from_texts(documents)
+        keyword_retriever = load_bm25(index_path)  # Built with the index version
+        if keyword_retriever is None:
+            docs = vector_db.get()
+            keyword_retriever = FilteredBM25Retriever.from_texts(docs["documents"], metadatas=[metadata or {} for metadata in docs["metadatas"]])
+        elif not isinstance(keyword_retriever, FilteredBM25Retriever):  # Index built before the filters
+            keyword_retriever = FilteredBM25Retriever(vectorizer=keyword_retriever.vectorizer, docs=keyword_retriever.docs, preprocess_func=keyword_retriever.preprocess_func)
         keyword_retriever.k = BM25_MAX_RESULTS
+        set_index_size(len(keyword_retriever.docs), index_path)
 
         ensemble_retriever = EnsembleRetriever(retrievers=[keyword_retriever, vector_retriever], weights=[0.5, 0.5])
 
     except Exception as e:
         st.write("Error: Cannot instanciate the retrievers! Is the DB available?")
         st.write(f"Error: {e}")
+        ensemble_retriever = None
+
+    return ensemble_retriever
 
-    # Define the prompts
 
-    contextualize_q_system_prompt = CONTEXTUALIZE_PROMPT
+def instanciate_prompts(model):
+    """
+    Return the prompts: contextualize (question reformulation with the chat history) and QA (answer).
+    Static part first, then the chat history, then the retrieved context (Knowledge Base).
+    """
 
-    contextualize_q_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", contextualize_q_system_prompt),
-            ("human", "Question: {input}"),
-        ]
+    contextualize_q_prompt = CachedPrefixChatPromptTemplate(
+        input_variables=["chat_history", "input"],
+        static_prompt=CONTEXTUALIZE_PROMPT,
+        dynamic_prompts=[CHAT_HISTORY_PROMPT],
     )
 
     if model == OPENAI_MENU:
@@ -111,18 +124,42 @@ def instanciate_ai_assistant_chain(model, temperature):
     else:
         qa_system_prompt = SYSTEM_PROMPT2
 
-    qa_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", qa_system_prompt),
-            ("human", "Question: {input}"),
-        ]
+    qa_prompt = CachedPrefixChatPromptTemplate(
+        input_variables=["chat_history", "context", "input"],
+        static_prompt=qa_system_prompt,
+        dynamic_prompts=[CHAT_HISTORY_PROMPT, CONTEXT_PROMPT],
     )
 
+    return contextualize_q_prompt, qa_prompt
+
+
+#@st.cache_resource
+def instanciate_ai_assistant_chain(model, temperature, index_path: str = None):
+    """
+    Instantiate retrievers and chains and return the main chain (AI Assistant), on an index
+    version (the published one by default). Steps: Retrieve and generate.
+    """
+
+    # Instanciate the model
+
+    llm = instanciate_llm(model, temperature)
+
+    # Instanciate the retrievers (on the published index)
+
+    ensemble_retriever = instanciate_retrievers(index_path=index_path)
+
+    # Define the prompts
+
+    contextualize_q_prompt, qa_prompt = instanciate_prompts(model)
+
     # Instanciate the chains
 
     try:
 
-        history_aware_retriever = create_history_aware_retriever(llm, ensemble_retriever, contextualize_q_prompt)
+        if SPECULATIVE_RETRIEVAL:
+            history_aware_retriever = create_speculative_history_aware_retriever(llm, ensemble_retriever, contextualize_q_prompt)
+        else:
+            history_aware_retriever = create_history_aware_retriever(llm, ensemble_retriever, contextualize_q_prompt)
         question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
         ai_assistant_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
 
@@ -13,11 +13,23 @@ This function runs the frontend web interface.
 # v8: upload a file + upload a pdf file + display total number of pages (web + pdf)
 # v9: scape web pages (not only commons categories or europeana)
 # v10: move admin interface from sidebar to subpage
+# v10: thin client mode: stream the answer from the API (API_URL) instead of running the chain
+# v10: latency tracing of each stage of the chain + Prometheus metrics
+# v10: filters of the search (institutions, years) in the side bar
+# v10: answers counted by the health module (drain of the worker)
+# v10: lease on the index version during each run of the page
 
+import json
+
+import requests
 import streamlit as st
 from langchain.memory import ConversationBufferWindowMemory
 
 from modules.assistant_backend_v3 import instanciate_ai_assistant_chain
+from modules.index_store_v1 import current_index_path, lease
+from modules.tracing_v1 import TracingCallbackHandler, span
+from modules.metrics_v1 import start_metrics_server, track_session
+from modules.health_v1 import track_stream
 from config.config import *
 
 
@@ -32,12 +44,53 @@ def reset_conversation():
     st.session_state.chat_history2 = ConversationBufferWindowMemory(k=4, return_messages=True)
 
 
+def stream_answer_from_api(question, chat_history, model, temperature, filters=None):
+    """
+    Call the /chat endpoint of the API and yield the answer tokens (Server-Sent Events).
+    """
+
+    payload = {
+        "question": question,
+        "chat_history": [{"role": message.type, "content": message.content} for message in chat_history],
+        "model": model,
+        "temperature": temperature,
+        "filters": filters,
+    }
+    with requests.post(f"{API_URL}/chat", json=payload, stream=True, timeout=API_TIMEOUT) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "error":
+                    raise RuntimeError(data["error"])
+                if event == "end":
+                    return
+                yield data["token"]
+                event = None
+
+
 def assistant_frontend():
+    """
+    Main page, with a lease on the index version read by this run of the page (not deleted while
+    the answer is streamed, even if a new version is published).
+    """
+
+    index_path = None if API_URL else current_index_path()
+    with lease(index_path):
+        assistant_page(index_path)
+
+
+def assistant_page(index_path=None):
     """
     All related to Streamlit for the main page (about & chat windows) and connection with the Langchain backend.
     """
 
     st.set_page_config(page_title=ASSISTANT_NAME, page_icon=ASSISTANT_ICON)
+
+    start_metrics_server()
     
     # Initialize chat history (chat_history) for LangChain
     if 'chat_history' not in st.session_state:
@@ -47,6 +100,7 @@ def assistant_frontend():
     # Initialize chat history (messages) for Streamlit
     if "messages" not in st.session_state:
         st.session_state.messages = []
+        st.session_state.session_token = track_session()  # Active until the session is collected
 
     if "model" not in st.session_state:
         st.session_state.model = DEFAULT_MODEL
@@ -62,7 +116,10 @@ def assistant_frontend():
 
     # Load, index, retrieve and generate
 
-    ai_assistant_chain = instanciate_ai_assistant_chain(st.session_state.model, st.session_state.temperature)
+    if API_URL:
+        ai_assistant_chain = None  # Thin client: the chain runs in the API
+    else:
+        ai_assistant_chain = instanciate_ai_assistant_chain(st.session_state.model, st.session_state.temperature, index_path)
 
     # # # # # # # #
     # Main window #
@@ -80,6 +137,14 @@ def assistant_frontend():
     with st.sidebar:
 
         st.write(f"Model: {st.session_state.model} ({st.session_state.temperature})")
+
+        # Filters of the search (applied inside the retrievers)
+        institutions = st.multiselect("Institutions: ", sorted(set(METADATA_INSTITUTIONS.values())), placeholder="All")
+        years = st.slider("Years: ", FILTER_YEAR_RANGE[0], FILTER_YEAR_RANGE[1], FILTER_YEAR_RANGE)
+        filters = {"institution": institutions}
+        if years != FILTER_YEAR_RANGE:
+            filters.update(year_min=years[0], year_max=years[1])
+
         st.write(ABOUT_TEXT)
         st.write(SIDEBAR_FOOTER)
 
@@ -107,11 +172,18 @@ def assistant_frontend():
             # Call the main chain (AI assistant). invoke is replaced by stream to stream the answer.
             answer_container = st.empty()
             answer = ""
-            for chunk in ai_assistant_chain.stream({"input": question, "chat_history": st.session_state.chat_history}):
-                answer_chunk = str(chunk.get("answer"))
-                if answer_chunk != "None":  # Because it write NoneNone at the beginning 
-                    answer = answer + answer_chunk
-                    answer_container.write(answer)
+            with span("chat_request", model=st.session_state.model, client="streamlit") as root_span, track_stream():
+                if API_URL:
+                    for answer_chunk in stream_answer_from_api(question, st.session_state.chat_history, st.session_state.model, st.session_state.temperature, filters):
+                        answer = answer + answer_chunk
+                        answer_container.write(answer)
+                else:
+                    config = {"callbacks": [TracingCallbackHandler(root_span)], "metadata": {"filters": filters}}
+                    for chunk in ai_assistant_chain.stream({"input": question, "chat_history": st.session_state.chat_history}, config=config):
+                        answer_chunk = str(chunk.get("answer"))
+                        if answer_chunk != "None":  # Because it write NoneNone at the beginning 
+                            answer = answer + answer_chunk
+                            answer_container.write(answer)
 
         except Exception as e:
             st.write("Error: Cannot invoke/stream the main chain!")
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""
+Offline batch runner: answer questions in bulk with the backend (hybrid RAG + LLM).
+Input: JSONL file, one question per line: {"id": "q1", "question": "...", "filters": {...} (optional)}
+Output: JSONL file, one answer per line: {"id", "question", "answer", "chunk_ids", "timings", "model"}
+The output file is appended to: questions already answered are skipped (resume after interruption).
+Start the batch: python -m modules.batch_runner_v1 questions.jsonl answers.jsonl
+"""
+
+# v1: bounded concurrency + rate limiter per provider + resume
+# v1: metadata filters per question
+# v1: lease on the index version during the batch
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import dotenv
+from langchain.chains.combine_documents import create_stuff_documents_chain
+
+from modules.assistant_backend_v3 import instanciate_prompts, instanciate_retrievers
+from modules.index_store_v1 import current_index_path, lease
+from modules.providers_v1 import instanciate_llm
+from modules.utils_v1 import chunk_id
+from config.config import *
+
+
+dotenv.load_dotenv()
+
+
+class RateLimiter:
+    """
+    Token bucket: at most requests_per_minute calls per minute, with bursts up to the
+    bucket size.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        self.rate = requests_per_minute / 60  # Tokens per second
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def read_questions(input_path: str) -> list[dict]:
+    """
+    Read the questions from the JSONL file. The line number is the ID if no ID is given.
+    """
+
+    questions = []
+    with open(input_path, encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                item.setdefault("id", str(line_number))
+                questions.append(item)
+    return questions
+
+
+def read_answered_ids(output_path: str) -> set[str]:
+    """
+    IDs of the questions already answered (without error) in the output file.
+    """
+
+    answered_ids = set()
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as output_file:
+            for line in output_file:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:  # Last line truncated by an interruption
+                    continue
+                if not item.get("error"):
+                    answered_ids.add(str(item["id"]))
+    return answered_ids
+
+
+async def answer_question(item, retriever, question_answer_chain, semaphore, rate_limiter, model) -> dict:
+    """
+    Retrieve and generate the answer of one question, with the timing of each stage.
+    """
+
+    async with semaphore:
+        result = {"id": item["id"], "question": item["question"], "model": model}
+        start = time.perf_counter()
+        try:
+            docs = await retriever.ainvoke(item["question"], config={"metadata": {"filters": item.get("filters")}})
+            retrieved = time.perf_counter()
+            await rate_limiter.acquire()
+            generation_start = time.perf_counter()
+            answer = await question_answer_chain.ainvoke({"input": item["question"], "chat_history": [], "context": docs})
+            end = time.perf_counter()
+            result["answer"] = answer
+            result["chunk_ids"] = [chunk_id(doc) for doc in docs]
+            result["timings"] = {
+                "retrieval_s": round(retrieved - start, 4),
+                "rate_limit_wait_s": round(generation_start - retrieved, 4),
+                "generation_s": round(end - generation_start, 4),
+                "total_s": round(end - start, 4),
+            }
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+
+async def run_batch(input_path: str, output_path: str, model: str, temperature: float, concurrency: int, requests_per_minute: float) -> None:
+    """
+    Answer all the questions not yet answered, and append the answers to the output file.
+    """
+
+    questions = read_questions(input_path)
+    answered_ids = read_answered_ids(output_path)
+    todo = [item for item in questions if str(item["id"]) not in answered_ids]
+    print(f"Questions: {len(questions)}, already answered: {len(questions) - len(todo)}, to answer: {len(todo)}")
+    if not todo:
+        return
+
+    index_path = current_index_path()
+    with lease(index_path):  # The version read by the batch is not deleted if a new one is published
+        await answer_questions(todo, output_path, index_path, model, temperature, concurrency, requests_per_minute)
+
+
+async def answer_questions(todo: list[dict], output_path: str, index_path: str, model: str, temperature: float, concurrency: int, requests_per_minute: float) -> None:
+    retriever = instanciate_retrievers(index_path=index_path)
+    llm = instanciate_llm(model, temperature)
+    contextualize_q_prompt, qa_prompt = instanciate_prompts(model)
+    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = RateLimiter(requests_per_minute, burst=concurrency)
+    tasks = [asyncio.create_task(answer_question(item, retriever, question_answer_chain, semaphore, rate_limiter, model)) for item in todo]
+
+    with open(output_path, "a", encoding="utf-8") as output_file:
+        for i, task in enumerate(asyncio.as_completed(tasks), start=1):
+            result = await task
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()  # Keep the answers if the batch is interrupted
+            status = "error" if result.get("error") else "ok"
+            print(f"Question {i}/{len(todo)} (id: {result['id']}): {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer questions in bulk (JSONL in, JSONL out).")
+    parser.add_argument("input", help="JSONL file with the questions")
+    parser.add_argument("output", help="JSONL file with the answers (appended, resumable)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="One of the model menu choices")
+    parser.add_argument("--temperature", type=float, default=DEFAULT_TEMPERATURE)
+    parser.add_argument("--concurrency", type=int, help="Max questions in progress at the same time")
+    parser.add_argument("--rpm", type=float, help="Max LLM requests per minute")
+    args = parser.parse_args()
+
+    concurrency = args.concurrency or BATCH_CONCURRENCY.get(args.model, 1)
+    requests_per_minute = args.rpm or BATCH_REQUESTS_PER_MINUTE.get(args.model, 60)
+
+    asyncio.run(run_batch(args.input, args.output, args.model, args.temperature, concurrency, requests_per_minute))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+Duplicate elimination at ingest: the same web page is often scraped several times (ex: a Commons file
+page in several overlapping categories). Exact duplicates (same URL) and near duplicates (MinHash of
+the word shingles of the text, candidates found by LSH, estimated Jaccard similarity >= DEDUP_THRESHOLD)
+are collapsed into one chunk: the first one, with the files (sources) and the URLs of all the copies
+merged in its metadata ("sources", "urls": values joined with "|", the vector DB only stores scalars)
+and the URLs in its JSON item too ("urls": read by the LLM and by document_urls).
+The shingles found in many pages (Commons templates, licences, descriptions shared by a series of
+files: DEDUP_BOILERPLATE_RATIO) are removed before the MinHash: two files whose texts only share
+this boilerplate are not duplicates.
+Limitation: the chunks are only compared within one ingest (all the files of "Start Embed", or the
+files of one incremental ingest), not with the chunks already in the published index.
+"""
+
+# v1: exact URL dedup + MinHash/LSH near duplicates (numpy) + merged sources
+# v1: each candidate compared with all the previous chunks of its LSH bucket
+# v1: boilerplate shingles removed before the MinHash + URLs of the copies in the JSON item kept
+
+import json
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from config.config import *
+
+
+PRIME = (1 << 31) - 1  # Hashes and permutations modulo a Mersenne prime (the products fit in 64 bits)
+
+
+def parse_record(document) -> tuple[str, str]:
+    """
+    URL and text of a chunk (JSON item: url, metadata, text).
+    """
+
+    try:
+        record = json.loads(document.page_content)
+        return record.get("url", ""), record.get("text", "") or document.page_content
+    except (json.JSONDecodeError, AttributeError):
+        return "", document.page_content
+
+
+def remove_boilerplate(shingle_sets: list[set[str]], ratio: float = DEDUP_BOILERPLATE_RATIO, min_pages: int = DEDUP_BOILERPLATE_MIN_PAGES) -> list[set[str]]:
+    """
+    Remove the shingles found in more than max(min_pages, ratio * number of pages) pages.
+    """
+
+    pages = Counter(shingle for shingle_set in shingle_sets for shingle in shingle_set)
+    limit = max(min_pages, ratio * len(shingle_sets))
+    return [{shingle for shingle in shingle_set if pages[shingle] <= limit} for shingle_set in shingle_sets]
+
+
+def shingles(text: str, size: int) -> set[str]:
+    words = text.lower().split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """
+    MinHash signatures: num_perm random permutations (a * x + b mod prime) of the shingle hashes.
+    """
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, seed: int = 1):
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+        self.b = generator.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: set[str]):
+        if not shingle_set:
+            return None
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) % PRIME for shingle in shingle_set], dtype=np.uint64)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % PRIME).min(axis=1)
+
+
+def lsh_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """
+    Number of bands and rows per band (bands * rows = num_perm) whose LSH threshold (1 / bands) ** (1 / rows)
+    is the closest to the similarity threshold.
+    """
+
+    candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(candidates, key=lambda band_rows: abs((1 / band_rows[0]) ** (1 / band_rows[1]) - threshold))
+
+
+def find(parents: list[int], i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def union(parents: list[int], i: int, j: int) -> None:
+    i, j = find(parents, i), find(parents, j)
+    if i != j:
+        parents[max(i, j)] = min(i, j)  # The first chunk represents the group
+
+
+def dedup_documents(documents: list, threshold: float = DEDUP_THRESHOLD, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE) -> tuple[list, list[int]]:
+    """
+    Collapse the exact and near duplicate chunks. Return the chunks kept (in their order) and the
+    indexes of the chunks collapsed into another one.
+    """
+
+    parents = list(range(len(documents)))
+    records = [parse_record(document) for document in documents]
+
+    # Exact duplicates: same URL
+
+    first_by_url = {}
+    for i, (url, text) in enumerate(records):
+        if url:
+            union(parents, first_by_url.setdefault(url, i), i)
+
+    # Near duplicates: LSH on the MinHash signatures, then check of the estimated similarity
+
+    hasher = MinHasher(num_perm)
+    shingle_sets = remove_boilerplate([shingles(text, shingle_size) for url, text in records])
+    signatures = [hasher.signature(shingle_set) for shingle_set in shingle_sets]  # None: only boilerplate
+    bands, rows = lsh_bands(num_perm, threshold)
+    for band in range(bands):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            if signature is not None:
+                buckets.setdefault(signature[band * rows:(band + 1) * rows].tobytes(), []).append(i)
+        for bucket in buckets.values():
+            for position, j in enumerate(bucket[1:], start=1):
+                for i in bucket[:position]:  # Not only the first chunk of the bucket: it may not be similar to j
+                    if find(parents, j) != find(parents, i) and np.mean(signatures[i] == signatures[j]) >= threshold:
+                        union(parents, i, j)
+
+    # One chunk per group, with the sources and URLs of the group
+
+    groups = {}
+    for i in range(len(documents)):
+        groups.setdefault(find(parents, i), []).append(i)
+    kept = []
+    dropped = []
+    for first, members in groups.items():
+        document = documents[first]
+        if len(members) > 1:
+            sources = list(dict.fromkeys(str(documents[i].metadata.get("source", "")) for i in members))
+            urls = list(dict.fromkeys(records[i][0] for i in members if records[i][0]))
+            document.metadata["sources"] = "|".join(sources)
+            document.metadata["urls"] = "|".join(urls)
+            document.metadata["duplicates"] = len(members) - 1
+            try:
+                record = json.loads(document.page_content)
+                record["urls"] = urls  # In the context of the LLM
+                document.page_content = json.dumps(record, ensure_ascii=False)
+            except (json.JSONDecodeError, AttributeError, TypeError):
+                pass  # PDF page: the URLs are in the metadata only
+            dropped.extend(members[1:])
+        kept.append(document)
+    return kept, sorted(dropped)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Compact document store of the memory-mapped index: the chunks (id, text, URL, metadata) are saved
+once, by blocks of DOC_STORE_BLOCK_SIZE chunks, each block compressed (zstd, or zlib if the
+zstandard package is not installed) and stored by columns (ids, texts, urls, metadatas).
+Files: doc_store.bin (compressed blocks, memory-mapped) + doc_store_offsets.npy (offset of each block)
++ doc_store.json (codec, number of chunks, block size).
+The retrievers work on the integer ids of the chunks: the texts are decompressed only for the
+final top-k (the documents of the prompt).
+"""
+
+# v1: columnar blocks compressed with zstd/zlib + lazy reading by integer id + cache of the decompressed blocks
+
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from config.config import *
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DOC_STORE_FILE = "doc_store.json"
+
+
+def codec_name(codec: str = DOC_STORE_CODEC) -> str:
+    return "zstd" if codec == "zstd" and zstandard is not None else "zlib"
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=DOC_STORE_LEVEL).compress(data)
+    return zlib.compress(data, DOC_STORE_LEVEL)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Document store compressed with zstd: the zstandard package is required")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def chunk_url(text: str, metadata: dict) -> str:
+    """
+    URL of the web page of a chunk (JSON item: "url" field), or path of the file (PDF page).
+    """
+
+    try:
+        return json.loads(text).get("url", "")
+    except (json.JSONDecodeError, AttributeError):
+        return metadata.get("source", "")
+
+
+def build_doc_store(path: str, ids: list[str], documents: list[str], metadatas: list[dict], block_size: int = DOC_STORE_BLOCK_SIZE) -> None:
+    """
+    Write the chunks in compressed blocks (one column per field in each block).
+    """
+
+    codec = codec_name()
+    n_blocks = (len(documents) + block_size - 1) // block_size
+    offsets = np.zeros(n_blocks + 1, dtype=np.int64)
+    with open(os.path.join(path, "doc_store.bin"), "wb") as store_file:
+        for block in range(n_blocks):
+            members = range(block * block_size, min((block + 1) * block_size, len(documents)))
+            columns = {
+                "ids": [ids[i] for i in members],
+                "texts": [documents[i] for i in members],
+                "urls": [chunk_url(documents[i], metadatas[i] or {}) for i in members],
+                "metadatas": [metadatas[i] or {} for i in members],
+            }
+            data = compress(json.dumps(columns, ensure_ascii=False).encode("utf-8"), codec)
+            store_file.write(data)
+            offsets[block + 1] = offsets[block] + len(data)
+    np.save(os.path.join(path, "doc_store_offsets.npy"), offsets)
+    with open(os.path.join(path, DOC_STORE_FILE), "w", encoding="utf-8") as info_file:
+        json.dump({"codec": codec, "documents": len(documents), "block_size": block_size}, info_file)
+
+
+def has_doc_store(path: str) -> bool:
+    return os.path.exists(os.path.join(path, DOC_STORE_FILE))
+
+
+class DocStore:
+    """
+    Read-only document store (memory-mapped): chunks read by integer id, block by block.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, DOC_STORE_FILE), encoding="utf-8") as info_file:
+            info = json.load(info_file)
+        self.codec = info["codec"]
+        self.size = info["documents"]
+        self.block_size = info["block_size"]
+        self.offsets = np.load(os.path.join(path, "doc_store_offsets.npy"), mmap_mode="r")
+        self.data = np.memmap(os.path.join(path, "doc_store.bin"), dtype=np.uint8, mode="r") if self.size else None
+        self.cache = OrderedDict()  # Block number --> decompressed columns (LRU)
+        self.lock = threading.Lock()
+
+    def block(self, block: int) -> dict:
+        with self.lock:
+            if block in self.cache:
+                self.cache.move_to_end(block)
+                return self.cache[block]
+        columns = json.loads(decompress(self.data[self.offsets[block]:self.offsets[block + 1]].tobytes(), self.codec))
+        with self.lock:
+            self.cache[block] = columns
+            while len(self.cache) > DOC_STORE_CACHE_BLOCKS:
+                self.cache.popitem(last=False)
+        return columns
+
+    def get(self, doc_id: int) -> dict:
+        """
+        Chunk of an integer id: {"id", "text", "url", "metadata"}.
+        """
+
+        columns = self.block(doc_id // self.block_size)
+        i = doc_id % self.block_size
+        return {"id": columns["ids"][i], "text": columns["texts"][i], "url": columns["urls"][i], "metadata": columns["metadatas"][i]}
+
+    def get_many(self, doc_ids: list[int]) -> list[dict]:
+        return [self.get(int(doc_id)) for doc_id in doc_ids]  # Chunks of the same block: decompressed once (cache)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+Ingestion of the Europeana RDF/XML records (one record per XML file, EDM with Dublin Core fields).
+Each file is streamed with an incremental parser (ElementTree.iterparse, no RDF graph): the DC fields
+of the described resource and the image URL are extracted directly. The files are parsed by a pool of
+processes and the records are written as JSON files (url, metadata, text), the format of the common
+ingest pipeline (./json_files, "Start Embed" or incremental ingest).
+Start the ingestion: python -m modules.europeana_ingest_v1 /root/download.europeana.eu/dataset/XML-KUL/ --source kul --index
+"""
+
+# v1: replaces old_versions/embed-xml-europeana-kul-v1.py and -irpa-v1.py (rdflib Graph + SPARQL)
+
+import argparse
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from config.config import *
+
+
+RDF = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+DC = "{http://purl.org/dc/elements/1.1/}"
+DCTERMS = "{http://purl.org/dc/terms/}"
+EDM = "{http://www.europeana.eu/schemas/edm/}"
+
+# Tag of the fields --> name of the field in the record (metadata dc:xxx)
+DC_FIELDS = {
+    f"{DC}title": "title",
+    f"{DC}creator": "creator",
+    f"{DC}date": "date",
+    f"{DC}format": "format",
+    f"{DC}type": "type",
+    f"{DCTERMS}medium": "medium",
+    f"{DC}description": "description",
+}
+IMAGE_TAGS = {f"{EDM}isShownBy", f"{EDM}object"}  # Image of the record in EDM (if no image with the prefix of the source)
+
+
+def parse_record(xml_path: str, image_prefix: str, provider_proxy: bool):
+    """
+    Extract one record from a Europeana RDF/XML file: URL of the resource with a dc:title, its DC
+    fields and the image URL. Return None if the file has no title or cannot be parsed.
+    """
+
+    fields = {}  # Subject (rdf:about) --> {field: [values]}
+    subjects = []  # Subjects with a dc:title, in the order of the file
+    image = ""
+    edm_image = ""
+    stack = []  # Subject of each open element (the children of a resource describe it)
+
+    try:
+        for event, element in ET.iterparse(xml_path, events=("start", "end")):
+            if event == "start":
+                about = element.get(f"{RDF}about")
+                stack.append(about or (stack[-1] if stack else None))
+                if about and not image and about.startswith(image_prefix):
+                    image = about
+                continue
+            subject = stack.pop()
+            field = DC_FIELDS.get(element.tag)
+            text = (element.text or "").strip()
+            if field and subject and text:
+                values = fields.setdefault(subject, {}).setdefault(field, [])
+                if text not in values:
+                    values.append(text)
+                if field == "title" and subject not in subjects:
+                    subjects.append(subject)
+            resource = element.get(f"{RDF}resource")
+            if resource and not image and resource.startswith(image_prefix):
+                image = resource
+            if resource and not edm_image and element.tag in IMAGE_TAGS:
+                edm_image = resource
+            if len(stack) == 1:
+                element.clear()  # Resource (child of rdf:RDF) done: free its elements
+    except ET.ParseError as e:
+        print(f"Error: {xml_path}: {e}")
+        return None
+
+    if not subjects:
+        return None
+    url = subjects[0]
+    record_fields = {name: "; ".join(values) for name, values in fields[url].items()}
+    if provider_proxy and "aggregator" in url:
+        url = url.replace("aggregator", "provider")  # Proxy of the provider (page of the institution)
+    metadata = {"og:image": image or edm_image}
+    metadata.update({f"dc:{name}": value for name, value in record_fields.items() if name != "description"})
+    return {"url": url, "metadata": metadata, "text": record_fields.get("description", "")}
+
+
+def write_json_files(records, output_dir: str, prefix: str, records_per_file: int) -> list[str]:
+    """
+    Write the records (iterator) in JSON files of records_per_file records, streamed (one record at a time).
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    json_file = None
+    count = 0
+    for record in records:
+        if count % records_per_file == 0:
+            if json_file:
+                json_file.write("\n]\n")
+                json_file.close()
+            paths.append(os.path.join(output_dir, f"{prefix}-{len(paths) + 1:04d}.json"))
+            json_file = open(f"{paths[-1]}.part", "w", encoding="utf-8")
+            json_file.write("[\n")
+        else:
+            json_file.write(",\n")
+        json_file.write(json.dumps(record, ensure_ascii=False))
+        count = count + 1
+    if json_file:
+        json_file.write("\n]\n")
+        json_file.close()
+    for path in paths:
+        os.replace(f"{path}.part", path)  # The files appear only when complete
+    return paths
+
+
+def ingest(xml_paths: list[str], source: str, output_dir: str, workers: int = None) -> list[str]:
+    """
+    Parse the XML files in a pool of processes and write the records in JSON files. Return the paths.
+    """
+
+    settings = EUROPEANA_SOURCES[source]
+    parse = partial(parse_record, image_prefix=settings["image_prefix"], provider_proxy=settings["provider_proxy"])
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        records = (record for record in executor.map(parse, xml_paths, chunksize=EUROPEANA_CHUNKSIZE) if record)
+        paths = write_json_files(records, output_dir, f"europeana-{source}", EUROPEANA_RECORDS_PER_FILE)
+    print(f"{len(xml_paths)} XML files parsed in {time.perf_counter() - start:.1f}s, {len(paths)} JSON files written")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming ingestion of Europeana RDF/XML records")
+    parser.add_argument("xml_dir", help="Directory of the XML files (one record per file)")
+    parser.add_argument("--source", choices=sorted(EUROPEANA_SOURCES), required=True, help="Institution (image URL prefix, proxy)")
+    parser.add_argument("--output-dir", default="./json_files", help="Directory of the JSON files")
+    parser.add_argument("--workers", type=int, default=None, help="Number of parser processes (default: number of cores)")
+    parser.add_argument("--index", action="store_true", help="Ingest the JSON files in a new index version (incremental)")
+    args = parser.parse_args()
+
+    xml_paths = sorted(os.path.join(args.xml_dir, name) for name in os.listdir(args.xml_dir) if name.endswith(".xml"))
+    json_paths = ingest(xml_paths, args.source, args.output_dir, args.workers)
+    if args.index and json_paths:
+        from modules.index_store_v1 import add_files
+        version = add_files(json_paths, [])
+        print(f"Index version {version} published")
+
+
+if __name__ == "__main__":
+    main()
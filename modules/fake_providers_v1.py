@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+Deterministic offline stand-ins for the embedding model and the chat models (LLM).
+No API key and no network: used to benchmark and load-test retrieval, ingestion and streaming.
+"""
+
+# v1: hash-seeded embedder + streaming fake LLM (TTFT and tokens/s)
+# v1: prompt prefix cache of the fake LLM (cache_control marks, like Anthropic)
+# v1: no cache of the prefixes shorter than 1024 tokens (minimum of the providers)
+
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config.config import *
+
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+FAKE_VOCABULARY = [
+    "the", "king", "queen", "portrait", "painting", "engraving", "photograph", "Leopold", "Albert",
+    "Elisabeth", "Brussels", "Laeken", "canvas", "museum", "collection", "royal", "Belgium", "artist",
+]
+
+
+PROMPT_CACHE_TTL = 300  # In seconds, like the Anthropic ephemeral cache
+PROMPT_CACHE_MIN_TOKENS = 1024  # Shorter prefixes are not cached (minimum of Anthropic and OpenAI)
+
+prompt_cache = {}  # Hash of a cached prompt prefix --> expiry time (shared by all the fake models of the process)
+prompt_cache_lock = threading.Lock()
+
+
+def message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in message.content)
+
+
+def count_tokens(text: str) -> int:
+    return len(WORD_PATTERN.findall(text))
+
+
+def seed_of(text: str) -> int:
+    """
+    Stable seed (same value in every process, unlike hash()).
+    """
+
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+
+@lru_cache(maxsize=100000)
+def word_vector(word: str, dimension: int) -> np.ndarray:
+    """
+    Random (but deterministic) vector of a word.
+    """
+
+    return np.random.default_rng(seed_of(word)).standard_normal(dimension).astype(np.float32)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embedder: the vector of a text is the normalized sum of the hash-seeded vectors
+    of its words. Texts sharing words get close vectors, so the retrieval results are meaningful.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def embed_query(self, text: str) -> List[float]:
+        words = WORD_PATTERN.findall(text.lower()) or [text]
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in words:
+            vector += word_vector(word, self.dimension)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Streaming fake LLM: waits ttft seconds (plus the prefill time of the input tokens not cached),
+    then streams answer_tokens tokens at tokens_per_second. The answer depends only on the prompt
+    (deterministic). The usage (input tokens, cached input tokens) is sent with the last token.
+    """
+
+    ttft: float = FAKE_LLM_TTFT  # Time to first token, in seconds
+    tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND
+    answer_tokens: int = FAKE_LLM_ANSWER_TOKENS
+    prefill_per_1k_tokens: float = FAKE_LLM_PREFILL_PER_1K_TOKENS  # TTFT added per 1000 input tokens not cached
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _prefill(self, messages: List[BaseMessage]) -> dict:
+        """
+        Usage of the input tokens: the longest prefix marked with cache_control and already
+        cached is read from the cache, then all the marked prefixes are cached. As with the
+        providers, a prefix shorter than PROMPT_CACHE_MIN_TOKENS is never cached.
+        """
+
+        input_tokens = sum(count_tokens(message_text(message)) for message in messages)
+        cached_tokens = 0
+        prefix = ""
+        now = time.monotonic()
+        with prompt_cache_lock:
+            for message in messages:
+                blocks = message.content if isinstance(message.content, list) else [{"type": "text", "text": message.content}]
+                for block in blocks:
+                    prefix = prefix + (block.get("text", "") if isinstance(block, dict) else str(block))
+                    if isinstance(block, dict) and block.get("cache_control") and count_tokens(prefix) >= PROMPT_CACHE_MIN_TOKENS:
+                        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+                        if prompt_cache.get(key, 0) > now:
+                            cached_tokens = count_tokens(prefix)
+                        prompt_cache[key] = now + PROMPT_CACHE_TTL
+        return {"input_tokens": input_tokens, "cached_tokens": cached_tokens}
+
+    def _ttft(self, usage: dict) -> float:
+        return self.ttft + (usage["input_tokens"] - usage["cached_tokens"]) / 1000 * self.prefill_per_1k_tokens
+
+    def _chunk(self, token: str, last: bool, usage: dict) -> ChatGenerationChunk:
+        if not last:
+            return ChatGenerationChunk(message=AIMessageChunk(content=token))
+        usage_metadata = {
+            "input_tokens": usage["input_tokens"],
+            "output_tokens": self.answer_tokens,
+            "total_tokens": usage["input_tokens"] + self.answer_tokens,
+            "input_token_details": {"cache_read": usage["cached_tokens"]},
+        }
+        return ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage_metadata))
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "\n".join(message_text(message) for message in messages)
+        rng = np.random.default_rng(seed_of(prompt))
+        words = rng.choice(FAKE_VOCABULARY, size=self.answer_tokens)
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        chunks = list(self._stream(messages, stop, run_manager, **kwargs))
+        text = "".join(chunk.message.content for chunk in chunks)
+        usage_metadata = chunks[-1].message.usage_metadata if chunks else None
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage_metadata))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        usage = self._prefill(messages)
+        time.sleep(self._ttft(usage))
+        tokens = self._tokens(messages)
+        for i, token in enumerate(tokens):
+            if i > 0:
+                time.sleep(1 / self.tokens_per_second)
+            chunk = self._chunk(token, i == len(tokens) - 1, usage)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        usage = self._prefill(messages)
+        await asyncio.sleep(self._ttft(usage))
+        tokens = self._tokens(messages)
+        for i, token in enumerate(tokens):
+            if i > 0:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = self._chunk(token, i == len(tokens) - 1, usage)
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
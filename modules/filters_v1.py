@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""
+Metadata filters of the retrieval: each chunk gets queryable fields at ingest (institution, from the
+URL of the web page, and year, from the date, the title or the text). A query can be scoped to
+institutions and/or a range of years: the filter is applied inside the BM25 and the vector DB
+retrievers before the top-k (pre-filter), so no result is lost as with a post-filter.
+The filters of a query are passed in the metadata of the Langchain config: {"metadata": {"filters": {...}}}.
+Filters: {"institution": "irpa" or ["irpa", "kbr"], "year_min": 1850, "year_max": 1900}
+"""
+
+# v1: institution + year fields, packed bitmaps per institution + years column, Chroma "where" filter
+# v1: filter of the vector DB retriever also applied by ainvoke
+# v1: BM25 scores computed only for the chunks allowed by the filters
+
+import json
+import re
+from typing import List
+from urllib.parse import urlparse
+
+import numpy as np
+from langchain_community.retrievers import BM25Retriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from config.config import *
+
+
+YEAR_PATTERN = re.compile(r"\b(1[0-9]{3}|20[0-9]{2})\b")
+MASK_CACHE_SIZE = 64  # Masks of the last filters used, per bitmap index
+
+
+def institution_of(url: str) -> str:
+    host = urlparse(url).netloc.lower()
+    for domain, institution in METADATA_INSTITUTIONS.items():
+        if host == domain or host.endswith(f".{domain}"):
+            return institution
+    return ""
+
+
+def year_of(*texts: str):
+    """
+    First year found in the texts (in their order: date, title, text), or None.
+    """
+
+    for text in texts:
+        match = YEAR_PATTERN.search(text or "")
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def add_filter_metadata(documents: list, file_type: str) -> None:
+    """
+    Add the filter fields (institution, year) to the metadata of the chunks, at ingest.
+    """
+
+    for document in documents:
+        if file_type == "pdf":
+            document.metadata["institution"] = "pdf"
+            year = year_of(document.page_content[:2000])
+        else:
+            try:
+                record = json.loads(document.page_content)
+            except json.JSONDecodeError:
+                record = {}
+            metadata = record.get("metadata") or {}
+            document.metadata["institution"] = institution_of(record.get("url", ""))
+            year = year_of(metadata.get("dc:date", ""), metadata.get("og:title", ""), record.get("text", "")[:2000])
+        if year:
+            document.metadata["year"] = year  # No None in the vector DB metadata: no field if no year
+
+
+def normalize_filters(filters):
+    """
+    Filters of a query in a standard form ({"institution": [...], "year_min": int, "year_max": int}), or None.
+    """
+
+    if not filters:
+        return None
+    normalized = {}
+    institutions = filters.get("institution")
+    if institutions:
+        normalized["institution"] = sorted({institutions.lower()} if isinstance(institutions, str) else {value.lower() for value in institutions})
+    for key in ("year_min", "year_max"):
+        if filters.get(key) not in (None, ""):
+            normalized[key] = int(filters[key])
+    return normalized or None
+
+
+def query_filters(run_manager: CallbackManagerForRetrieverRun):
+    return normalize_filters((run_manager.metadata or {}).get("filters"))
+
+
+def chroma_where(filters):
+    """
+    Filter of the vector DB (Chroma "where"), or None.
+    """
+
+    if not filters:
+        return None
+    conditions = []
+    if "institution" in filters:
+        conditions.append({"institution": {"$in": filters["institution"]}})
+    if "year_min" in filters:
+        conditions.append({"year": {"$gte": filters["year_min"]}})
+    if "year_max" in filters:
+        conditions.append({"year": {"$lte": filters["year_max"]}})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class BitmapIndex:
+    """
+    Filter index: one packed bitmap (1 bit per chunk) per institution, and the years column.
+    A filter gives the mask of the chunks allowed (OR of the bitmaps of the institutions, AND the range of years).
+    """
+
+    def __init__(self, institutions: list[str], bitmaps, years, size: int):
+        self.institutions = {institution: i for i, institution in enumerate(institutions)}
+        self.bitmaps = bitmaps  # uint8 array (institutions, ceil(size / 8))
+        self.years = years  # int16 array (size), 0 = unknown
+        self.size = size
+        self.masks = {}
+
+    @classmethod
+    def from_metadatas(cls, metadatas: list[dict]) -> "BitmapIndex":
+        institutions = sorted({(metadata or {}).get("institution", "") for metadata in metadatas} - {""})
+        ids = {institution: i for i, institution in enumerate(institutions)}
+        bits = np.zeros((len(institutions), len(metadatas)), dtype=bool)
+        years = np.zeros(len(metadatas), dtype=np.int16)
+        for doc_id, metadata in enumerate(metadatas):
+            metadata = metadata or {}
+            if metadata.get("institution") in ids:
+                bits[ids[metadata["institution"]], doc_id] = True
+            years[doc_id] = metadata.get("year") or 0
+        return cls(institutions, np.packbits(bits, axis=1), years, len(metadatas))
+
+    def mask(self, filters):
+        """
+        Boolean mask of the chunks matching the filters (None: no filter).
+        """
+
+        if not filters:
+            return None
+        key = json.dumps(filters, sort_keys=True)
+        if key not in self.masks:
+            mask = np.ones(self.size, dtype=bool)
+            if "institution" in filters:
+                rows = [self.institutions[institution] for institution in filters["institution"] if institution in self.institutions]
+                if rows:
+                    mask = np.unpackbits(np.bitwise_or.reduce(self.bitmaps[rows], axis=0), count=self.size).astype(bool)
+                else:
+                    mask = np.zeros(self.size, dtype=bool)
+            if "year_min" in filters:
+                mask &= self.years >= filters["year_min"]
+            if "year_max" in filters:
+                mask &= (self.years > 0) & (self.years <= filters["year_max"])
+            if len(self.masks) >= MASK_CACHE_SIZE:
+                self.masks.pop(next(iter(self.masks)))
+            self.masks[key] = mask
+        return self.masks[key]
+
+
+class FilteredBM25Retriever(BM25Retriever):
+    """
+    BM25 retriever with the metadata filters of the query applied before the top-k.
+    """
+
+    bitmap_index: object = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        filters = query_filters(run_manager)
+        if not filters:
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+        if self.bitmap_index is None:
+            self.bitmap_index = BitmapIndex.from_metadatas([document.metadata for document in self.docs])
+        candidates = np.flatnonzero(self.bitmap_index.mask(filters))
+        if len(candidates) == 0:
+            return []
+        scores = np.asarray(self.vectorizer.get_batch_scores(self.preprocess_func(query), candidates.tolist()))
+        top = np.argsort(-scores, kind="stable")[:self.k]
+        return [self.docs[candidates[i]] for i in top]
+
+
+class FilteredVectorStoreRetriever(VectorStoreRetriever):
+    """
+    Vector DB retriever with the metadata filters of the query (Chroma "where", applied by the search).
+    """
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        where = chroma_where(query_filters(run_manager))
+        if where is None:
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+        return self.vectorstore.similarity_search(query, **{**self.search_kwargs, "filter": where})
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        where = chroma_where(query_filters(run_manager))  # Same filter on the async paths (API, batch runner)
+        if where is None:
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
+        return await self.vectorstore.asimilarity_search(query, **{**self.search_kwargs, "filter": where})
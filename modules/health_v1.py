@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+Health and readiness of a worker process, and graceful drain:
+- health (/healthz): the process is alive; with the index version (published and loaded), the number
+  of chunks loaded, the state of the providers (circuit breakers, warm-up connection) and of the warm-up.
+- readiness (/readyz): the warm-up is done and the worker is not draining (else HTTP 503).
+- drain: the worker is not ready anymore, the answers being streamed are finished (max DRAIN_TIMEOUT),
+  then the process exits (SIGTERM).
+The API serves /healthz and /readyz itself; a Streamlit worker serves them on a side port
+(its port + HEALTH_PORT_OFFSET), with POST /drain used by the supervisor.
+"""
+
+# v1: health report + readiness + drain (active streams) + side HTTP server for the Streamlit workers
+
+import json
+import os
+import signal
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from modules.metrics_v1 import ACTIVE_STREAMS, index_state
+from modules.warmup_v1 import state as warmup_state
+from config.config import *
+
+
+streams = {"active": 0, "draining": False}
+streams_lock = threading.Lock()
+streams_done = threading.Condition(streams_lock)
+
+
+@contextmanager
+def track_stream():
+    """
+    Count an answer being streamed (drain waits for them).
+    """
+
+    with streams_lock:
+        streams["active"] = streams["active"] + 1
+    try:
+        with ACTIVE_STREAMS.track_inprogress():
+            yield
+    finally:
+        with streams_lock:
+            streams["active"] = streams["active"] - 1
+            streams_done.notify_all()
+
+
+def provider_states() -> dict:
+    from modules.provider_router_v1 import circuit_breakers
+
+    providers = {provider: "open" if breaker.opened_at is not None else "closed" for provider, breaker in circuit_breakers.items()}
+    if "providers" in warmup_state["errors"]:
+        providers["warmup_connections"] = f"error: {warmup_state['errors']['providers']}"
+    elif "providers" in warmup_state["steps"]:
+        providers["warmup_connections"] = "ok"
+    return providers
+
+
+def health_report() -> dict:
+    from modules.index_store_v1 import current_version, serving
+
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "name": warmup_state["name"],
+        "index_version": current_version(),  # Published
+        "loaded_version": serving["version"],  # Read by this process
+        "documents": index_state["documents"],
+        "providers": provider_states(),
+        "warmup": {"ready": warmup_state["ready"], "warming_up": warmup_state["warming_up"], "steps": warmup_state["steps"], "errors": warmup_state["errors"],
+                   "index_published": warmup_state.get("index_published")},
+        "active_streams": streams["active"],
+        "draining": streams["draining"],
+    }
+
+
+def readiness() -> tuple[bool, dict]:
+    report = health_report()
+    ready = warmup_state["ready"] and not streams["draining"]
+    return ready, {**report, "status": "ready" if ready else "not ready"}
+
+
+def drain(timeout: float = DRAIN_TIMEOUT, exit_process: bool = True) -> None:
+    """
+    Stop being ready, wait for the answers being streamed (max timeout), then exit (SIGTERM to itself).
+    """
+
+    with streams_lock:
+        streams["draining"] = True
+        deadline = time.monotonic() + timeout
+        while streams["active"] > 0 and time.monotonic() < deadline:
+            streams_done.wait(timeout=max(0.0, deadline - time.monotonic()))
+    print(f"Drained ({streams['active']} answers still streamed)", flush=True)
+    if exit_process:
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self.send_json(200, health_report())
+        elif self.path == "/readyz":
+            ready, report = readiness()
+            self.send_json(200 if ready else 503, report)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path == "/drain":
+            threading.Thread(target=drain, name="drain", daemon=True).start()
+            self.send_json(202, {"status": "draining", "active_streams": streams["active"]})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_health_server(port: int, host: str = "127.0.0.1") -> None:
+    """
+    Side HTTP server (thread) of a Streamlit worker: /healthz, /readyz and POST /drain.
+    """
+
+    server = ThreadingHTTPServer((host, port), HealthHandler)
+    threading.Thread(target=server.serve_forever, name="health", daemon=True).start()
+
+
+def probe(url: str, method: str = "GET", timeout: float = 2) -> bool:
+    """
+    True if the URL answers with HTTP 2xx.
+    """
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method=method), timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except OSError:
+        return False
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+"""
+Blue/green index builds: each build goes into a new version directory (vector DB, BM25 index and
+manifest), then is published by an atomic swap of the pointer file (CURRENT). The serving processes
+read the pointer and switch to the new version without restart. Each process holds a lease on the
+versions being read (counted per reader: page run, API request, batch), and the old versions are
+deleted (garbage collected) when they have no live lease.
+"""
+
+# v1: versioned builds + atomic pointer swap + leases + garbage collection
+# v1: memory-mapped index files (vectors, BM25 postings, documents) built with each version
+# v1: incremental ingest (copy of the published version + new files) + one build at a time (file lock)
+# v1: memory-mapped index split in shards (INDEX_SHARDING)
+# v1: leases counted per reader, one BM25 index in memory, failed builds not published
+
+import atexit
+import fcntl
+import os
+import pickle
+import secrets
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from config.config import *
+
+
+CURRENT_FILE = os.path.join(INDEX_ROOT, "CURRENT")
+LEASES_DIR = os.path.join(INDEX_ROOT, "leases")
+BUILDING_MARKER = ".building"  # In a version directory while it is built
+LEGACY_LEASE = "legacy"  # Leases on the legacy directory (not versioned): ./indexes/leases/legacy
+BM25_FILE = "bm25.pkl"
+
+serving = {"version": None}  # Last version leased by this process
+leases = {}  # Version --> number of readers in this process (lease file while > 0)
+lease_lock = threading.Lock()
+bm25_cache = {}  # Index path --> BM25 retriever (only the last version loaded, once per process)
+
+
+def new_version() -> str:
+    return time.strftime("v%Y%m%d-%H%M%S-") + secrets.token_hex(3)
+
+
+def version_path(version: str) -> str:
+    return os.path.join(INDEX_ROOT, version)
+
+
+def current_version():
+    """
+    Version published (pointer file), or None.
+    """
+
+    try:
+        with open(CURRENT_FILE, encoding="utf-8") as current_file:
+            return current_file.read().strip() or None
+    except OSError:
+        return None
+
+
+def current_index_path() -> str:
+    """
+    Directory of the published index (the legacy ./chromadb directory if no version is published).
+    """
+
+    version = current_version()
+    if version and os.path.isdir(version_path(version)):
+        return version_path(version)
+    return LEGACY_INDEX_PATH
+
+
+def publish(version: str) -> None:
+    """
+    Atomic swap of the pointer: the serving processes use the new version from their next request.
+    """
+
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    with open(f"{CURRENT_FILE}.tmp", "w", encoding="utf-8") as current_file:
+        current_file.write(version)
+        current_file.flush()
+        os.fsync(current_file.fileno())
+    os.replace(f"{CURRENT_FILE}.tmp", CURRENT_FILE)
+    print(f"Index version {version} published")
+
+
+def unpublish() -> None:
+    """
+    Remove the pointer: no version is published. The versions are deleted when no process reads them.
+    """
+
+    try:
+        os.remove(CURRENT_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def acquire_lease(index_path: str):
+    """
+    Lease on the version of an index directory for one reader (one file per process, counted per
+    reader). Return the version (LEGACY_LEASE for the legacy directory, None for another directory),
+    to give to release_lease.
+    """
+
+    if index_path and os.path.abspath(index_path) == os.path.abspath(LEGACY_INDEX_PATH):
+        version = LEGACY_LEASE  # Not versioned, but not deleted while read (delete_legacy_index)
+    elif not index_path or os.path.dirname(os.path.abspath(index_path)) != os.path.abspath(INDEX_ROOT):
+        return None  # Temporary directory (benchmarks)
+    else:
+        version = os.path.basename(os.path.abspath(index_path))
+    with lease_lock:
+        if not leases.get(version):
+            os.makedirs(os.path.join(LEASES_DIR, version), exist_ok=True)
+            with open(os.path.join(LEASES_DIR, version, str(os.getpid())), "w") as lease_file:
+                lease_file.write(str(time.time()))
+        leases[version] = leases.get(version, 0) + 1
+        serving["version"] = version
+    return version
+
+
+def release_lease(version) -> None:
+    """
+    End of a reader: the lease file of the version is removed when it has no reader left in this process.
+    """
+
+    if version is None:
+        return
+    with lease_lock:
+        leases[version] = leases.get(version, 0) - 1
+        if leases[version] > 0:
+            return
+        del leases[version]
+        try:
+            os.remove(os.path.join(LEASES_DIR, version, str(os.getpid())))
+        except OSError:
+            pass
+    if version != current_version():
+        collect_garbage()
+
+
+@contextmanager
+def lease(index_path: str):
+    version = acquire_lease(index_path)
+    try:
+        yield version
+    finally:
+        release_lease(version)
+
+
+def release_all_leases() -> None:
+    with lease_lock:
+        for version in list(leases):
+            try:
+                os.remove(os.path.join(LEASES_DIR, version, str(os.getpid())))
+            except OSError:
+                pass
+        leases.clear()
+
+
+atexit.register(release_all_leases)
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def live_leases(version: str) -> int:
+    """
+    Number of processes alive holding a lease on a version (the leases of dead processes are removed).
+    """
+
+    lease_dir = os.path.join(LEASES_DIR, version)
+    if not os.path.isdir(lease_dir):
+        return 0
+    alive = 0
+    for name in os.listdir(lease_dir):
+        if name.isdigit() and pid_alive(int(name)):
+            alive = alive + 1
+        else:
+            try:
+                os.remove(os.path.join(lease_dir, name))
+            except OSError:
+                pass
+    return alive
+
+
+def list_versions() -> list[dict]:
+    versions = []
+    if not os.path.isdir(INDEX_ROOT):
+        return versions
+    current = current_version()
+    for name in sorted(os.listdir(INDEX_ROOT)):
+        path = version_path(name)
+        if name.startswith("v") and os.path.isdir(path):
+            versions.append({
+                "version": name,
+                "current": name == current,
+                "building": os.path.exists(os.path.join(path, BUILDING_MARKER)),
+                "readers": live_leases(name),
+            })
+    return versions
+
+
+def collect_garbage() -> list[str]:
+    """
+    Delete the versions which are not published, not being built, and not read by any process.
+    """
+
+    deleted = []
+    for version in list_versions():
+        path = version_path(version["version"])
+        if version["current"] or version["readers"]:
+            continue
+        if version["building"] and time.time() - os.path.getmtime(os.path.join(path, BUILDING_MARKER)) < INDEX_BUILD_MAX_AGE:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        shutil.rmtree(os.path.join(LEASES_DIR, version["version"]), ignore_errors=True)
+        deleted.append(version["version"])
+        print(f"Index version {version['version']} deleted")
+    return deleted
+
+
+def delete_legacy_index() -> bool:
+    """
+    Delete the legacy directory if no process reads it. Return False if it is read (not deleted).
+    """
+
+    if live_leases(LEGACY_LEASE):
+        return False
+    shutil.rmtree(LEGACY_INDEX_PATH, ignore_errors=True)
+    return True
+
+
+def build_bm25(index_path: str, documents: list[str], metadatas: list[dict] = None) -> None:
+    """
+    Build the keyword (BM25) index once, at build time, and save it with the version.
+    """
+
+    from modules.filters_v1 import FilteredBM25Retriever
+    keyword_retriever = FilteredBM25Retriever.from_texts(documents, metadatas=[metadata or {} for metadata in metadatas] if metadatas else None)
+    with open(os.path.join(index_path, BM25_FILE), "wb") as bm25_file:
+        pickle.dump(keyword_retriever, bm25_file)
+
+
+def load_bm25(index_path: str):
+    """
+    BM25 retriever of a version (None if the version has no BM25 index), loaded once per process.
+    """
+
+    if index_path not in bm25_cache:
+        path = os.path.join(index_path, BM25_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as bm25_file:
+            keyword_retriever = pickle.load(bm25_file)
+        bm25_cache.clear()  # Previous version: freed when its retrievers are released
+        bm25_cache[index_path] = keyword_retriever
+    return bm25_cache[index_path]
+
+
+@contextmanager
+def build_lock():
+    """
+    One build at a time (for all the processes): each build starts from the version published by the previous one.
+    """
+
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    with open(os.path.join(INDEX_ROOT, "build.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def start_version(base_path: str = None) -> tuple[str, str]:
+    """
+    Create the directory of a new version (empty, or a copy of an existing index), marked as being built.
+    """
+
+    version = new_version()
+    path = version_path(version)
+    if base_path and os.path.isdir(base_path):
+        shutil.copytree(base_path, path, ignore=shutil.ignore_patterns(BUILDING_MARKER, "*.tmp"))
+    else:
+        os.makedirs(path)
+    open(os.path.join(path, BUILDING_MARKER), "w").close()
+    return version, path
+
+
+def build_search_indexes(path: str, embedding_model) -> None:
+    """
+    Build the BM25 and memory-mapped indexes (or shards) of an index directory from its vector DB.
+    The pickled BM25 index (a copy of all the texts) is only built for INDEX_BACKEND = "chroma": the
+    memory-mapped index has its own BM25 postings and reads the texts from the document store.
+    """
+
+    from modules.manifest_v1 import read_manifest, write_manifest
+    from modules.mmap_index_v1 import build_mmap_index
+    from modules.providers_v1 import import_chroma
+    from modules.shards_v1 import build_shards
+
+    # Indexes of the copied version (incremental ingest) rebuilt from scratch
+    shutil.rmtree(os.path.join(path, "shards"), ignore_errors=True)
+    for name in os.listdir(path):
+        if name.endswith(".npy") or name.endswith(".bin") or name in ("mmap_index.json", "doc_store.json", BM25_FILE):
+            os.remove(os.path.join(path, name))
+
+    Chroma, chromadb = import_chroma()
+    vector_db = Chroma(embedding_function=embedding_model, collection_name=COLLECTION_NAME, persist_directory=path)
+    data = vector_db.get(include=["documents", "metadatas", "embeddings"])
+    if INDEX_BACKEND != "mmap":
+        build_bm25(path, data["documents"], data["metadatas"])  # Else built from the vector DB if the backend is switched to chroma
+    if INDEX_SHARDING:
+        build_shards(path, data["ids"], data["documents"], data["metadatas"], data["embeddings"])
+    else:
+        build_mmap_index(path, data["ids"], data["documents"], data["metadatas"], data["embeddings"])
+    write_manifest(read_manifest(path), path)  # Index sizes with the BM25 and memory-mapped indexes
+
+
+def finish_version(version: str, path: str, embedding_model) -> None:
+    """
+    Build the BM25 and memory-mapped indexes from the vector DB of the version, then publish it.
+    """
+
+    build_search_indexes(path, embedding_model)
+    os.remove(os.path.join(path, BUILDING_MARKER))
+    publish(version)
+    collect_garbage()
+
+
+def build_index(json_file_paths: list[str], pdf_file_paths: list[str], embedding_model=None, log=print) -> str:
+    """
+    Build a new version (vector DB, BM25 index, memory-mapped index, manifest) in its own directory, then publish it.
+    log: messages of the ingest (st.write in the Admin page).
+    """
+
+    from modules.manifest_v1 import read_manifest
+    from modules.providers_v1 import instanciate_embedding_model
+    from modules.utils_v1 import load_files_and_embed
+
+    with build_lock():
+        version, path = start_version()
+        try:
+            embedding_model = embedding_model or instanciate_embedding_model()
+            load_files_and_embed(json_file_paths, pdf_file_paths, embed=True, persist_directory=path, embedding_model=embedding_model, log=log)
+            manifest = read_manifest(path)
+            failed = [file_path for file_path in json_file_paths + pdf_file_paths if not manifest["files"].get(file_path, {}).get("embedded")]
+            if failed:
+                raise RuntimeError(f"Files not embedded: {', '.join(failed)}")  # Not published: the live index stays
+            finish_version(version, path, embedding_model)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+    return version
+
+
+def add_files(json_file_paths: list[str], pdf_file_paths: list[str], hashes: dict = None, log=print) -> str:
+    """
+    Incremental ingest: copy the published version, replace the chunks of the given files (only these
+    files are embedded), then publish the copy. hashes: file path --> sha256, saved in the manifest.
+    log: messages of the ingest (print: called from a background thread or a command line).
+    """
+
+    from modules.manifest_v1 import read_manifest, update_manifest
+    from modules.providers_v1 import import_chroma, instanciate_embedding_model
+    from modules.utils_v1 import load_files_and_embed
+
+    with build_lock():
+        version, path = start_version(current_index_path())
+        try:
+            embedding_model = instanciate_embedding_model()
+            Chroma, chromadb = import_chroma()
+            vector_db = Chroma(embedding_function=embedding_model, collection_name=COLLECTION_NAME, persist_directory=path)
+            for file_path in json_file_paths + pdf_file_paths:
+                vector_db._collection.delete(where={"source": {"$in": [file_path, os.path.abspath(file_path)]}})  # Previous chunks of the file
+
+            load_files_and_embed(json_file_paths, pdf_file_paths, embed=True, persist_directory=path, embedding_model=embedding_model, log=log)
+            manifest = read_manifest(path)
+            failed = [file_path for file_path in json_file_paths + pdf_file_paths if not manifest["files"].get(file_path, {}).get("embedded")]
+            if failed:
+                raise RuntimeError(f"Files not embedded: {', '.join(failed)}")
+            if hashes:
+                update_manifest({file_path: {**manifest["files"][file_path], "sha256": digest} for file_path, digest in hashes.items()}, path)
+
+            finish_version(version, path, embedding_model)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+    return version
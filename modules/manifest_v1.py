@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+Statistics manifest of the corpus and of the index, maintained by the ingestion: per file the
+number of records (JSON items) or pages (PDF), chunks and tokens, and the embedded/pending status;
+per index component the size on disk. The admin page reads it instead of re-parsing all the files.
+"""
+
+# v1: manifest.json in the vector DB directory
+# v1: duplicates collapsed at ingest (per file and total)
+# v1: size of the document store
+
+import json
+import os
+import time
+
+
+MANIFEST_NAME = "manifest.json"
+
+
+def approx_tokens(text: str) -> int:
+    """
+    Approximate number of tokens (about 4 characters per token for the OpenAI tokenizers).
+    """
+
+    return len(text) // 4
+
+
+def file_signature(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def file_stats(path: str, file_type: str, documents: list) -> dict:
+    """
+    Statistics of one file: its chunks (documents) and its signature (size, time) on disk.
+    """
+
+    stats = {"type": file_type, "chunks": len(documents), "tokens": sum(approx_tokens(doc.page_content) for doc in documents), "embedded": False}
+    stats["records" if file_type == "json" else "pages"] = len(documents)  # 1 JSON item or 1 PDF page per chunk
+    stats.update(file_signature(path))
+    return stats
+
+
+def index_bytes(persist_directory: str) -> dict:
+    """
+    Size on disk of each component of the index.
+    """
+
+    components = {}
+    for root, dirs, files in os.walk(persist_directory):
+        for name in files:
+            if name in (MANIFEST_NAME, ".building") or name.endswith(".tmp"):
+                continue
+            if os.path.relpath(root, persist_directory).split(os.sep)[0] == "shards":
+                component = "shards"  # Memory-mapped indexes of the shards
+            elif name.startswith("doc_store"):
+                component = "doc_store"  # Compressed documents (memory-mapped)
+            elif name in ("bitmaps.npy", "years.npy"):
+                component = "filter_index"  # Bitmaps of the metadata filters
+            elif name.endswith(".npy") or name.endswith(".bin") or name == "mmap_index.json":
+                component = "mmap_index"  # Vectors, BM25 postings and documents (memory-mapped)
+            elif name.endswith(".sqlite3"):
+                component = "sqlite"  # Documents, metadata and embeddings
+            elif root != persist_directory:
+                component = "vector_segments"  # HNSW index of the collections
+            else:
+                component = os.path.splitext(name)[0]  # Ex: bm25
+            components[component] = components.get(component, 0) + os.path.getsize(os.path.join(root, name))
+    return components
+
+
+def read_manifest(persist_directory: str = "./chromadb") -> dict:
+    try:
+        with open(os.path.join(persist_directory, MANIFEST_NAME), encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, json.JSONDecodeError):
+        return {"files": {}, "totals": {}, "index_bytes": {}}
+
+
+def write_manifest(manifest: dict, persist_directory: str = "./chromadb") -> None:
+    """
+    Write the manifest (totals and index sizes recomputed) atomically.
+    """
+
+    files = manifest["files"].values()
+    manifest["totals"] = {
+        "files": len(manifest["files"]),
+        "records": sum(stats.get("records", 0) for stats in files),
+        "pages": sum(stats.get("pages", 0) for stats in files),
+        "chunks": sum(stats["chunks"] for stats in files),
+        "tokens": sum(stats["tokens"] for stats in files),
+        "duplicates": sum(stats.get("duplicates", 0) for stats in files),
+        "embedded_chunks": sum(stats["chunks"] - stats.get("duplicates", 0) for stats in files if stats["embedded"]),
+    }
+    manifest["index_bytes"] = index_bytes(persist_directory)
+    manifest["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    os.makedirs(persist_directory, exist_ok=True)
+    path = os.path.join(persist_directory, MANIFEST_NAME)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def update_manifest(stats_by_path: dict, persist_directory: str = "./chromadb") -> dict:
+    """
+    Add or replace the statistics of the given files in the manifest.
+    """
+
+    manifest = read_manifest(persist_directory)
+    manifest["files"].update(stats_by_path)
+    write_manifest(manifest, persist_directory)
+    return manifest
+
+
+def pending_files(manifest: dict, paths: list[str]) -> list[str]:
+    """
+    Files on disk which are not embedded: new, changed since their embedding, or not embedded yet.
+    """
+
+    pending = []
+    for path in paths:
+        stats = manifest["files"].get(path)
+        if stats is None or not stats["embedded"]:
+            pending.append(path)
+            continue
+        try:
+            signature = file_signature(path)
+        except OSError:
+            continue
+        if signature["size"] != stats["size"] or signature["mtime"] != stats["mtime"]:
+            pending.append(path)
+    return pending
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""
+Prometheus metrics of the assistant process, served on a side port (METRICS_PORT) and
+scraped by Prometheus. The latency metrics are fed by the spans of the tracing module.
+"""
+
+# v1: histograms (latency, TTFT, retrieval, tokens), counters (cache hits, provider errors, sessions), gauges (index, RSS)
+# v1: active sessions tracked by the app, size of the index read once per index version (manifest)
+
+import os
+import resource
+import threading
+import weakref
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from modules.manifest_v1 import read_manifest
+from config.config import *
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+TOKEN_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600, 3200)
+
+REQUEST_LATENCY = Histogram("assistant_request_seconds", "Latency of a question (until the end of the answer)", ["client"], buckets=LATENCY_BUCKETS)
+TTFT = Histogram("assistant_ttft_seconds", "Time to first token of the answer", buckets=LATENCY_BUCKETS)
+RETRIEVAL_LATENCY = Histogram("assistant_retrieval_seconds", "Latency of the retrievers", ["stage"], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram("assistant_stage_seconds", "Latency of the other stages of the chain", ["stage"], buckets=LATENCY_BUCKETS)
+TOKENS_STREAMED = Histogram("assistant_tokens_streamed", "Number of tokens streamed per answer", buckets=TOKEN_BUCKETS)
+INPUT_TOKENS = Counter("assistant_input_tokens_total", "Input tokens sent to the models", ["stage"])
+CACHED_INPUT_TOKENS = Counter("assistant_cached_input_tokens_total", "Input tokens read from the prompt cache of the providers", ["stage"])
+
+CACHE_HITS = Counter("assistant_cache_hits_total", "Cache hits", ["cache"])
+PROVIDER_ERRORS = Counter("assistant_provider_errors_total", "Errors of the model providers", ["stage"])
+SESSIONS = Counter("assistant_sessions_total", "Chat sessions started")
+SPECULATIVE_RETRIEVALS = Counter("assistant_speculative_retrievals_total", "Speculative retrievals accepted or rejected", ["outcome"])
+PROVIDER_FAILOVERS = Counter("assistant_provider_failovers_total", "Calls moved to another provider (error or hedge lost)", ["provider", "reason"])
+
+ACTIVE_SESSIONS = Gauge("assistant_active_sessions", "Chat sessions connected (Streamlit)")
+ACTIVE_STREAMS = Gauge("assistant_active_streams", "Answers being streamed")
+INDEX_DOCUMENTS = Gauge("assistant_index_documents", "Number of chunks in the index")
+INDEX_BYTES = Gauge("assistant_index_bytes", "Size of the index on disk")
+PROCESS_RSS = Gauge("assistant_process_rss_bytes", "Resident memory of the process")
+
+RETRIEVAL_STAGES = ("bm25", "vector_db", "fusion", "query_embedding")
+
+server_lock = threading.Lock()
+server_port = None
+
+
+def process_rss_bytes() -> float:
+    """
+    Current resident memory (RSS) of the process.
+    """
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # High-water mark if /proc is not available
+
+
+class SessionToken:
+    """
+    Kept in the session state of a chat session: collected with the session when it disconnects.
+    """
+
+
+active_sessions = weakref.WeakSet()
+
+
+def track_session() -> SessionToken:
+    """
+    Count a new chat session. The caller keeps the returned token in the session state.
+    """
+
+    token = SessionToken()
+    active_sessions.add(token)
+    SESSIONS.inc()
+    return token
+
+
+PROCESS_RSS.set_function(process_rss_bytes)
+ACTIVE_SESSIONS.set_function(lambda: len(active_sessions))
+
+
+def start_metrics_server() -> int:
+    """
+    Start the metrics HTTP server once per process. With several workers, each worker takes
+    the first free port from METRICS_PORT to METRICS_PORT + METRICS_PORT_RANGE - 1.
+    """
+
+    global server_port
+    with server_lock:
+        if server_port is None and METRICS:
+            for port in range(METRICS_PORT, METRICS_PORT + METRICS_PORT_RANGE):
+                try:
+                    start_http_server(port)
+                    server_port = port
+                    print(f"Metrics served on port {port}")
+                    break
+                except OSError:
+                    continue
+    return server_port
+
+
+def observe_span(span: dict) -> None:
+    """
+    Feed the metrics with a span closed by the tracing module.
+    """
+
+    if not span.get("endTimeUnixNano"):
+        return
+    name = span["name"]
+    attributes = span["attributes"]
+    seconds = (span["endTimeUnixNano"] - span["startTimeUnixNano"]) / 1e9
+    if name == "chat_request":
+        REQUEST_LATENCY.labels(client=attributes.get("client", "")).observe(seconds)
+    elif name == "generation_ttft":
+        TTFT.observe(seconds)
+    elif name in RETRIEVAL_STAGES:
+        RETRIEVAL_LATENCY.labels(stage=name).observe(seconds)
+    else:
+        STAGE_LATENCY.labels(stage=name).observe(seconds)
+    if name == "generation" and "tokens" in attributes:
+        TOKENS_STREAMED.observe(attributes["tokens"])
+    if attributes.get("input_tokens"):
+        INPUT_TOKENS.labels(stage=name).inc(attributes["input_tokens"])
+        CACHED_INPUT_TOKENS.labels(stage=name).inc(attributes.get("cached_input_tokens", 0))
+    if name in ("contextualize", "generation") and attributes.get("error"):
+        PROVIDER_ERRORS.labels(stage=name).inc()
+
+
+index_state = {"documents": 0, "path": None}  # Index loaded by this process (health probes)
+index_sizes = {}  # Size on disk per index path (an index version does not change once published)
+
+
+def index_size(path: str) -> int:
+    """
+    Size on disk of the index, from its manifest (or by walking the directory if it has none).
+    """
+
+    size = sum(read_manifest(path)["index_bytes"].values())
+    if not size:
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                try:
+                    size = size + os.path.getsize(os.path.join(root, file))
+                except OSError:
+                    continue
+    return size
+
+
+def set_index_size(documents: int, path: str) -> None:
+    """
+    Number of chunks and size on disk of the index (computed once per index path).
+    """
+
+    INDEX_DOCUMENTS.set(documents)
+    index_state.update(documents=documents, path=path)
+    if path not in index_sizes:
+        index_sizes[path] = index_size(path)
+    INDEX_BYTES.set(index_sizes[path])
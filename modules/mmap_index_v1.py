@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+"""
+Read-only memory-mapped index: the vectors, the BM25 postings and the documents of an index version
+are saved as flat files (numpy .npy and binary files with offsets) at build time. The worker processes
+map the same files (numpy mmap): the memory is shared through the page cache instead of being loaded
+(and duplicated) in each process.
+Files: vectors.npy (normalized float32 vectors), terms.bin + term_offsets.npy (sorted vocabulary),
+postings_offsets.npy + postings_docs.npy + postings_tf.npy (BM25 postings), idf.npy, doc_lengths.npy,
+doc_store.bin + doc_store_offsets.npy (compressed document store), bitmaps.npy + years.npy (metadata filters),
+mmap_index.json (statistics).
+The retrievers return the integer ids of the chunks: the documents are read from the document store
+only for the results of the fusion.
+"""
+
+# v1: vector search (dot product) + BM25 (same scores as rank_bm25 BM25Okapi) + fusion by document id (RRF)
+# v1: metadata filters (bitmap index) applied before the top-k of both retrievers
+# v1: BM25 statistics of the whole corpus (shards) + search methods shared with the sharded index
+# v1: compressed document store (doc_store_v1) + documents read only for the results of the fusion
+
+import json
+import math
+import os
+from collections import Counter
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from modules.doc_store_v1 import DocStore, build_doc_store, has_doc_store
+from modules.filters_v1 import BitmapIndex, query_filters
+from config.config import *
+
+
+MMAP_INDEX_FILE = "mmap_index.json"
+BM25_K1 = 1.5  # Parameters of rank_bm25 BM25Okapi (used by the BM25Retriever of Langchain)
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+
+def tokenize(text: str) -> list[str]:
+    return text.split()  # Same tokenization as the BM25Retriever of Langchain
+
+
+def write_blobs(path: str, name: str, offsets_name: str, blobs: list[bytes]) -> None:
+    """
+    Write a list of byte strings as one binary file + one offset file.
+    """
+
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    with open(os.path.join(path, f"{name}.bin"), "wb") as blob_file:
+        for i, blob in enumerate(blobs):
+            blob_file.write(blob)
+            offsets[i + 1] = offsets[i] + len(blob)
+    np.save(os.path.join(path, f"{offsets_name}.npy"), offsets)
+
+
+def corpus_stats(documents: list[str]) -> dict:
+    """
+    BM25 statistics of a corpus: number of documents, document frequency of the terms, average
+    document length and average IDF. The shards of a corpus use the same statistics (global IDF):
+    their BM25 scores can be compared.
+    """
+
+    df = Counter()
+    total_length = 0
+    for document in documents:
+        tokens = tokenize(document)
+        total_length = total_length + len(tokens)
+        df.update(set(tokens))
+    n_docs = len(documents)
+    idf_sum = sum(math.log(n_docs - count + 0.5) - math.log(count + 0.5) for count in df.values())
+    return {"documents": n_docs, "df": df, "avg_doc_length": total_length / n_docs if n_docs else 0.0, "average_idf": idf_sum / len(df) if df else 0.0}
+
+
+def build_mmap_index(path: str, ids: list[str], documents: list[str], metadatas: list[dict], embeddings, stats: dict = None) -> None:
+    """
+    Save the vectors, the BM25 postings and the documents of an index version (or of a shard, with
+    the statistics of the whole corpus) in flat files.
+    """
+
+    os.makedirs(path, exist_ok=True)
+    stats = stats or corpus_stats(documents)
+
+    # Vectors (normalized: the dot product gives the cosine similarity)
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.save(os.path.join(path, "vectors.npy"), vectors / np.where(norms == 0, 1, norms))
+
+    # BM25 postings (one list of (document, term frequency) per term of the sorted vocabulary)
+
+    term_counts = [Counter(tokenize(document)) for document in documents]
+    terms = sorted({term for counts in term_counts for term in counts})
+    term_ids = {term: i for i, term in enumerate(terms)}
+    postings = [[] for _ in terms]
+    for doc_id, counts in enumerate(term_counts):
+        for term, tf in counts.items():
+            postings[term_ids[term]].append((doc_id, tf))
+
+    postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    postings_offsets[1:] = np.cumsum([len(term_postings) for term_postings in postings])
+    np.save(os.path.join(path, "postings_offsets.npy"), postings_offsets)
+    np.save(os.path.join(path, "postings_docs.npy"), np.array([doc_id for term_postings in postings for doc_id, tf in term_postings], dtype=np.int32))
+    np.save(os.path.join(path, "postings_tf.npy"), np.array([tf for term_postings in postings for doc_id, tf in term_postings], dtype=np.float32))
+
+    n_docs = len(documents)
+    idf = np.array([math.log(stats["documents"] - stats["df"][term] + 0.5) - math.log(stats["df"][term] + 0.5) for term in terms], dtype=np.float32)
+    idf[idf < 0] = BM25_EPSILON * stats["average_idf"]  # Same floor as rank_bm25
+    np.save(os.path.join(path, "idf.npy"), idf)
+    doc_lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+    np.save(os.path.join(path, "doc_lengths.npy"), doc_lengths)
+
+    bitmap_index = BitmapIndex.from_metadatas(metadatas)
+    np.save(os.path.join(path, "bitmaps.npy"), bitmap_index.bitmaps)
+    np.save(os.path.join(path, "years.npy"), bitmap_index.years)
+
+    write_blobs(path, "terms", "term_offsets", [term.encode("utf-8") for term in terms])
+    build_doc_store(path, ids, documents, metadatas)
+
+    with open(os.path.join(path, MMAP_INDEX_FILE), "w", encoding="utf-8") as index_file:
+        json.dump({"documents": n_docs, "terms": len(terms), "dimension": vectors.shape[1] if vectors.ndim == 2 else 0,
+                   "avg_doc_length": stats["avg_doc_length"], "institutions": sorted(bitmap_index.institutions)}, index_file)
+
+
+def has_mmap_index(path: str) -> bool:
+    return os.path.exists(os.path.join(path, MMAP_INDEX_FILE)) or os.path.isdir(os.path.join(path, "shards"))
+
+
+class MmapIndex:
+    """
+    Read-only index of a version, mapped in memory (shared between the processes by the page cache).
+    """
+
+    def __init__(self, path: str, name: str = None):
+        self.path = path
+        self.name = name  # Name of the shard (prefix of the document ids)
+        with open(os.path.join(path, MMAP_INDEX_FILE), encoding="utf-8") as index_file:
+            self.stats = json.load(index_file)
+        self.size = self.stats["documents"]
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.vectors = load("vectors")
+        self.postings_offsets = load("postings_offsets")
+        self.postings_docs = load("postings_docs")
+        self.postings_tf = load("postings_tf")
+        self.idf = load("idf")
+        self.doc_lengths = load("doc_lengths")
+        self.term_offsets = load("term_offsets")
+        self.terms = np.memmap(os.path.join(path, "terms.bin"), dtype=np.uint8, mode="r") if self.stats["terms"] else None
+        if has_doc_store(path):
+            self.doc_store = DocStore(path)
+        else:  # Index built before the document store: JSON documents + offsets
+            self.doc_store = None
+            self.doc_offsets = load("doc_offsets")
+            self.docs = np.memmap(os.path.join(path, "docs.bin"), dtype=np.uint8, mode="r") if self.size else None
+        if "institutions" in self.stats:
+            self.bitmap_index = BitmapIndex(self.stats["institutions"], load("bitmaps"), load("years"), self.size)
+        else:
+            self.bitmap_index = BitmapIndex.from_metadatas([{}] * self.size)  # Index built before the filters
+
+    def term_id(self, term: str):
+        """
+        Id of a term (binary search in the sorted vocabulary), or None.
+        """
+
+        key = term.encode("utf-8")
+        low, high = 0, self.stats["terms"]
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self.terms[self.term_offsets[middle]:self.term_offsets[middle + 1]].tobytes()
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    @staticmethod
+    def top_k(scores, k: int) -> list[tuple[int, float]]:
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def top_k_of(self, scores, candidates, k: int) -> list[tuple[int, float]]:
+        """
+        Top-k of the candidates (ids of the chunks allowed by the filters, scores of the candidates only).
+        """
+
+        return [(int(candidates[i]), score) for i, score in self.top_k(scores, k)]
+
+    def vector_search(self, query_vector, k: int, mask=None) -> list[tuple[int, float]]:
+        """
+        Exact search: dot product with all the vectors (O(N x dimension) per query), or only with the
+        vectors allowed by the filters. For a very large corpus, Chroma (HNSW, approximate) is faster.
+        """
+
+        if self.size == 0:
+            return []
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1)
+        if mask is None:
+            return self.top_k(self.vectors @ query_vector, k)
+        candidates = np.flatnonzero(mask)
+        return self.top_k_of(self.vectors[candidates] @ query_vector, candidates, k)  # Only the vectors allowed are read
+
+    def bm25_scores(self, query: str):
+        scores = np.zeros(self.size, dtype=np.float32)
+        avg_doc_length = self.stats["avg_doc_length"] or 1
+        for term in tokenize(query):  # Repeated terms count several times (as rank_bm25)
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / avg_doc_length))
+        return scores
+
+    def bm25_search(self, query: str, k: int, mask=None) -> list[tuple[int, float]]:
+        if mask is None:
+            return self.top_k(self.bm25_scores(query), k)
+        candidates = np.flatnonzero(mask)
+        return self.top_k_of(self.bm25_scores(query)[candidates], candidates, k)
+
+    def index_id(self, doc_id: int):
+        return doc_id if self.name is None else f"{self.name}/{doc_id}"  # Shard: ids prefixed by its name
+
+    def document(self, doc_id: int) -> Document:
+        if self.doc_store is None:
+            record = json.loads(self.docs[self.doc_offsets[doc_id]:self.doc_offsets[doc_id + 1]].tobytes())
+        else:
+            chunk = self.doc_store.get(doc_id)
+            record = {"page_content": chunk["text"], "metadata": chunk["metadata"]}
+        return Document(page_content=record["page_content"], metadata={**record["metadata"], "index_id": self.index_id(doc_id)})
+
+    def documents(self, index_ids: list) -> list[Document]:
+        return [self.document(int(str(index_id).rsplit("/", 1)[-1])) for index_id in index_ids]
+
+    def search_vector_ids(self, query_vector, k: int, filters=None) -> list[tuple[float, Any]]:
+        results = self.vector_search(query_vector, k, self.bitmap_index.mask(filters))
+        return [(score, self.index_id(doc_id)) for doc_id, score in results]
+
+    def search_bm25_ids(self, query: str, k: int, filters=None) -> list[tuple[float, Any]]:
+        results = self.bm25_search(query, k, self.bitmap_index.mask(filters))
+        return [(score, self.index_id(doc_id)) for doc_id, score in results]
+
+    def search_vector(self, query_vector, k: int, filters=None) -> list[tuple[float, Document]]:
+        results = self.search_vector_ids(query_vector, k, filters)
+        return list(zip([score for score, index_id in results], self.documents([index_id for score, index_id in results])))
+
+    def search_bm25(self, query: str, k: int, filters=None) -> list[tuple[float, Document]]:
+        results = self.search_bm25_ids(query, k, filters)
+        return list(zip([score for score, index_id in results], self.documents([index_id for score, index_id in results])))
+
+
+mmap_indexes = {}  # Index path --> MmapIndex or ShardedIndex (mapped once per process)
+
+
+def load_mmap_index(path: str):
+    if path not in mmap_indexes:
+        mmap_indexes.clear()  # Previous version: unmapped when its retrievers are released
+        if os.path.isdir(os.path.join(path, "shards")):
+            from modules.shards_v1 import ShardedIndex
+            mmap_indexes[path] = ShardedIndex.open(path)
+        else:
+            mmap_indexes[path] = MmapIndex(path)
+    return mmap_indexes[path]
+
+
+def lazy_documents(results) -> List[Document]:
+    """
+    Documents without text (only the index id): read from the document store after the fusion.
+    """
+
+    return [Document(page_content="", metadata={"index_id": index_id}) for score, index_id in results]
+
+
+class MmapVectorRetriever(BaseRetriever):
+    """
+    Semantic retriever on the memory-mapped vectors (lazy: documents without text, for the FusionRetriever).
+    """
+
+    index: Any
+    embedding_model: Any
+    k: int = VECTORDB_MAX_RESULTS
+    lazy: bool = False
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = self.embedding_model.embed_query(query)
+        if self.lazy:
+            return lazy_documents(self.index.search_vector_ids(query_vector, self.k, query_filters(run_manager)))
+        return [document for score, document in self.index.search_vector(query_vector, self.k, query_filters(run_manager))]
+
+
+class MmapBM25Retriever(BaseRetriever):
+    """
+    Keyword retriever on the memory-mapped BM25 postings (lazy: documents without text, for the FusionRetriever).
+    """
+
+    index: Any
+    k: int = BM25_MAX_RESULTS
+    lazy: bool = False
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.lazy:
+            return lazy_documents(self.index.search_bm25_ids(query, self.k, query_filters(run_manager)))
+        return [document for score, document in self.index.search_bm25(query, self.k, query_filters(run_manager))]
+
+
+class FusionRetriever(BaseRetriever):
+    """
+    Hybrid retriever: Reciprocal Rank Fusion of the results of the retrievers, by document id
+    (same scores as the EnsembleRetriever, without comparing the contents). With an index, the results
+    of the retrievers are lazy documents: only the fused documents are read from the document store.
+    """
+
+    retrievers: List[BaseRetriever]
+    weights: List[float]
+    c: int = 60
+    index: Any = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        scores = {}
+        documents = {}
+        for retriever, weight in zip(self.retrievers, self.weights):
+            for rank, document in enumerate(retriever.invoke(query, config={"callbacks": run_manager.get_child()})):
+                doc_id = document.metadata["index_id"]
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rank + 1 + self.c)
+                documents.setdefault(doc_id, document)
+        ranking = sorted(scores, key=scores.get, reverse=True)
+        if self.index is not None:
+            return self.index.documents(ranking)
+        return [documents[doc_id] for doc_id in ranking]
+
+
+def instanciate_mmap_retriever(path: str, embedding_model) -> FusionRetriever:
+    index = load_mmap_index(path)
+    return FusionRetriever(
+        retrievers=[MmapBM25Retriever(index=index, lazy=True), MmapVectorRetriever(index=index, embedding_model=embedding_model, lazy=True)],
+        weights=[0.5, 0.5],
+        index=index,
+    )
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+"""
+Export of the chunks of an index version (id, text, URL, metadata and embedding) to a Parquet file,
+by record batches, for offline analysis (clusters, duplicates, dimensionality), and import of
+precomputed embeddings from a Parquet file into a new index version (no call to the embedding API).
+Columns: id, document, url, institution, year, metadata (JSON), embedding (fixed size list of float32).
+Schema metadata: source, embedding_model, dimension and normalized. With a memory-mapped index (not
+sharded), the embeddings are exported from vectors.npy without copy (normalized vectors); else they are
+read from the vector DB page by page (vectors of the embedding model). The import checks that the
+embedding model and the dimension are the ones of config.py, and updates the manifest per source file.
+Commands:
+python -m modules.parquet_io_v1 export --output chunks.parquet [--version <version>]
+python -m modules.parquet_io_v1 import chunks.parquet [--replace]
+"""
+
+# v1: export by record batches (memory-mapped vectors or vector DB pages) + bulk import of precomputed embeddings
+# v1: embedding model, dimension and normalization in the schema metadata, checked at import + manifest of the imported files
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.index_store_v1 import build_lock, current_index_path, finish_version, lease, start_version, version_path
+from config.config import *
+
+
+def schema(dimension: int, source: str) -> pa.Schema:
+    return pa.schema([
+        ("id", pa.string()),
+        ("document", pa.string()),
+        ("url", pa.string()),
+        ("institution", pa.string()),
+        ("year", pa.int32()),
+        ("metadata", pa.string()),
+        ("embedding", pa.list_(pa.float32(), dimension)),
+    ], metadata={"source": source, "embedding_model": EMBEDDING_MODEL, "dimension": str(dimension),
+                 "normalized": "true" if source == "mmap" else "false"})  # vectors.npy: normalized for the dot product
+
+
+def record_batch(ids: list[str], documents: list[str], metadatas: list[dict], embeddings, dimension: int, source: str) -> pa.RecordBatch:
+    from modules.doc_store_v1 import chunk_url
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1)  # No copy for float32 vectors
+    metadatas = [metadata or {} for metadata in metadatas]
+    return pa.RecordBatch.from_arrays([
+        pa.array(ids, pa.string()),
+        pa.array(documents, pa.string()),
+        pa.array([chunk_url(document, metadata) for document, metadata in zip(documents, metadatas)], pa.string()),
+        pa.array([metadata.get("institution") for metadata in metadatas], pa.string()),
+        pa.array([metadata.get("year") for metadata in metadatas], pa.int32()),
+        pa.array([json.dumps(metadata, ensure_ascii=False) for metadata in metadatas], pa.string()),
+        pa.FixedSizeListArray.from_arrays(pa.array(embeddings, pa.float32()), dimension),
+    ], schema=schema(dimension, source))
+
+
+def mmap_batches(index_path: str):
+    """
+    Record batches of a memory-mapped index: vectors sliced from vectors.npy, documents from the document store.
+    """
+
+    from modules.doc_store_v1 import DocStore
+
+    vectors = np.load(os.path.join(index_path, "vectors.npy"), mmap_mode="r")
+    doc_store = DocStore(index_path)
+    dimension = vectors.shape[1] if vectors.ndim == 2 else 0
+    for start in range(0, doc_store.size, PARQUET_BATCH_SIZE):
+        chunks = doc_store.get_many(range(start, min(start + PARQUET_BATCH_SIZE, doc_store.size)))
+        yield record_batch([chunk["id"] for chunk in chunks], [chunk["text"] for chunk in chunks], [chunk["metadata"] for chunk in chunks],
+                           vectors[start:start + len(chunks)], dimension, "mmap")
+
+
+def chroma_batches(index_path: str):
+    """
+    Record batches of the vector DB, read page by page (not all the embeddings at once).
+    """
+
+    from modules.providers_v1 import import_chroma
+
+    Chroma, chromadb = import_chroma()
+    collection = Chroma(collection_name=COLLECTION_NAME, persist_directory=index_path)._collection
+    total = collection.count()
+    for offset in range(0, total, PARQUET_BATCH_SIZE):
+        page = collection.get(limit=PARQUET_BATCH_SIZE, offset=offset, include=["documents", "metadatas", "embeddings"])
+        embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+        yield record_batch(page["ids"], page["documents"], page["metadatas"], embeddings, embeddings.shape[1], "chroma")
+
+
+def export_parquet(output_path: str, index_path: str = None) -> int:
+    """
+    Write the chunks of an index version (the published one by default) to a Parquet file. Return the number of chunks.
+    """
+
+    from modules.doc_store_v1 import has_doc_store
+
+    index_path = index_path or current_index_path()
+    writer = None
+    rows = 0
+    with lease(index_path):  # Not garbage collected during the export
+        batches = mmap_batches(index_path) if has_doc_store(index_path) else chroma_batches(index_path)
+        try:
+            for batch in batches:
+                if writer is None:
+                    writer = pq.ParquetWriter(f"{output_path}.tmp", batch.schema, compression="zstd")
+                writer.write_batch(batch)
+                rows = rows + batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+    if writer is None:
+        raise ValueError(f"No chunks in {index_path}")
+    os.replace(f"{output_path}.tmp", output_path)
+    print(f"{rows} chunks of {index_path} written to {output_path}")
+    return rows
+
+
+def check_schema(parquet_file: pq.ParquetFile) -> None:
+    """
+    The embeddings of the file must come from the embedding model of config.py (same vector space and dimension).
+    """
+
+    metadata = {key.decode(): value.decode() for key, value in (parquet_file.schema_arrow.metadata or {}).items()}
+    embedding_type = parquet_file.schema_arrow.field("embedding").type
+    dimension = getattr(embedding_type, "list_size", None)
+    if dimension != EMBEDDING_DIMENSION:
+        raise ValueError(f"Embeddings of dimension {dimension} in the file, {EMBEDDING_DIMENSION} expected (EMBEDDING_DIMENSION)")
+    if metadata.get("embedding_model", EMBEDDING_MODEL) != EMBEDDING_MODEL:
+        raise ValueError(f"Embeddings of {metadata['embedding_model']} in the file, {EMBEDDING_MODEL} expected (EMBEDDING_MODEL)")
+
+
+def source_stats(source: str, documents: list[str], stats: dict) -> None:
+    """
+    Add the chunks of a batch to the manifest statistics of their source file.
+    """
+
+    from modules.manifest_v1 import approx_tokens, file_signature
+
+    if source not in stats:
+        try:
+            signature = file_signature(source)
+        except OSError:
+            signature = {"size": 0, "mtime": 0}  # Source file not on this node
+        file_type = "pdf" if source.endswith(".pdf") else "json"
+        stats[source] = {"type": file_type, "chunks": 0, "tokens": 0, "embedded": True, "records" if file_type == "json" else "pages": 0, **signature}
+    stats[source]["chunks"] = stats[source]["chunks"] + len(documents)
+    stats[source]["records" if stats[source]["type"] == "json" else "pages"] = stats[source]["chunks"]
+    stats[source]["tokens"] = stats[source]["tokens"] + sum(approx_tokens(document or "") for document in documents)
+
+
+def import_parquet(input_path: str, replace: bool = False) -> str:
+    """
+    Bulk load the chunks and their precomputed embeddings of a Parquet file (same columns as the export)
+    into a new version (a copy of the published one, or an empty one with replace), then publish it.
+    The statistics of the source files of the chunks replace the ones of the manifest.
+    """
+
+    from modules.manifest_v1 import update_manifest
+    from modules.providers_v1 import import_chroma, instanciate_embedding_model
+
+    parquet_file = pq.ParquetFile(input_path)
+    check_schema(parquet_file)
+    with build_lock():
+        version, path = start_version(None if replace else current_index_path())
+        try:
+            embedding_model = instanciate_embedding_model()  # Not called: the embeddings are in the file
+            Chroma, chromadb = import_chroma()
+            collection = Chroma(embedding_function=embedding_model, collection_name=COLLECTION_NAME, persist_directory=path)._collection
+            rows = 0
+            stats = {}  # Source file --> manifest statistics
+            for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=["id", "document", "metadata", "embedding"]):
+                embedding_column = batch.column("embedding")
+                dimension = embedding_column.type.list_size
+                embeddings = embedding_column.flatten().to_numpy(zero_copy_only=False).reshape(-1, dimension)
+                metadatas = [{key: value for key, value in json.loads(metadata or "{}").items() if value is not None}  # No None in the vector DB
+                             for metadata in batch.column("metadata").to_pylist()]
+                ids = batch.column("id").to_pylist()
+                documents = batch.column("document").to_pylist()
+                by_source = {}
+                for document, metadata in zip(documents, metadatas):
+                    by_source.setdefault(metadata.get("source", input_path), []).append(document)
+                for source, source_documents in by_source.items():
+                    source_stats(source, source_documents, stats)
+                for with_metadata in (True, False):  # The vector DB refuses empty metadata: chunks without metadata added apart
+                    members = [i for i, metadata in enumerate(metadatas) if bool(metadata) == with_metadata]
+                    if members:
+                        collection.upsert(ids=[ids[i] for i in members], embeddings=embeddings[members], documents=[documents[i] for i in members],
+                                          metadatas=[metadatas[i] for i in members] if with_metadata else None)
+                rows = rows + batch.num_rows
+            update_manifest(stats, path)
+            finish_version(version, path, embedding_model)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+    print(f"{rows} chunks of {input_path} imported in version {version}")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parquet export/import of the chunks and their embeddings")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", nargs="?", help="Parquet file to import")
+    parser.add_argument("--output", help="Parquet file to write (export)")
+    parser.add_argument("--version", help="Version to export (default: the published one)")
+    parser.add_argument("--replace", action="store_true", help="Import in an empty version instead of a copy of the published one")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            if not args.output:
+                parser.error("--output is required")
+            export_parquet(args.output, version_path(args.version) if args.version else None)
+        else:
+            if not args.path:
+                parser.error("the Parquet file to import is required")
+            import_parquet(args.path, replace=args.replace)
+    except (OSError, ValueError, RuntimeError, pa.ArrowException) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+Prompt prefix caching: the prompts are assembled with the static part first, then the chat
+history, then the retrieved context (Knowledge Base). For the providers which need it (Anthropic),
+the prefixes are marked as cacheable (cache_control). OpenAI caches the prefixes automatically.
+The cached input tokens of each call are read from the usage returned by the provider.
+"""
+
+# v1: static prefix first + cache_control breakpoints + cached tokens usage
+# v1: chat history as text (one line per message), breakpoint at the end of its last message
+# v1: no breakpoint after the static prompt alone (shorter than the minimum cached prefix): only the history prefix is cached
+
+from typing import Any, List
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.prompt_values import PromptValue
+from langchain_core.prompts.chat import BaseChatPromptTemplate
+from langchain_core.runnables import Runnable
+
+
+CACHE_BREAKPOINTS = "cache_breakpoints"  # Key of the system message additional_kwargs: end (characters) of the cacheable prefixes
+MAX_CACHE_BREAKPOINTS = 4  # Anthropic limit
+CACHED_VARIABLE = "chat_history"  # The dynamic prompts of this variable end with a cache breakpoint (prefix of the next turn)
+
+
+class CachedPrefixChatPromptTemplate(BaseChatPromptTemplate):
+    """
+    System message = static prompt + dynamic prompts (formatted), followed by the human message.
+    The end of the chat history (its last message) is the cache breakpoint: the static prompt and the
+    history of a turn are a prefix of the next turn. The static prompt alone is not a breakpoint: it is
+    shorter than the minimum prefix cached by the providers (1024 tokens).
+    """
+
+    static_prompt: str
+    dynamic_prompts: List[str]
+    human_prompt: str = "Question: {input}"
+
+    @property
+    def _prompt_type(self) -> str:
+        return "cached-prefix-chat"
+
+    def format_messages(self, **kwargs: Any) -> List[BaseMessage]:
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        if "chat_history" in kwargs:
+            kwargs["chat_history"] = format_history(kwargs["chat_history"])
+        parts = [prompt.format(**kwargs) for prompt in self.dynamic_prompts]
+        breakpoints = []
+        end = len(self.static_prompt)
+        for part, template in zip(parts, self.dynamic_prompts):
+            if f"{{{CACHED_VARIABLE}}}" in template:
+                trailer = template[template.rindex("}") + 1:]  # Fixed text after the last variable
+                breakpoints.append(end + len(part) - len(trailer))
+            end = end + len(part)
+        system_message = SystemMessage(content=self.static_prompt + "".join(parts), additional_kwargs={CACHE_BREAKPOINTS: breakpoints})
+        return [system_message, HumanMessage(content=self.human_prompt.format(**kwargs))]
+
+
+def format_history(chat_history) -> str:
+    """
+    Chat history as text, one line per message: the history of a turn is a prefix of the next one.
+    """
+
+    if isinstance(chat_history, str):
+        return chat_history
+    return "".join(f"{message.type}: {message.content}\n" for message in chat_history)
+
+
+def mark_cache_control(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Split the system message in text blocks at the cache breakpoints, and mark the blocks
+    (prefixes) as cacheable (Anthropic cache_control).
+    """
+
+    marked = []
+    for message in messages:
+        breakpoints = message.additional_kwargs.get(CACHE_BREAKPOINTS) if isinstance(message, SystemMessage) else None
+        if breakpoints and isinstance(message.content, str):
+            blocks = []
+            start = 0
+            for i, end in enumerate(breakpoints + [len(message.content)]):
+                block = {"type": "text", "text": message.content[start:end]}
+                if end < len(message.content) and i < MAX_CACHE_BREAKPOINTS and block["text"].strip():
+                    block["cache_control"] = {"type": "ephemeral"}
+                if block["text"]:
+                    blocks.append(block)
+                start = end
+            message = SystemMessage(content=blocks)
+        marked.append(message)
+    return marked
+
+
+class CacheControlModel(Runnable):
+    """
+    Model wrapper for the providers which need explicit cache marks (Anthropic).
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def _marked(self, input):
+        if isinstance(input, PromptValue):
+            return mark_cache_control(input.to_messages())
+        if isinstance(input, list):
+            return mark_cache_control(input)
+        return input
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.llm.invoke(self._marked(input), config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.llm.ainvoke(self._marked(input), config, **kwargs)
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self.llm.stream(self._marked(input), config, **kwargs)
+
+    async def astream(self, input, config=None, **kwargs):
+        async for chunk in self.llm.astream(self._marked(input), config, **kwargs):
+            yield chunk
+
+
+def token_usage(message) -> dict:
+    """
+    Input tokens and cached input tokens of a model answer (Langchain usage metadata, or the
+    usage of the provider: Anthropic cache_read_input_tokens, OpenAI prompt_tokens_details).
+    """
+
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    if not cached_tokens:
+        provider_usage = (getattr(message, "response_metadata", None) or {}).get("usage") or {}
+        cached_tokens = provider_usage.get("cache_read_input_tokens") or (provider_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return {"input_tokens": input_tokens, "cached_input_tokens": cached_tokens}
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+"""
+Routing of the calls between the model providers: ordered fallback chain, circuit breaker per
+provider, and hedging (if the first provider has not produced a token within the TTFT budget,
+a second provider is called, the first to produce a token wins and the other is cancelled).
+"""
+
+# v1: fallback + circuit breaker + hedging
+
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+
+from langchain_core.runnables import Runnable
+
+from modules.metrics_v1 import PROVIDER_FAILOVERS
+from config.config import *
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a provider: after max_failures failures in a row the circuit is open
+    (the provider is skipped) during reset_timeout seconds, then one call is tried (half open).
+    """
+
+    def __init__(self, max_failures: int = CIRCUIT_BREAKER_FAILURES, reset_timeout: float = CIRCUIT_BREAKER_RESET):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()  # Half open: one call allowed, then open again until the next timeout
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures = self.failures + 1
+            if self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+
+circuit_breakers = {}  # Menu choice --> circuit breaker (shared by all the sessions of the process)
+breakers_lock = threading.Lock()
+
+
+def circuit_breaker(provider: str) -> CircuitBreaker:
+    with breakers_lock:
+        return circuit_breakers.setdefault(provider, CircuitBreaker())
+
+
+class RoutedChatModel(Runnable):
+    """
+    Model calling the providers in order (first the chosen model, then the fallbacks), skipping
+    the providers whose circuit is open. The models are instantiated only when called (get_model).
+    """
+
+    def __init__(self, providers: list[str], get_model, hedging: bool = HEDGING, ttft_budget: float = HEDGE_TTFT_BUDGET):
+        self.providers = providers
+        self.get_model = get_model
+        self.hedging = hedging
+        self.ttft_budget = ttft_budget
+
+    def _available(self, started: set):
+        for provider in self.providers:
+            if provider not in started and circuit_breaker(provider).allow():
+                return provider
+        return None
+
+    def _failed(self, provider: str, reason: str) -> None:
+        circuit_breaker(provider).record_failure()
+        PROVIDER_FAILOVERS.labels(provider=provider, reason=reason).inc()
+        print(f"Provider {provider}: {reason}")
+
+    def _cancelled(self, provider: str) -> None:
+        PROVIDER_FAILOVERS.labels(provider=provider, reason="slower than the hedge").inc()  # Slow, not failed: circuit unchanged
+
+    def invoke(self, input, config=None, **kwargs):
+        output = None
+        for chunk in self.stream(input, config, **kwargs):
+            output = chunk if output is None else output + chunk
+        return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        output = None
+        async for chunk in self.astream(input, config, **kwargs):
+            output = chunk if output is None else output + chunk
+        return output
+
+    def stream(self, input, config=None, **kwargs):
+        events = queue.Queue()  # (provider, kind, payload), kind: chunk, end or error
+        cancels = {}  # Provider --> cancel event
+        started = set()
+
+        def produce(provider, llm, cancel):
+            iterator = None
+            try:
+                iterator = llm.stream(input, config, **kwargs)
+                for chunk in iterator:
+                    if cancel.is_set():
+                        return
+                    events.put((provider, "chunk", chunk))
+                events.put((provider, "end", None))
+            except Exception as e:
+                events.put((provider, "error", e))
+            finally:
+                if iterator is not None:
+                    iterator.close()  # Closed in this thread (the one running it): releases the concurrency slot of the provider
+
+        def start(provider):
+            started.add(provider)
+            cancels[provider] = threading.Event()
+            try:
+                llm = self.get_model(provider)
+            except Exception as e:
+                events.put((provider, "error", e))
+                return
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(produce, provider, llm, cancels[provider]), daemon=True).start()
+
+        provider = self._available(started)
+        if provider is None:
+            raise RuntimeError("No model provider available (all circuits open)")
+        start(provider)
+        running = {provider}
+        winner = None
+        hedged = not self.hedging
+        deadline = time.monotonic() + self.ttft_budget
+        last_error = None
+
+        try:
+            while True:
+                timeout = None if (winner or hedged) else max(0.0, deadline - time.monotonic())
+                try:
+                    provider, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedged = True  # TTFT budget exceeded: hedge with the next provider
+                    hedge = self._available(started)
+                    if hedge:
+                        start(hedge)
+                        running.add(hedge)
+                    continue
+
+                if winner is None:
+                    if kind == "chunk":
+                        winner = provider
+                        circuit_breaker(winner).record_success()
+                        for loser in running - {winner}:
+                            cancels[loser].set()
+                            self._cancelled(loser)
+                        yield payload
+                    elif kind == "end":
+                        circuit_breaker(provider).record_success()
+                        return
+                    else:
+                        last_error = payload
+                        running.discard(provider)
+                        self._failed(provider, f"error: {payload}")
+                        if not running:
+                            fallback = self._available(started)
+                            if fallback is None:
+                                raise last_error
+                            start(fallback)
+                            running.add(fallback)
+                            deadline = time.monotonic() + self.ttft_budget
+                            hedged = not self.hedging
+                elif provider == winner:
+                    if kind == "chunk":
+                        yield payload
+                    elif kind == "end":
+                        return
+                    else:
+                        self._failed(provider, f"error: {payload}")
+                        raise payload
+        finally:
+            for cancel in cancels.values():  # Stop the producers if the answer is not consumed to the end
+                cancel.set()
+
+    async def astream(self, input, config=None, **kwargs):
+        events = asyncio.Queue()
+        tasks = {}  # Provider --> task
+        started = set()
+
+        async def produce(provider):
+            try:
+                llm = self.get_model(provider)
+                async for chunk in llm.astream(input, config, **kwargs):
+                    await events.put((provider, "chunk", chunk))
+                await events.put((provider, "end", None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await events.put((provider, "error", e))
+
+        def start(provider):
+            started.add(provider)
+            tasks[provider] = asyncio.create_task(produce(provider))
+
+        provider = self._available(started)
+        if provider is None:
+            raise RuntimeError("No model provider available (all circuits open)")
+        start(provider)
+        running = {provider}
+        winner = None
+        hedged = not self.hedging
+        deadline = time.monotonic() + self.ttft_budget
+
+        try:
+            while True:
+                timeout = None if (winner or hedged) else max(0.0, deadline - time.monotonic())
+                try:
+                    provider, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedged = True
+                    hedge = self._available(started)
+                    if hedge:
+                        start(hedge)
+                        running.add(hedge)
+                    continue
+
+                if winner is None:
+                    if kind == "chunk":
+                        winner = provider
+                        circuit_breaker(winner).record_success()
+                        for loser in running - {winner}:
+                            tasks[loser].cancel()
+                            self._cancelled(loser)
+                        yield payload
+                    elif kind == "end":
+                        circuit_breaker(provider).record_success()
+                        return
+                    else:
+                        running.discard(provider)
+                        self._failed(provider, f"error: {payload}")
+                        if not running:
+                            fallback = self._available(started)
+                            if fallback is None:
+                                raise payload
+                            start(fallback)
+                            running.add(fallback)
+                            deadline = time.monotonic() + self.ttft_budget
+                            hedged = not self.hedging
+                elif provider == winner:
+                    if kind == "chunk":
+                        yield payload
+                    elif kind == "end":
+                        return
+                    else:
+                        self._failed(provider, f"error: {payload}")
+                        raise payload
+        finally:
+            for task in tasks.values():
+                task.cancel()
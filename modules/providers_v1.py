@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+"""
+Instantiate the embedding model and the chat models (LLM) from the providers
+(OpenAI, Anthropic, Google VertexAI, Ollama, or the offline fake providers).
+The SDK of a provider is imported only when its model is used for the first time
+(registry of the providers), to cut the start time of the app.
+The models are instantiated once per process and shared by all the sessions, with their
+HTTP connection pools (keep-alive, HTTP/2) and a cap of the concurrent calls per provider.
+Import time profile of the providers: python -m modules.providers_v1 --profile
+"""
+
+# v1: move the model instanciation from the backend + fake providers
+# v1: registry of the providers with lazy imports + import time profile
+# v1: pool of long-lived models and HTTP clients + max concurrent calls per provider
+# v1: routing between the providers (fallback, circuit breaker, hedging)
+# v1: prompt prefix caching (cache marks for Anthropic and the fake LLM, usage of OpenAI streamed)
+# v1: cache of the query embeddings (LRU)
+# v1: pooled HTTP clients also for Anthropic (SDK clients) + error if no provider for the model
+
+import argparse
+import asyncio
+import importlib
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+import streamlit as st
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable
+
+from modules.metrics_v1 import CACHE_HITS
+from modules.provider_router_v1 import RoutedChatModel
+from modules.prompt_cache_v1 import CacheControlModel
+from modules.tracing_v1 import TracedEmbeddings
+from config.config import *
+
+
+def http_clients(provider: str) -> dict:
+    """
+    HTTP clients (sync and async) of a provider, with a pool of keep-alive HTTP/2 connections.
+    Created once per process.
+    """
+
+    with pool_lock:
+        if provider not in http_client_pool:
+            limits = httpx.Limits(max_connections=HTTP_POOL_MAX_CONNECTIONS, max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+            http_client_pool[provider] = {
+                "http_client": httpx.Client(http2=True, limits=limits, timeout=HTTP_TIMEOUT),
+                "http_async_client": httpx.AsyncClient(http2=True, limits=limits, timeout=HTTP_TIMEOUT),
+            }
+    return http_client_pool[provider]
+
+
+def anthropic_clients(llm) -> dict:
+    """
+    Anthropic SDK clients (sync and async) of the model on the pooled HTTP clients. ChatAnthropic has
+    no http_client argument: its SDK clients are replaced once the model is instantiated.
+    """
+
+    anthropic = sys.modules["anthropic"]  # Imported by langchain_anthropic
+    clients = http_clients("anthropic")
+    params = {"api_key": llm.anthropic_api_key.get_secret_value(), "base_url": llm.anthropic_api_url, "max_retries": llm.max_retries}
+    return {"_client": anthropic.Anthropic(**params, http_client=clients["http_client"]),
+            "_async_client": anthropic.AsyncAnthropic(**params, http_client=clients["http_async_client"])}
+
+
+# Menu choice --> (module, class, keyword arguments of the model for a temperature)
+LLM_PROVIDERS = {
+    OPENAI_MENU: ("langchain_openai", "ChatOpenAI", lambda temperature: {"model": OPENAI_MODEL, "temperature": temperature, "stream_usage": True, **http_clients("openai")}),
+    ANTHROPIC_MENU: ("langchain_anthropic", "ChatAnthropic", lambda temperature: {"model_name": ANTHROPIC_MODEL, "temperature": temperature, "max_tokens": 4000}),
+    VERTEXAI_MENU: ("langchain_google_vertexai", "ChatVertexAI", lambda temperature: {"model_name": VERTEXAI_MODEL, "temperature": temperature, "max_output_tokens": 4000}),
+    OLLAMA_MENU: ("langchain_community.chat_models", "ChatOllama", lambda temperature: {"model": OLLAMA_MODEL, "temperature": temperature, "base_url": OLLAMA_URL}),
+    FAKE_MENU: ("modules.fake_providers_v1", "FakeChatModel", lambda temperature: {"ttft": FAKE_LLM_TTFT, "tokens_per_second": FAKE_LLM_TOKENS_PER_SECOND, "answer_tokens": FAKE_LLM_ANSWER_TOKENS, "prefill_per_1k_tokens": FAKE_LLM_PREFILL_PER_1K_TOKENS}),
+}
+
+# Menu choice --> SDK clients set on the model (providers without http_client argument).
+# VertexAI is not listed: its SDK calls the API over gRPC, the channel is kept by the pooled model.
+SDK_CLIENTS = {ANTHROPIC_MENU: anthropic_clients}
+
+# Providers which cache the prompt prefixes only if they are marked (cache_control)
+PROMPT_CACHE_PROVIDERS = {ANTHROPIC_MENU, FAKE_MENU}
+
+# EMBEDDING_PROVIDER --> (module, class, keyword arguments of the embedding model)
+EMBEDDING_PROVIDERS = {
+    "openai": ("langchain_openai", "OpenAIEmbeddings", lambda: {"model": EMBEDDING_MODEL, **http_clients("openai")}),  # 3072 dimensions vectors used to embed the JSON items and the questions
+    "fake": ("modules.fake_providers_v1", "FakeEmbeddings", lambda: {"dimension": EMBEDDING_DIMENSION}),
+}
+
+import_times = {}  # Module --> import time (seconds) in this process
+import_lock = threading.Lock()
+
+# Pools shared by all the sessions of the process
+pool_lock = threading.Lock()
+http_client_pool = {}  # Provider --> HTTP clients
+llm_pool = {}  # (menu choice, temperature) --> model
+embedding_pool = {}  # EMBEDDING_PROVIDER --> embedding model
+provider_semaphores = {}  # Menu choice --> max concurrent calls
+
+
+class ConcurrencyLimitedModel(Runnable):
+    """
+    Model wrapper: at most max_concurrency calls in progress for the provider (all sessions).
+    """
+
+    def __init__(self, llm, semaphore: threading.BoundedSemaphore):
+        self.llm = llm
+        self.semaphore = semaphore
+
+    async def _acquire(self) -> None:
+        while not self.semaphore.acquire(blocking=False):  # Polling: no thread left blocked if the task is cancelled
+            await asyncio.sleep(0.01)
+
+    def invoke(self, input, config=None, **kwargs):
+        with self.semaphore:
+            return self.llm.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        await self._acquire()
+        try:
+            return await self.llm.ainvoke(input, config, **kwargs)
+        finally:
+            self.semaphore.release()
+
+    def stream(self, input, config=None, **kwargs):
+        with self.semaphore:
+            yield from self.llm.stream(input, config, **kwargs)
+
+    async def astream(self, input, config=None, **kwargs):
+        await self._acquire()
+        try:
+            async for chunk in self.llm.astream(input, config, **kwargs):
+                yield chunk
+        finally:
+            self.semaphore.release()
+
+
+def import_class(module_name: str, class_name: str):
+    """
+    Import the class of a provider (the module is imported only once) and record the import time.
+    """
+
+    with import_lock:
+        if module_name not in sys.modules:
+            start = time.perf_counter()
+            importlib.import_module(module_name)
+            import_times[module_name] = time.perf_counter() - start
+            print(f"Provider module {module_name} imported in {import_times[module_name]:.2f} s")
+    return getattr(sys.modules[module_name], class_name)
+
+
+def use_pysqlite3() -> None:
+    """
+    Only to be able to run on Github Codespace: replace sqlite3 by pysqlite3 (before importing chromadb).
+    """
+
+    if getattr(sys.modules.get("sqlite3"), "__name__", "") != "pysqlite3":
+        __import__('pysqlite3')
+        sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+
+def import_chroma():
+    """
+    Import the vector DB (Chroma) on first use. Return the Chroma class and the chromadb module.
+    """
+
+    with import_lock:
+        if "langchain_chroma" not in sys.modules:
+            start = time.perf_counter()
+            use_pysqlite3()
+            importlib.import_module("chromadb")
+            importlib.import_module("langchain_chroma")
+            import_times["langchain_chroma"] = time.perf_counter() - start
+            print(f"Vector DB modules imported in {import_times['langchain_chroma']:.2f} s")
+    return sys.modules["langchain_chroma"].Chroma, sys.modules["chromadb"]
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings of the questions kept in a LRU cache (QUERY_EMBEDDING_CACHE_SIZE): the same question
+    (ex: the example questions, pre-embedded by the warm-up) is embedded once per process.
+    """
+
+    def __init__(self, embedding_model, size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embedding_model = embedding_model
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embedding_model.embed_documents(texts)
+
+    def cached(self, text):
+        with self.lock:
+            if text in self.cache:
+                self.cache.move_to_end(text)
+                CACHE_HITS.labels(cache="query_embedding").inc()
+                return self.cache[text]
+        return None
+
+    def store(self, text, vector):
+        with self.lock:
+            self.cache[text] = vector
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        return vector
+
+    def embed_query(self, text):
+        vector = self.cached(text)
+        return vector if vector is not None else self.store(text, self.embedding_model.embed_query(text))
+
+    async def aembed_query(self, text):
+        vector = self.cached(text)
+        return vector if vector is not None else self.store(text, await self.embedding_model.aembed_query(text))
+
+
+def instanciate_embedding_model():
+    """
+    Instantiate the embedding model chosen in config.py (EMBEDDING_PROVIDER).
+    """
+
+    if EMBEDDING_PROVIDER in embedding_pool:
+        CACHE_HITS.labels(cache="embedding_client").inc()
+        return embedding_pool[EMBEDDING_PROVIDER]
+    module_name, class_name, kwargs = EMBEDDING_PROVIDERS[EMBEDDING_PROVIDER]
+    embedding_model = CachedQueryEmbeddings(TracedEmbeddings(import_class(module_name, class_name)(**kwargs())))
+    with pool_lock:
+        return embedding_pool.setdefault(EMBEDDING_PROVIDER, embedding_model)
+
+
+def pooled_llm(model, temperature):
+    """
+    Return the model (LLM) of a menu choice, instantiated once per process.
+    """
+
+    if (model, temperature) in llm_pool:
+        CACHE_HITS.labels(cache="llm_client").inc()
+        return llm_pool[(model, temperature)]
+    module_name, class_name, kwargs = LLM_PROVIDERS[model]
+    llm = import_class(module_name, class_name)(**kwargs(temperature))
+    if model in SDK_CLIENTS:
+        for name, client in SDK_CLIENTS[model](llm).items():
+            object.__setattr__(llm, name, client)  # Private attributes of the (pydantic) model
+    if model in PROMPT_CACHE_PROVIDERS:
+        llm = CacheControlModel(llm)
+    with pool_lock:
+        semaphore = provider_semaphores.setdefault(model, threading.BoundedSemaphore(PROVIDER_MAX_CONCURRENCY.get(model, 16)))
+        return llm_pool.setdefault((model, temperature), ConcurrencyLimitedModel(llm, semaphore))
+
+
+def instanciate_llm(model, temperature):
+    """
+    Instantiate the model (LLM) chosen in the menu. With fallbacks (PROVIDER_FALLBACKS), the calls
+    are routed to the next provider if the chosen one fails, is skipped (circuit breaker) or is slow (hedging).
+    """
+
+    providers = [model] if model in LLM_PROVIDERS else []
+    providers = providers + [provider for provider in PROVIDER_FALLBACKS if provider not in providers and provider in LLM_PROVIDERS]
+    if not providers:
+        raise ValueError(f"No model available for {model}! Models: {list(LLM_PROVIDERS)}, fallbacks: {PROVIDER_FALLBACKS}")
+
+    try:
+
+        if model not in LLM_PROVIDERS:
+            st.write(f"Error: No model available for {model}! Fallbacks used: {PROVIDER_FALLBACKS}")
+
+        if len(providers) == 1:
+            llm = pooled_llm(providers[0], temperature)
+        else:
+            llm = RoutedChatModel(providers, lambda provider: pooled_llm(provider, temperature))
+
+    except Exception as e:
+        st.write("Error: Cannot instanciate any model!")
+        st.write(f"Error: {e}")
+        llm = None
+
+    return llm
+
+
+def profile_imports() -> list[dict]:
+    """
+    Cold import time of each provider module, each measured in a fresh Python process.
+    """
+
+    # Name --> (setup not measured, statement measured)
+    modules = {"chromadb + langchain_chroma": ("import modules.providers_v1 as p", "p.import_chroma()")}
+    for menu, (module_name, class_name, kwargs) in LLM_PROVIDERS.items():
+        modules[f"{menu} ({module_name})"] = ("pass", f"import {module_name}")
+    for provider, (module_name, class_name, kwargs) in EMBEDDING_PROVIDERS.items():
+        modules[f"embedding {provider} ({module_name})"] = ("pass", f"import {module_name}")
+
+    report = []
+    for name, (setup, statement) in modules.items():
+        code = f"import time; {setup}; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if result.returncode == 0:
+            report.append({"module": name, "import_s": round(float(result.stdout.split()[-1]), 3)})
+        else:
+            report.append({"module": name, "error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "error"})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Providers of the models.")
+    parser.add_argument("--profile", action="store_true", help="Cold import time of each provider module")
+    args = parser.parse_args()
+    if args.profile:
+        for line in profile_imports():
+            if "error" in line:
+                print(f"{line['module']}: error: {line['error']}")
+            else:
+                print(f"{line['module']}: {line['import_s']} s")
+
+
+if __name__ == "__main__":
+    main()
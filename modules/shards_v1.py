@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+Sharded index: the memory-mapped index of a version is split in shards (by institution or by hash
+of the chunk id), each with its own vectors and BM25 postings (with the BM25 statistics of the whole
+corpus: global IDF, the scores of the shards can be compared). A query is sent to all the shards in
+parallel (thread pool) and their top-k (ids) are merged; the documents of the final results are then
+read from the document store of their shard.
+A shard can be moved to another node: copy its directory (<version>/shards/<name>) and serve it with
+python -m modules.shards_v1 serve <shard directory> --host <address of the node> --port 9500 (127.0.0.1 by
+default: XML-RPC without authentication, to expose on a private network only), then add its URL to
+SHARD_ENDPOINTS (config.py): the shard is then queried by RPC (XML-RPC) instead of locally.
+If a shard does not answer, the results of the other shards are returned and marked partial (metadata
+"partial": names of the shards missing); if no shard answers, the search fails.
+"""
+
+# v1: split by institution or hash + scatter-gather on a thread pool + XML-RPC shard server/client
+# v1: search by ids + documents read only for the results of the fusion
+# v1: partial results marked + error if no shard answers + lazy connection to the remote shards + server on 127.0.0.1
+
+import argparse
+import heapq
+import os
+import socketserver
+import threading
+import xmlrpc.client
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from xmlrpc.server import SimpleXMLRPCServer
+
+import numpy as np
+from langchain_core.documents import Document
+
+from modules.mmap_index_v1 import MmapIndex, build_mmap_index, corpus_stats
+from config.config import *
+
+
+executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+
+
+def shard_of(chunk_id: str, metadata: dict) -> str:
+    if INDEX_SHARDING == "institution":
+        return (metadata or {}).get("institution") or "other"
+    return f"{zlib.crc32(chunk_id.encode('utf-8')) % INDEX_SHARDS:02d}"
+
+
+def build_shards(path: str, ids: list[str], documents: list[str], metadatas: list[dict], embeddings) -> list[str]:
+    """
+    Split the chunks in shards (INDEX_SHARDING) and build the memory-mapped index of each shard
+    in <path>/shards/<name>, with the BM25 statistics of the whole corpus. Return the names.
+    """
+
+    stats = corpus_stats(documents)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    members = {}
+    for i, chunk_id in enumerate(ids):
+        members.setdefault(shard_of(chunk_id, metadatas[i]), []).append(i)
+    for name, indexes in sorted(members.items()):
+        build_mmap_index(os.path.join(path, "shards", name), [ids[i] for i in indexes], [documents[i] for i in indexes],
+                         [metadatas[i] for i in indexes], embeddings[indexes], stats)
+    return sorted(members)
+
+
+class TimeoutTransport(xmlrpc.client.Transport):
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = SHARD_TIMEOUT
+        return connection
+
+
+class ShardClient:
+    """
+    Shard served by another node (XML-RPC): same search methods as a local shard.
+    """
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.local = threading.local()  # One connection per thread (ServerProxy is not thread-safe)
+        self._size = None
+
+    @property
+    def size(self) -> int:
+        """
+        Number of chunks of the shard, asked on first use (0 while the shard is not available, asked again later).
+        """
+
+        if self._size is None:
+            try:
+                self._size = self.proxy().size()
+            except (OSError, xmlrpc.client.Error) as e:
+                print(f"Error: shard {self.name} not available at {self.url}: {e}")
+                return 0
+        return self._size
+
+    def proxy(self):
+        if not hasattr(self.local, "proxy"):
+            self.local.proxy = xmlrpc.client.ServerProxy(self.url, transport=TimeoutTransport(), allow_none=True)
+        return self.local.proxy
+
+    @staticmethod
+    def to_documents(results) -> list[tuple[float, Document]]:
+        return [(score, Document(page_content=page_content, metadata=metadata)) for score, page_content, metadata in results]
+
+    def search_vector(self, query_vector, k: int, filters=None) -> list[tuple[float, Document]]:
+        return self.to_documents(self.proxy().search_vector([float(value) for value in query_vector], k, filters))
+
+    def search_bm25(self, query: str, k: int, filters=None) -> list[tuple[float, Document]]:
+        return self.to_documents(self.proxy().search_bm25(query, k, filters))
+
+    def search_vector_ids(self, query_vector, k: int, filters=None) -> list[tuple[float, str]]:
+        return [(score, index_id) for score, index_id in self.proxy().search_vector_ids([float(value) for value in query_vector], k, filters)]
+
+    def search_bm25_ids(self, query: str, k: int, filters=None) -> list[tuple[float, str]]:
+        return [(score, index_id) for score, index_id in self.proxy().search_bm25_ids(query, k, filters)]
+
+    def documents(self, index_ids: list) -> list[Document]:
+        return [Document(page_content=page_content, metadata=metadata) for page_content, metadata in self.proxy().documents(list(index_ids))]
+
+
+class ShardedIndex:
+    """
+    Scatter-gather on the shards: the search is run on all the shards in parallel, and the top-k
+    of the results of all the shards is returned.
+    """
+
+    def __init__(self, shards: list):
+        self.shards = shards
+        self.local = threading.local()  # Shards which did not answer the searches of the query in progress (this thread)
+
+    @property
+    def size(self) -> int:
+        return sum(shard.size for shard in self.shards)
+
+    def unavailable(self) -> set:
+        if not hasattr(self.local, "unavailable"):
+            self.local.unavailable = set()
+        return self.local.unavailable
+
+    @staticmethod
+    def mark_partial(documents: list[Document], unavailable: set) -> None:
+        for document in documents:
+            document.metadata["partial"] = sorted(unavailable)
+
+    @classmethod
+    def open(cls, path: str) -> "ShardedIndex":
+        shards = []
+        for name in sorted(os.listdir(os.path.join(path, "shards"))):
+            if name in SHARD_ENDPOINTS:
+                shards.append(ShardClient(name, SHARD_ENDPOINTS[name]))  # Shard moved to another node
+            else:
+                shards.append(MmapIndex(os.path.join(path, "shards", name), name=name))
+        return cls(shards)
+
+    def gather(self, method: str, query, k: int, filters) -> list[tuple[float, Document]]:
+        futures = [executor.submit(getattr(shard, method), query, k, filters) for shard in self.shards]
+        results = []
+        unavailable = set()
+        for shard, future in zip(self.shards, futures):
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                print(f"Error: shard {getattr(shard, 'name', '')} not available: {e}")  # Partial results
+                unavailable.add(getattr(shard, "name", ""))
+        if self.shards and len(unavailable) == len(self.shards):
+            raise RuntimeError(f"No shard available ({', '.join(sorted(unavailable))})")
+        results = heapq.nlargest(k, results, key=lambda result: result[0])
+        if unavailable and method.endswith("_ids"):
+            self.unavailable().update(unavailable)  # Marked on the documents read for these ids
+        elif unavailable:
+            self.mark_partial([document for score, document in results], unavailable)
+        return results
+
+    def search_vector(self, query_vector, k: int, filters=None) -> list[tuple[float, Document]]:
+        return self.gather("search_vector", query_vector, k, filters)
+
+    def search_bm25(self, query: str, k: int, filters=None) -> list[tuple[float, Document]]:
+        return self.gather("search_bm25", query, k, filters)
+
+    def search_vector_ids(self, query_vector, k: int, filters=None) -> list[tuple[float, str]]:
+        return self.gather("search_vector_ids", query_vector, k, filters)
+
+    def search_bm25_ids(self, query: str, k: int, filters=None) -> list[tuple[float, str]]:
+        return self.gather("search_bm25_ids", query, k, filters)
+
+    def documents(self, index_ids: list) -> list[Document]:
+        """
+        Documents of ids "<shard>/<id>", read from their shards (one call per shard), in the order of the ids.
+        If a shard did not answer (this call or the searches of the ids), the documents are marked partial.
+        """
+
+        by_shard = {}
+        for index_id in index_ids:
+            by_shard.setdefault(index_id.split("/", 1)[0], []).append(index_id)
+        shards = {shard.name: shard for shard in self.shards}
+        documents = {}
+        for name, shard_ids in by_shard.items():
+            try:
+                documents.update(zip(shard_ids, shards[name].documents(shard_ids)))
+            except Exception as e:
+                print(f"Error: shard {name} not available: {e}")
+                self.unavailable().add(name)
+        if by_shard and not documents:
+            self.local.unavailable = set()
+            raise RuntimeError(f"No shard available ({', '.join(sorted(by_shard))})")
+        results = [documents[index_id] for index_id in index_ids if index_id in documents]
+        if self.unavailable():
+            self.mark_partial(results, self.unavailable())
+        self.local.unavailable = set()  # Query done
+        return results
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def serve(path: str, host: str, port: int) -> None:
+    """
+    Serve one shard (directory of its memory-mapped index) by XML-RPC.
+    """
+
+    shard = MmapIndex(path, name=os.path.basename(os.path.normpath(path)))
+    to_rpc = lambda results: [[float(score), document.page_content, document.metadata] for score, document in results]
+    ids_to_rpc = lambda results: [[float(score), index_id] for score, index_id in results]
+    server = ThreadingXMLRPCServer((host, port), allow_none=True, logRequests=False)
+    server.register_function(lambda: shard.size, "size")
+    server.register_function(lambda query_vector, k, filters: to_rpc(shard.search_vector(query_vector, k, filters)), "search_vector")
+    server.register_function(lambda query, k, filters: to_rpc(shard.search_bm25(query, k, filters)), "search_bm25")
+    server.register_function(lambda query_vector, k, filters: ids_to_rpc(shard.search_vector_ids(query_vector, k, filters)), "search_vector_ids")
+    server.register_function(lambda query, k, filters: ids_to_rpc(shard.search_bm25_ids(query, k, filters)), "search_bm25_ids")
+    server.register_function(lambda index_ids: [[document.page_content, document.metadata] for document in shard.documents(index_ids)], "documents")
+    print(f"Shard {shard.name} ({shard.size} chunks) served on {host}:{port}")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard server (XML-RPC)")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("path", help="Directory of the shard (<version>/shards/<name>)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the node on the private network to serve other nodes")
+    parser.add_argument("--port", type=int, default=9500)
+    args = parser.parse_args()
+    serve(args.path, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+Portable snapshot of an index version: one archive (tar compressed on the fly with zstd, or gzip if
+the zstandard package is not installed) with all the files of the version (vector DB, BM25 index,
+memory-mapped vectors and postings, document store, manifest), a header (format version, source
+version, embedding model and dimension) and the sha256 of each file. A snapshot of another embedding
+model is refused (its vectors would not match the query embeddings). A new node imports the snapshot as a new version (checked,
+then published): it serves without embedding the files again.
+Commands:
+python -m modules.snapshot_v1 export --output index.snapshot [--version <version>]
+python -m modules.snapshot_v1 import index.snapshot [--no-publish]
+"""
+
+# v1: streaming export/import (tar + zstd/gzip) + format version + sha256 checksums
+# v1: embedding model and dimension in the header, checked at import
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+
+from modules.index_store_v1 import BUILDING_MARKER, build_lock, collect_garbage, current_index_path, lease, new_version, publish, version_path
+from config.config import *
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SNAPSHOT_FORMAT = 1  # Version of the archive layout (header.json, index/, checksums.json)
+HEADER_NAME = "header.json"
+CHECKSUMS_NAME = "checksums.json"
+INDEX_DIR = "index"
+READ_SIZE = 1024 * 1024
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def add_json(archive: tarfile.TarFile, name: str, data: dict) -> None:
+    content = json.dumps(data, indent=2).encode("utf-8")
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(content))
+
+
+class HashingReader:
+    """
+    File object computing the sha256 of what is read (the file is read once, by the tar writer).
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file_obj.read(size)
+        self.sha256.update(data)
+        return data
+
+
+def export_snapshot(output_path: str, index_path: str = None) -> dict:
+    """
+    Write the snapshot of an index version (the published one by default). Return the header.
+    """
+
+    index_path = index_path or current_index_path()
+    if not os.path.isdir(index_path) or os.path.exists(os.path.join(index_path, BUILDING_MARKER)):
+        raise ValueError(f"No finished index in {index_path}")
+
+    with lease(index_path):  # Not garbage collected during the export
+        codec = "zstd" if SNAPSHOT_CODEC == "zstd" and zstandard is not None else "gzip"
+        header = {"format": SNAPSHOT_FORMAT, "codec": codec, "source_version": os.path.basename(os.path.normpath(index_path)),
+                  "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "index_backend": INDEX_BACKEND,
+                  "embedding_model": EMBEDDING_MODEL, "embedding_dimension": EMBEDDING_DIMENSION}
+        checksums = {}
+        with open(f"{output_path}.tmp", "wb") as output_file:
+            if codec == "zstd":
+                stream = zstandard.ZstdCompressor(level=SNAPSHOT_LEVEL).stream_writer(output_file, closefd=False)
+            else:
+                stream = gzip.GzipFile(fileobj=output_file, mode="wb", compresslevel=SNAPSHOT_LEVEL)
+            with tarfile.open(fileobj=stream, mode="w|") as archive:
+                add_json(archive, HEADER_NAME, header)
+                for root, dirs, files in os.walk(index_path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name == BUILDING_MARKER or name.endswith(".tmp"):
+                            continue
+                        path = os.path.join(root, name)
+                        relative_path = os.path.relpath(path, index_path)
+                        info = archive.gettarinfo(path, arcname=f"{INDEX_DIR}/{relative_path}")
+                        with open(path, "rb") as index_file:
+                            reader = HashingReader(index_file)
+                            archive.addfile(info, reader)
+                        checksums[relative_path] = reader.sha256.hexdigest()
+                add_json(archive, CHECKSUMS_NAME, checksums)  # Last: computed while the files are written
+            stream.close()
+            output_file.flush()
+            os.fsync(output_file.fileno())
+    os.replace(f"{output_path}.tmp", output_path)
+    print(f"Snapshot of {index_path} ({len(checksums)} files) written to {output_path}")
+    return header
+
+
+def open_snapshot(input_file):
+    magic = input_file.read(4)
+    input_file.seek(0)
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("Snapshot compressed with zstd: the zstandard package is required")
+        return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(input_file), mode="r|")
+    return tarfile.open(fileobj=input_file, mode="r|*")
+
+
+def check_header(header: dict) -> None:
+    """
+    The vectors of the snapshot must come from the embedding model of config.py.
+    """
+
+    model, dimension = header.get("embedding_model"), header.get("embedding_dimension")
+    if model is None or dimension is None:
+        raise ValueError("Snapshot without embedding model (exported before it was recorded): export it again")
+    if model != EMBEDDING_MODEL or dimension != EMBEDDING_DIMENSION:
+        raise ValueError(f"Snapshot of {model} ({dimension} dimensions), {EMBEDDING_MODEL} ({EMBEDDING_DIMENSION} dimensions) expected")
+
+
+def import_snapshot(input_path: str, publish_version: bool = True) -> str:
+    """
+    Extract a snapshot in a new version (read once, streamed), check the format and the checksums,
+    then publish the version. Return the version.
+    """
+
+    with build_lock():
+        version = new_version()
+        path = version_path(version)
+        os.makedirs(path)
+        open(os.path.join(path, BUILDING_MARKER), "w").close()
+        header, checksums, written = None, None, {}
+        try:
+            with open(input_path, "rb") as input_file, open_snapshot(input_file) as archive:
+                for member in archive:
+                    if member.name == HEADER_NAME:
+                        header = json.load(archive.extractfile(member))
+                        if header.get("format") != SNAPSHOT_FORMAT:
+                            raise ValueError(f"Snapshot format {header.get('format')} not supported (expected {SNAPSHOT_FORMAT})")
+                        check_header(header)
+                    elif member.name == CHECKSUMS_NAME:
+                        checksums = json.load(archive.extractfile(member))
+                    elif member.isfile() and member.name.startswith(f"{INDEX_DIR}/"):
+                        if header is None:
+                            raise ValueError("Snapshot without header")
+                        relative_path = os.path.normpath(member.name[len(INDEX_DIR) + 1:])
+                        if os.path.isabs(relative_path) or relative_path.startswith(".."):
+                            raise ValueError(f"Unsafe path in the snapshot: {member.name}")
+                        target = os.path.join(path, relative_path)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        sha256 = hashlib.sha256()
+                        source = archive.extractfile(member)
+                        with open(target, "wb") as target_file:
+                            while data := source.read(READ_SIZE):
+                                sha256.update(data)
+                                target_file.write(data)
+                        written[relative_path] = sha256.hexdigest()
+            if checksums is None:
+                raise ValueError("Snapshot without checksums (truncated?)")
+            if checksums != written:
+                bad = sorted(name for name in set(checksums) | set(written) if checksums.get(name) != written.get(name))
+                raise ValueError(f"Checksums of the snapshot do not match: {', '.join(bad[:5])}")
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        os.remove(os.path.join(path, BUILDING_MARKER))
+        print(f"Snapshot of {header['source_version']} ({len(written)} files) imported as {version}")
+        if publish_version:
+            publish(version)
+            collect_garbage()
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export/import a snapshot of an index version")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", nargs="?", help="Snapshot to import")
+    parser.add_argument("--output", help="Snapshot to write (export)")
+    parser.add_argument("--version", help="Version to export (default: the published one)")
+    parser.add_argument("--no-publish", action="store_true", help="Import without publishing the version")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            if not args.output:
+                parser.error("--output is required")
+            export_snapshot(args.output, version_path(args.version) if args.version else None)
+        else:
+            if not args.path:
+                parser.error("the snapshot to import is required")
+            import_snapshot(args.path, publish_version=not args.no_publish)
+    except (OSError, ValueError, RuntimeError, tarfile.TarError) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
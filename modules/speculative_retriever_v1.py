@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+Speculative history aware retriever: same result as create_history_aware_retriever, but the
+retrieval starts immediately on the raw question while the LLM reformulates the question. When the
+terms of the reformulated question are in the raw question (the question did not need the chat
+history), the speculative results are used, else the speculative retrieval is cancelled (at its next
+stage) and a second retrieval is run on the reformulated question.
+"""
+
+# v1: speculative retrieval in parallel with the reformulation (contextualize) LLM call
+# v1: speculation on the raw question only (accepted if the reformulation adds no terms) + cancelled when rejected
+
+import asyncio
+import contextvars
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+from modules.metrics_v1 import SPECULATIVE_RETRIEVALS
+from modules.tracing_v1 import span
+from config.config import *
+
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+
+
+def terms(text: str) -> set[str]:
+    return {word for word in WORD_PATTERN.findall(text.lower()) if len(word) > 2}
+
+
+def query_overlap(rewritten_question: str, question: str) -> float:
+    """
+    Part of the terms of the reformulated question which are in the raw question.
+    """
+
+    rewritten_terms = terms(rewritten_question)
+    if not rewritten_terms:
+        return 1.0
+    return len(rewritten_terms & terms(question)) / len(rewritten_terms)
+
+
+class SpeculationCancelled(Exception):
+    pass
+
+
+class SpeculationCanceller(BaseCallbackHandler):
+    """
+    Stop a speculative retrieval running in a thread at the start of its next stage (retriever run) once cancelled.
+    """
+
+    raise_error = True  # The exception stops the run
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def on_retriever_start(self, serialized, query, **kwargs) -> None:
+        if self.cancelled.is_set():
+            raise SpeculationCancelled()
+
+
+def create_speculative_history_aware_retriever(llm, retriever, prompt):
+    """
+    Drop-in replacement of create_history_aware_retriever (input: input and chat_history, output: documents).
+    """
+
+    rewrite_chain = prompt | llm | StrOutputParser()
+
+    def decide(rewritten_question: str, query: str):
+        overlap = query_overlap(rewritten_question, query)
+        accepted = overlap >= SPECULATIVE_ACCEPT_OVERLAP
+        SPECULATIVE_RETRIEVALS.labels(outcome="accepted" if accepted else "rejected").inc()
+        return accepted, round(overlap, 3)
+
+    def retrieve(inputs: dict, config):
+        if not inputs.get("chat_history"):
+            return retriever.invoke(inputs["input"], config)
+        query = inputs["input"]
+        canceller = SpeculationCanceller()
+        with span("speculative_retrieval") as speculation:
+            speculative = executor.submit(contextvars.copy_context().run, retriever.with_config(callbacks=[canceller]).invoke, query, config)
+            rewritten_question = rewrite_chain.invoke(inputs, config)
+            accepted, overlap = decide(rewritten_question, query)
+            speculation["attributes"].update(accepted=accepted, overlap=overlap)
+        if accepted:
+            return speculative.result()
+        canceller.cancelled.set()  # Not started: not run. Running: stopped before its next retriever (BM25, vector, documents)
+        speculative.cancel()
+        return retriever.invoke(rewritten_question, config)
+
+    async def aretrieve(inputs: dict, config):
+        if not inputs.get("chat_history"):
+            return await retriever.ainvoke(inputs["input"], config)
+        query = inputs["input"]
+        with span("speculative_retrieval") as speculation:
+            speculative = asyncio.create_task(retriever.ainvoke(query, config))
+            rewritten_question = await rewrite_chain.ainvoke(inputs, config)
+            accepted, overlap = decide(rewritten_question, query)
+            speculation["attributes"].update(accepted=accepted, overlap=overlap)
+        if accepted:
+            return await speculative
+        speculative.cancel()
+        return await retriever.ainvoke(rewritten_question, config)
+
+    # Same run name as create_history_aware_retriever (the tracing finds the contextualize LLM call with it)
+    return RunnableLambda(retrieve, afunc=aretrieve).with_config(run_name="chat_retriever_chain")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+"""
+Streamlit worker started by the supervisor: the process is warmed up (index, retrievers, provider
+connections, example questions) in a background thread while Streamlit starts, so the first user
+does not pay for it. Its health server (port + HEALTH_PORT_OFFSET) serves /healthz, /readyz and
+POST /drain. Same as: streamlit run Assistant.py --server.port=<port>
+"""
+
+# v1: warm-up thread + Streamlit server in the same process
+# v1: side health server (health, readiness, drain)
+
+import argparse
+import threading
+
+from streamlit.web import bootstrap
+
+from modules.health_v1 import start_health_server
+from modules.warmup_v1 import warm_up
+from config.config import *
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamlit worker")
+    parser.add_argument("--port", type=int, default=STREAMLIT_BASE_PORT)
+    parser.add_argument("--address", default="127.0.0.1")
+    args = parser.parse_args()
+
+    start_health_server(args.port + HEALTH_PORT_OFFSET)
+    threading.Thread(target=warm_up, args=(f"worker-{args.port}",), name="warmup", daemon=True).start()
+
+    flag_options = {"server_port": args.port, "server_address": args.address, "server_headless": True}
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run("Assistant.py", False, [], flag_options)
+
+
+if __name__ == "__main__":
+    main()
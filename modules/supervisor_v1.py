@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+"""
+Supervisor of the Streamlit workers: starts STREAMLIT_WORKERS processes (one port each) behind a
+local reverse proxy with session affinity (Nginx, ip_hash: the websocket of a session always reaches
+the same worker), restarts a process which dies, and stops them all on SIGTERM. Without Nginx, one
+worker is started on PROXY_PORT (as before the supervisor).
+The supervisor writes its pid in RUN_DIR/supervisor.pid (used by app.sh instead of "ps | grep").
+With INDEX_BACKEND = "mmap", all the workers map the same index files (memory shared by the page cache).
+The start waits for the workers to be ready (/readyz of each worker). A worker is stopped with a drain
+(the answers being streamed are finished). Rolling restart: one worker at a time, removed from the
+reverse proxy, drained, restarted, and put back when ready: no request is dropped.
+Commands: python -m modules.supervisor_v1 start|stop|status|rolling-restart|run|nginx-config
+"""
+
+# v1: N workers + Nginx (ip_hash) + restart with backoff + pid file
+# v1: workers warmed up before being ready (start waits for them)
+# v1: readiness probes (/readyz), drain of the workers, rolling restart (SIGUSR1)
+# v1: without Nginx, one worker on PROXY_PORT
+
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+from modules.health_v1 import probe
+from config.config import *
+
+
+PID_FILE = os.path.join(RUN_DIR, "supervisor.pid")
+NGINX_CONF = os.path.join(RUN_DIR, "nginx.conf")
+MAX_RESTART_DELAY = 60  # In seconds
+
+
+def worker_ports(workers: int) -> list[int]:
+    return [STREAMLIT_BASE_PORT + i for i in range(workers)]
+
+
+def standalone(proxy: bool) -> bool:
+    """
+    Reverse proxy asked but Nginx not installed: one worker on PROXY_PORT (as before the supervisor).
+    """
+
+    return proxy and shutil.which("nginx") is None
+
+
+def serving_ports(workers: int, proxy: bool) -> list[int]:
+    return [PROXY_PORT] if standalone(proxy) else worker_ports(workers)
+
+
+def health_url(port: int, path: str) -> str:
+    return f"http://127.0.0.1:{port + HEALTH_PORT_OFFSET}{path}"  # Side health server of a worker
+
+
+def wait_workers_ready(ports: list[int], timeout: float = WARMUP_TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(probe(health_url(port, "/readyz")) for port in ports):
+            return True
+        time.sleep(1)
+    return False
+
+
+def nginx_config(workers: int, down: set = frozenset()) -> str:
+    """
+    Nginx config: reverse proxy on PROXY_PORT, session affinity by client IP, websockets (Streamlit).
+    The workers in down (rolling restart) receive no new connection.
+    """
+
+    run_dir = os.path.abspath(RUN_DIR)
+    servers = "\n".join(f"        server 127.0.0.1:{port}{' down' if port in down else ''};" for port in worker_ports(workers))
+    return f"""# Generated by modules/supervisor_v1.py
+pid {run_dir}/nginx.pid;
+error_log {run_dir}/nginx_error.log;
+events {{
+    worker_connections 1024;
+}}
+http {{
+    access_log off;
+    client_body_temp_path {run_dir}/nginx_body;
+    proxy_temp_path {run_dir}/nginx_proxy;
+    upstream streamlit {{
+        ip_hash;
+{servers}
+    }}
+    map $http_upgrade $connection_upgrade {{
+        default upgrade;
+        '' close;
+    }}
+    server {{
+        listen {PROXY_PORT};
+        client_max_body_size 200m;
+        location / {{
+            proxy_pass http://streamlit;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection $connection_upgrade;
+            proxy_set_header Host $host;
+            proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+            proxy_read_timeout 86400;
+        }}
+    }}
+}}
+"""
+
+
+def read_pid():
+    try:
+        with open(PID_FILE) as pid_file:
+            pid = int(pid_file.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+
+class Child:
+    """
+    Process supervised: restarted after a growing delay when it dies.
+    """
+
+    def __init__(self, name: str, command: list[str], port: int = None):
+        self.name = name
+        self.command = command
+        self.port = port  # Streamlit worker: port (its health server: port + HEALTH_PORT_OFFSET)
+        self.process = None
+        self.delay = SUPERVISOR_RESTART_DELAY
+        self.restart_at = 0
+        self.started_at = 0
+
+    def start(self) -> None:
+        log_file = open(os.path.join(RUN_DIR, "logs", f"{self.name}.log"), "ab")
+        self.process = subprocess.Popen(self.command, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        log_file.close()
+        self.started_at = time.monotonic()
+        print(f"{self.name} started (pid {self.process.pid})", flush=True)
+
+    def check(self) -> None:
+        if self.process is None:
+            if time.monotonic() >= self.restart_at:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            if time.monotonic() - self.started_at > MAX_RESTART_DELAY:
+                self.delay = SUPERVISOR_RESTART_DELAY  # Stable again
+            return
+        print(f"{self.name} exited (code {code}), restart in {self.delay}s", flush=True)
+        self.process = None
+        self.restart_at = time.monotonic() + self.delay
+        self.delay = min(self.delay * 2, MAX_RESTART_DELAY)
+
+    def stop(self) -> None:
+        """
+        Stop the process: drain for a worker (it exits when its answers are streamed), else SIGTERM.
+        """
+
+        if self.process is not None and self.process.poll() is None:
+            if self.port is None or not probe(health_url(self.port, "/drain"), method="POST"):
+                self.process.terminate()
+
+    def wait(self, timeout: float) -> None:
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def run(workers: int, proxy: bool) -> None:
+    """
+    Start the workers (and the reverse proxy), restart them when they die, stop them on SIGTERM/SIGINT.
+    """
+
+    os.makedirs(os.path.join(RUN_DIR, "logs"), exist_ok=True)
+    if read_pid() not in (None, os.getpid()):
+        print("Error: the supervisor is already running!")
+        return
+    with open(PID_FILE, "w") as pid_file:
+        pid_file.write(str(os.getpid()))
+
+    nginx_child = None
+    if standalone(proxy):
+        print(f"Error: nginx not found! One worker is started on port {PROXY_PORT} (no reverse proxy).", flush=True)
+        workers_children = [Child(f"worker-{PROXY_PORT}", [sys.executable, "-m", "modules.streamlit_worker_v1", f"--port={PROXY_PORT}", "--address=0.0.0.0"], PROXY_PORT)]
+    else:
+        workers_children = [Child(f"worker-{port}", [sys.executable, "-m", "modules.streamlit_worker_v1", f"--port={port}"], port) for port in worker_ports(workers)]
+    children = list(workers_children)
+    if proxy and not standalone(proxy):
+        with open(NGINX_CONF, "w") as conf_file:
+            conf_file.write(nginx_config(workers))
+        nginx_child = Child("nginx", [shutil.which("nginx"), "-c", os.path.abspath(NGINX_CONF), "-p", os.path.abspath(RUN_DIR), "-g", "daemon off;"])
+        children.append(nginx_child)
+
+    stopping = []
+    rolling = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: rolling.append(signum))
+
+    try:
+        while not stopping:
+            for child in children:
+                child.check()
+            if rolling:
+                rolling.clear()
+                rolling_restart(workers_children, nginx_child, workers)
+            time.sleep(1)
+    finally:
+        for child in workers_children:
+            child.stop()  # Drain: the answers being streamed are finished
+        for child in workers_children:
+            child.wait(timeout=DRAIN_TIMEOUT + 30)
+        if nginx_child:
+            nginx_child.stop()
+            nginx_child.wait(timeout=30)
+        os.remove(PID_FILE)
+        print("Supervisor stopped", flush=True)
+
+
+def reload_nginx(nginx_child, workers: int, down: set = frozenset()) -> None:
+    if nginx_child is None or nginx_child.process is None:
+        return
+    with open(NGINX_CONF, "w") as conf_file:
+        conf_file.write(nginx_config(workers, down))
+    nginx_child.process.send_signal(signal.SIGHUP)  # Graceful reload of the config
+    time.sleep(1)
+
+
+def rolling_restart(workers_children: list, nginx_child, workers: int) -> None:
+    """
+    Restart the workers one at a time: out of the reverse proxy, drained, restarted, back when ready.
+    """
+
+    for child in workers_children:
+        print(f"Rolling restart: {child.name}", flush=True)
+        reload_nginx(nginx_child, workers, down={child.port})
+        child.stop()
+        child.wait(timeout=DRAIN_TIMEOUT + 30)
+        child.start()
+        ready = wait_workers_ready([child.port])
+        reload_nginx(nginx_child, workers)
+        if not ready:
+            print(f"Error: {child.name} not ready after the restart, rolling restart stopped!", flush=True)
+            return
+    print("Rolling restart done", flush=True)
+
+
+def start(workers: int, proxy: bool) -> None:
+    """
+    Start the supervisor in the background (detached from the terminal).
+    """
+
+    if read_pid():
+        print("OK: system already started.")
+        return
+    os.makedirs(os.path.join(RUN_DIR, "logs"), exist_ok=True)
+    log_file = open(os.path.join(RUN_DIR, "logs", "supervisor.log"), "ab")
+    command = [sys.executable, "-m", "modules.supervisor_v1", "run", "--workers", str(workers)] + ([] if proxy else ["--no-proxy"])
+    subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, start_new_session=True)
+    log_file.close()
+    for _ in range(10):
+        time.sleep(0.5)
+        if read_pid():
+            break
+    else:
+        print("ERROR: system process not found!")
+        return
+    ports = serving_ports(workers, proxy)
+    print(f"Waiting for the {len(ports)} workers to be warmed up...")
+    if wait_workers_ready(ports):
+        print(f"OK: system started ({len(ports)} workers, port {PROXY_PORT if proxy else STREAMLIT_BASE_PORT}).")
+    else:
+        print(f"ERROR: workers not ready after {WARMUP_TIMEOUT}s (see {RUN_DIR}/logs)!")
+
+
+def stop() -> None:
+    pid = read_pid()
+    if pid is None:
+        print("OK: system not running.")
+        return
+    os.kill(pid, signal.SIGTERM)
+    while read_pid():
+        print(f"Waiting process ({pid}) to shutdown...")
+        time.sleep(1)
+    print("OK: system stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Supervisor of the Streamlit workers")
+    parser.add_argument("command", choices=["start", "stop", "status", "rolling-restart", "run", "nginx-config"])
+    parser.add_argument("--workers", type=int, default=STREAMLIT_WORKERS, help="Number of Streamlit workers")
+    parser.add_argument("--no-proxy", action="store_true", help="Do not start the reverse proxy (Nginx)")
+    args = parser.parse_args()
+
+    proxy = PROXY and not args.no_proxy
+    if args.command == "run":
+        run(args.workers, proxy)
+    elif args.command == "start":
+        start(args.workers, proxy)
+    elif args.command == "stop":
+        stop()
+    elif args.command == "rolling-restart":
+        pid = read_pid()
+        if pid is None:
+            start(args.workers, proxy)
+        else:
+            os.kill(pid, signal.SIGUSR1)
+            print(f"OK: rolling restart requested (see {RUN_DIR}/logs/supervisor.log).")
+    elif args.command == "status":
+        pid = read_pid()
+        print(f"Running (pid {pid})" if pid else "Not running")
+    else:
+        print(nginx_config(args.workers))
+
+
+if __name__ == "__main__":
+    main()
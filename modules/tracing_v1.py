@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+"""
+Latency tracing of the RAG chain: one span per stage (contextualize LLM call, query embedding,
+vector DB, BM25, fusion, generation and its time to first token).
+The spans are appended to a local JSONL file, one span per line, with the fields of the
+OpenTelemetry (OTLP) spans: traceId, spanId, parentSpanId, name, startTimeUnixNano,
+endTimeUnixNano, attributes. Above TRACES_MAX_BYTES, the file is renamed spans.jsonl.1 (the previous one is dropped).
+"""
+
+# v1: spans from the Langchain callbacks + JSONL sink + p50/p95 per stage + Prometheus metrics fed by the spans
+# v1: rotation of the JSONL file by size + only the tail of the file read
+
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, List
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+from modules.metrics_v1 import observe_span
+from modules.prompt_cache_v1 import token_usage
+from config.config import *
+
+
+# Name of the retriever and chain runs (Langchain) --> name of the stage (span)
+RETRIEVER_STAGES = {"BM25Retriever": "bm25", "VectorStoreRetriever": "vector_db", "EnsembleRetriever": "fusion",
+                    "MmapBM25Retriever": "bm25", "MmapVectorRetriever": "vector_db", "FusionRetriever": "fusion",
+                    "FilteredBM25Retriever": "bm25", "FilteredVectorStoreRetriever": "vector_db"}
+CONTEXTUALIZE_CHAIN = "chat_retriever_chain"  # Run name of the chain created by create_history_aware_retriever
+
+STAGES = ["chat_request", "speculative_retrieval", "contextualize", "query_embedding", "vector_db", "bm25", "fusion", "generation_ttft", "generation"]
+
+current_span = contextvars.ContextVar("current_span", default=None)
+write_lock = threading.Lock()
+READ_SIZE = 1024 * 1024
+
+
+def start_span(name: str, parent: dict = None, **attributes) -> dict:
+    """
+    Open a span. Without parent, the span is a child of the current span (or a new trace).
+    """
+
+    parent = parent or current_span.get()
+    return {
+        "traceId": parent["traceId"] if parent else secrets.token_hex(16),
+        "spanId": secrets.token_hex(8),
+        "parentSpanId": parent["spanId"] if parent else "",
+        "name": name,
+        "startTimeUnixNano": time.time_ns(),
+        "endTimeUnixNano": None,
+        "attributes": dict(attributes),
+    }
+
+
+def end_span(span: dict, **attributes) -> None:
+    """
+    Close a span and write it in the JSONL file.
+    """
+
+    span["endTimeUnixNano"] = time.time_ns()
+    span["attributes"].update(attributes)
+    observe_span(span)
+    if not TRACING:
+        return
+    try:
+        os.makedirs(os.path.dirname(TRACES_PATH), exist_ok=True)
+        with write_lock:
+            with open(TRACES_PATH, "a", encoding="utf-8") as traces_file:
+                traces_file.write(json.dumps(span) + "\n")
+                size = traces_file.tell()
+            if size > TRACES_MAX_BYTES:
+                os.replace(TRACES_PATH, f"{TRACES_PATH}.1")
+    except OSError as e:
+        print(f"Error: Cannot write the span: {e}")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Context manager: the block is traced as a span, and is the parent of the spans opened inside.
+    """
+
+    new_span = start_span(name, **attributes)
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    except Exception as e:
+        new_span["attributes"]["error"] = str(e)
+        raise
+    finally:
+        current_span.reset(token)
+        end_span(new_span)
+
+
+def run_name(serialized: dict, kwargs: dict) -> str:
+    if kwargs.get("name"):
+        return kwargs["name"]
+    if serialized:
+        return serialized.get("name") or serialized.get("id", [""])[-1]
+    return ""
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Langchain callbacks --> spans of the stages of the chain, children of the root span.
+    """
+
+    def __init__(self, root: dict):
+        self.root = root
+        self.names = {}  # run_id --> run name
+        self.parents = {}  # run_id --> parent run_id
+        self.spans = {}  # run_id --> open span
+        self.first_token = set()  # run_id of the LLM runs which produced their first token
+        self.tokens = {}  # run_id --> number of tokens
+        self.lock = threading.Lock()
+
+    def _register(self, run_id, parent_run_id, name):
+        with self.lock:
+            self.names[run_id] = name
+            self.parents[run_id] = parent_run_id
+
+    def _inside(self, run_id, name) -> bool:
+        while run_id is not None:
+            if self.names.get(run_id) == name:
+                return True
+            run_id = self.parents.get(run_id)
+        return False
+
+    def _start(self, run_id, stage, **attributes):
+        self.spans[run_id] = start_span(stage, parent=self.root, **attributes)
+
+    def _end(self, run_id, **attributes):
+        span = self.spans.pop(run_id, None)
+        if span:
+            end_span(span, **attributes)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs: Any) -> None:
+        self._register(run_id, parent_run_id, run_name(serialized, kwargs))
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs: Any) -> None:
+        name = run_name(serialized, kwargs)
+        self._register(run_id, parent_run_id, name)
+        if name in RETRIEVER_STAGES:
+            self._start(run_id, RETRIEVER_STAGES[name])
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id, error=str(error))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs: Any) -> None:
+        self._register(run_id, parent_run_id, run_name(serialized, kwargs))
+        stage = "contextualize" if self._inside(parent_run_id, CONTEXTUALIZE_CHAIN) else "generation"
+        self._start(run_id, stage, model=run_name(serialized, kwargs))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs: Any) -> None:
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, parent_run_id=parent_run_id, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs: Any) -> None:
+        self.tokens[run_id] = self.tokens.get(run_id, 0) + 1
+        span = self.spans.get(run_id)
+        if span and span["name"] == "generation" and run_id not in self.first_token:
+            self.first_token.add(run_id)
+            ttft_span = start_span("generation_ttft", parent=self.root)
+            ttft_span["startTimeUnixNano"] = span["startTimeUnixNano"]
+            end_span(ttft_span)
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        usage = {}
+        try:
+            usage = token_usage(response.generations[0][0].message)
+        except (AttributeError, IndexError):
+            pass
+        self._end(run_id, tokens=self.tokens.pop(run_id, 0), **usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id, error=str(error))
+
+
+class TracedEmbeddings(Embeddings):
+    """
+    Embedding model wrapper: the embedding of the question is traced (query_embedding span).
+    """
+
+    def __init__(self, embedding_model: Embeddings):
+        self.embedding_model = embedding_model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embedding_model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if current_span.get() is None:
+            return self.embedding_model.embed_query(text)
+        with span("query_embedding"):
+            return self.embedding_model.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if current_span.get() is None:
+            return await self.embedding_model.aembed_query(text)
+        with span("query_embedding"):
+            return await self.embedding_model.aembed_query(text)
+
+
+def tail_lines(path: str, count: int) -> list[bytes]:
+    """
+    Last count lines of a file, read backwards by blocks (not the whole file).
+    """
+
+    if count <= 0 or not os.path.exists(path):
+        return []
+    with open(path, "rb") as traces_file:
+        position = traces_file.seek(0, os.SEEK_END)
+        data = b""
+        while position > 0 and data.count(b"\n") <= count:
+            size = min(READ_SIZE, position)
+            position = position - size
+            traces_file.seek(position)
+            data = traces_file.read(size) + data
+    lines = data.splitlines()
+    if position > 0:
+        lines = lines[1:]  # First line cut by the block
+    return lines[-count:]
+
+
+def read_spans(path: str = TRACES_PATH, max_spans: int = TRACES_MAX_SPANS) -> list[dict]:
+    """
+    Read the last max_spans spans of the JSONL file (and of the rotated file if needed).
+    """
+
+    lines = tail_lines(path, max_spans)
+    lines = tail_lines(f"{path}.1", max_spans - len(lines)) + lines
+    spans = []
+    for line in lines:
+        try:
+            spans.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return spans
+
+
+def aggregate_spans(spans: list[dict]) -> list[dict]:
+    """
+    Count, p50, p95 and max duration (ms) of the spans, per stage.
+    """
+
+    durations = {}
+    input_tokens = {}
+    cached_tokens = {}
+    for span in spans:
+        if span.get("endTimeUnixNano"):
+            duration = (span["endTimeUnixNano"] - span["startTimeUnixNano"]) / 1e6
+            durations.setdefault(span["name"], []).append(duration)
+            input_tokens[span["name"]] = input_tokens.get(span["name"], 0) + span["attributes"].get("input_tokens", 0)
+            cached_tokens[span["name"]] = cached_tokens.get(span["name"], 0) + span["attributes"].get("cached_input_tokens", 0)
+
+    def percentile(ordered, p):
+        return round(ordered[min(len(ordered) - 1, max(0, -(-len(ordered) * p // 100) - 1))], 1)
+
+    rows = []
+    for name in STAGES + sorted(set(durations) - set(STAGES)):
+        if name in durations:
+            ordered = sorted(durations[name])
+            row = {"stage": name, "count": len(ordered), "p50_ms": percentile(ordered, 50), "p95_ms": percentile(ordered, 95), "max_ms": round(ordered[-1], 1)}
+            if input_tokens[name]:
+                row["cached_input_tokens_%"] = round(100 * cached_tokens[name] / input_tokens[name], 1)
+            rows.append(row)
+    return rows
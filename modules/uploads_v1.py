@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Uploads of the admin interface: the files are streamed to disk in fixed-size chunks (the content
+hash is computed on the fly), then each finished upload is queued for an incremental ingest of just
+that file (new index version published, without re-embedding the other files). The worker thread
+runs outside of any Streamlit session: its messages are printed, its state is read with ingest_status().
+"""
+
+# v1: chunked streaming writes + sha256 + background ingest queue (one worker thread per process)
+# v1: worker started under a lock + no Streamlit call from the worker thread (status in jobs, messages printed)
+
+import hashlib
+import os
+import queue
+import threading
+import time
+
+from config.config import *
+
+
+ingest_queue = queue.Queue()
+jobs = {}  # File path --> {"sha256", "status", "updated"}: "queued", "indexing", "done (<version>)" or "error: ..."
+jobs_lock = threading.Lock()
+worker = {"thread": None}
+
+
+def save_upload(uploaded_file, directory: str) -> tuple[str, str, int]:
+    """
+    Write an uploaded file in the directory, chunk by chunk (UPLOAD_CHUNK_SIZE), and return
+    its path, its sha256 and its size. The file appears (atomic rename) only when complete.
+    """
+
+    path = os.path.join(directory, os.path.basename(uploaded_file.name))
+    digest = hashlib.sha256()
+    size = 0
+    uploaded_file.seek(0)
+    with open(f"{path}.part", "wb") as file:
+        while True:
+            chunk = uploaded_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            file.write(chunk)
+            size = size + len(chunk)
+    os.replace(f"{path}.part", path)
+    return path, digest.hexdigest(), size
+
+
+def set_status(path: str, sha256: str, status: str) -> None:
+    with jobs_lock:
+        jobs[path] = {"sha256": sha256, "status": status, "updated": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def enqueue_ingest(path: str, sha256: str) -> bool:
+    """
+    Queue the incremental ingest of a file. Return False if this content is already queued or indexed.
+    """
+
+    from modules.index_store_v1 import current_index_path
+    from modules.manifest_v1 import read_manifest
+
+    with jobs_lock:
+        job = jobs.get(path)
+        if job and job["sha256"] == sha256 and not job["status"].startswith("error"):
+            return False
+    if read_manifest(current_index_path())["files"].get(path, {}).get("sha256") == sha256:
+        return False
+    set_status(path, sha256, "queued")
+    ingest_queue.put((path, sha256))
+    with jobs_lock:  # Only one worker thread, even if two sessions upload at the same time
+        if worker["thread"] is None or not worker["thread"].is_alive():
+            worker["thread"] = threading.Thread(target=ingest_worker, name="ingest", daemon=True)
+            worker["thread"].start()
+    return True
+
+
+def ingest_worker() -> None:
+    """
+    Ingest the queued files: the files queued together are ingested in one new index version.
+    """
+
+    from modules.index_store_v1 import add_files
+
+    while True:
+        batch = dict([ingest_queue.get()])
+        while not ingest_queue.empty():
+            path, sha256 = ingest_queue.get()
+            batch[path] = sha256
+        for path, sha256 in batch.items():
+            set_status(path, sha256, "indexing")
+        json_paths = [path for path in batch if path.endswith(".json")]
+        pdf_paths = [path for path in batch if path.endswith(".pdf")]
+        try:
+            version = add_files(json_paths, pdf_paths, hashes=batch)  # Messages printed: no Streamlit context in this thread
+            for path, sha256 in batch.items():
+                set_status(path, sha256, f"done ({version})")
+        except Exception as e:
+            print(f"Error: Cannot ingest the files {', '.join(batch)}: {e}")
+            for path, sha256 in batch.items():
+                set_status(path, sha256, f"error: {e}")
+
+
+def ingest_status() -> list[dict]:
+    with jobs_lock:
+        return [{"file": path, **job} for path, job in sorted(jobs.items())]
@@ -5,59 +5,122 @@ Miscellaneous functions, including function to chunk and embed files.
 """
 
 # v1: move 2 functions from assistant_frontend_v6.py
-
-# Only to be able to run on Github Codespace
-__import__('pysqlite3')
-import sys
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+# v1: statistics manifest of the files and of the index updated by the ingestion
+# v1: exact and near duplicate web pages collapsed before the embedding (DEDUP)
+# v1: filter fields (institution, year) added to the metadata of the chunks
+# v1: vector DB (and pysqlite3) imported only when files are embedded
 
 import streamlit as st
 import shutil
+import hashlib
+import json
 from langchain_community.document_loaders import JSONLoader, PyPDFLoader
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
 
+from modules.providers_v1 import import_chroma, instanciate_embedding_model
+from modules.manifest_v1 import file_stats, update_manifest
+from modules.filters_v1 import add_filter_metadata
 from config.config import *
 
 
-def load_files_and_embed(json_file_paths: int, pdf_file_paths: int, embed: bool) -> None:
+def load_files_and_embed(json_file_paths: int, pdf_file_paths: int, embed: bool, persist_directory: str = "./chromadb", embedding_model=None, dedup: bool = DEDUP, log=st.write, raise_errors: bool = False) -> None:
     """
-    Loads and chunks files into a list of documents then embed
+    Loads and chunks files into a list of documents then embed. log: st.write, or print outside of a Streamlit page.
+    raise_errors: raise the errors after logging them (benchmarks), instead of only logging them
     """
 
     try:
 
-        embedding_model = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+        if embedding_model is None:
+            embedding_model = instanciate_embedding_model()
+        if embed:
+            Chroma, chromadb = import_chroma()  # pysqlite3 (Github Codespace) then the vector DB, on first use
 
         nbr_files = len(json_file_paths)
-        st.write(f"Number of JSON files: {nbr_files}")
+        log(f"Number of JSON files: {nbr_files}")
         documents = []
+        json_stats = {}
         for json_file_path in json_file_paths:
             loader = JSONLoader(file_path=json_file_path, jq_schema=".[]", text_content=False)
             docs = loader.load()   # 1 JSON item per chunk
             print(f"JSON file: {json_file_path}, Number of web pages: {len(docs)}")
+            json_stats[json_file_path] = file_stats(json_file_path, "json", docs)
             documents = documents + docs
-        st.write(f"Number of web pages: {len(documents)}")
+        log(f"Number of web pages: {len(documents)}")
+        add_filter_metadata(documents, "json")
+        if dedup and documents:
+            from modules.dedup_v1 import dedup_documents
+            files = [path for path in json_file_paths for _ in range(json_stats[path]["chunks"])]  # File of each chunk
+            documents, dropped = dedup_documents(documents)
+            for i in dropped:
+                json_stats[files[i]]["duplicates"] = json_stats[files[i]].get("duplicates", 0) + 1
+            log(f"Number of web pages after dedup: {len(documents)} ({len(dropped)} duplicates collapsed)")
         if embed:
-            Chroma.from_documents(documents, embedding_model, collection_name=COLLECTION_NAME, persist_directory="./chromadb")
+            if documents:  # Nothing to embed (ex: incremental ingest of PDF files only)
+                Chroma.from_documents(documents, embedding_model, collection_name=COLLECTION_NAME, persist_directory=persist_directory)
+            for stats in json_stats.values():
+                stats["embedded"] = True
+            update_manifest(json_stats, persist_directory)
 
         nbr_files = len(pdf_file_paths)
-        st.write(f"Number of PDF files: {nbr_files}")
+        log(f"Number of PDF files: {nbr_files}")
         documents2 = []
+        pdf_stats = {}
         if pdf_file_paths:  # if equals to "", then skip
             for pdf_file_path in pdf_file_paths:
                 loader = PyPDFLoader(pdf_file_path)
                 pages = loader.load_and_split()  # 1 pdf page per chunk
                 print(f"PDF file: {pdf_file_path}, Number of PDF pages: {len(pages)}")
+                pdf_stats[pdf_file_path] = file_stats(pdf_file_path, "pdf", pages)
                 documents2 = documents2 + pages
-        st.write(f"Number of PDF pages: {len(documents2)}")
-        st.write(f"Number of web and pdf pages: {len(documents) + len(documents2)}")
+        log(f"Number of PDF pages: {len(documents2)}")
+        add_filter_metadata(documents2, "pdf")
+        log(f"Number of web and pdf pages: {len(documents) + len(documents2)}")
         if embed:
-            Chroma.from_documents(documents2, embedding_model, collection_name=COLLECTION_NAME, persist_directory="./chromadb")
+            if documents2:  # Nothing to embed (ex: incremental ingest of JSON files only)
+                Chroma.from_documents(documents2, embedding_model, collection_name=COLLECTION_NAME, persist_directory=persist_directory)
+            for stats in pdf_stats.values():
+                stats["embedded"] = True
+            update_manifest(pdf_stats, persist_directory)
 
     except Exception as e:
-        st.write("Error: Is the DB available?")
-        st.write(f"Error: {e}")
+        log("Error: Is the DB available?")
+        log(f"Error: {e}")
+        if raise_errors:
+            raise
+
+
+def chunk_id(document) -> str:
+    """
+    Stable ID of a chunk (document), computed from its content. The same chunk gets
+    the same ID whatever the retriever (BM25 or vector DB) which found it.
+    """
+
+    return hashlib.sha1(document.page_content.encode("utf-8")).hexdigest()[:16]
+
+
+def document_url(document) -> str:
+    """
+    URL of the web page of a chunk (JSON item: "url" field), or path of the file (PDF page).
+    """
+
+    try:
+        return json.loads(document.page_content).get("url", "")
+    except (json.JSONDecodeError, AttributeError):
+        return document.metadata.get("source", "")
+
+
+def document_urls(document) -> list[str]:
+    """
+    URLs of a chunk: its URL, then the URLs of the duplicates collapsed into it at ingest (JSON "urls" field, metadata "urls").
+    """
+
+    urls = [document_url(document)]
+    try:
+        urls = urls + list(json.loads(document.page_content).get("urls", []))
+    except (json.JSONDecodeError, AttributeError):
+        pass
+    urls = urls + (document.metadata.get("urls") or "").split("|")
+    return list(dict.fromkeys(url for url in urls if url))
 
 
 def delete_directory(dir_path):
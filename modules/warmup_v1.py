@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+Warm-up of a worker process (Streamlit worker or API worker) before it serves the users: the index
+files are read (page cache), the retrievers are instantiated (vector DB, BM25 or memory-mapped index),
+the connections to the providers are opened (pooled HTTP clients), the example questions are embedded
+(query embedding cache) and one retrieval is run. Then the process is ready: RUN_DIR/ready/<name>.json.
+Wait until processes are ready: python -m modules.warmup_v1 wait --names worker-8501,worker-8502
+"""
+
+# v1: page-fault of the index files + retrievers + provider connections + example questions + ready file
+
+import argparse
+import atexit
+import json
+import os
+import time
+
+from config.config import *
+
+
+READY_DIR = os.path.join(RUN_DIR, "ready")
+READ_SIZE = 8 * 1024 * 1024
+
+state = {"name": None, "ready": False, "warming_up": False, "steps": {}, "errors": {}}  # Warm-up state of this process
+
+
+def example_questions() -> list[str]:
+    """
+    The example questions displayed in the About text.
+    """
+
+    questions = []
+    for line in ABOUT_TEXT.splitlines():
+        if line.startswith("- "):
+            questions.append(line[2:].split("*")[0].strip())
+    return questions
+
+
+def prefault(path: str) -> int:
+    """
+    Read all the files of the index (page cache shared by the processes). Return the number of bytes.
+    """
+
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name), "rb") as index_file:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(index_file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                while True:
+                    data = index_file.read(READ_SIZE)
+                    if not data:
+                        break
+                    total = total + len(data)
+    return total
+
+
+def open_provider_connections() -> list[str]:
+    """
+    Open the pooled connections (TLS, HTTP/2) of the providers: any answer keeps the connection in the pool.
+    """
+
+    from modules.providers_v1 import http_clients, instanciate_llm
+
+    instanciate_llm(DEFAULT_MODEL, DEFAULT_TEMPERATURE)
+    opened = []
+    for provider, url in PROVIDER_WARMUP_URLS.items():
+        http_clients(provider)["http_client"].get(url)
+        opened.append(provider)
+    return opened
+
+
+def index_published(index_path: str) -> bool:
+    """
+    False before the first build: no version published and no legacy vector DB.
+    """
+
+    from modules.index_store_v1 import current_version
+
+    return bool(current_version()) or (os.path.isdir(index_path) and bool(os.listdir(index_path)))
+
+
+def ready_path(name: str) -> str:
+    return os.path.join(READY_DIR, f"{name}.json")
+
+
+def remove_ready_file() -> None:
+    if state["name"]:
+        try:
+            os.remove(ready_path(state["name"]))
+        except OSError:
+            pass
+
+
+def warm_up(name: str) -> dict:
+    """
+    Warm up the process (if WARMUP), then write its ready file. A step which fails is recorded (the
+    process is ready if the retrievers are instantiated). Before the first build (no index), only the
+    connections to the providers are opened and the process is ready (the Admin page builds the index).
+    """
+
+    from modules.assistant_backend_v3 import instanciate_retrievers
+    from modules.index_store_v1 import current_index_path, current_version
+    from modules.providers_v1 import instanciate_embedding_model
+
+    state.update(name=name, ready=False, warming_up=True, steps={}, errors={})
+    remove_ready_file()
+    atexit.register(remove_ready_file)
+    questions = example_questions()
+    retrievers = []
+
+    def step(step_name, function):
+        start = time.perf_counter()
+        try:
+            result = function()
+        except Exception as e:
+            state["errors"][step_name] = str(e)
+            result = None
+        state["steps"][step_name] = round(time.perf_counter() - start, 3)
+        return result
+
+    def instanciate():
+        retrievers.append(instanciate_retrievers())
+        if retrievers[0] is None:
+            raise RuntimeError("Cannot instanciate the retrievers")
+
+    def embed_questions():
+        embedding_model = instanciate_embedding_model()
+        for question in questions:
+            embedding_model.embed_query(question)  # Kept in the query embedding cache
+
+    index_path = current_index_path()
+    published = index_published(index_path)
+    if WARMUP and not published:
+        step("providers", open_provider_connections)
+    elif WARMUP:
+        step("index_files", lambda: prefault(index_path))
+        step("retrievers", instanciate)
+        step("providers", open_provider_connections)
+        step("example_questions", embed_questions)
+        if retrievers and retrievers[0] is not None and questions:
+            step("retrieval", lambda: retrievers[0].invoke(questions[0]))
+
+    state.update(ready="retrievers" not in state["errors"], warming_up=False, version=current_version(), index_path=index_path, index_published=published)
+    print(f"Warm-up of {name}: {state['steps']} errors: {state['errors']}", flush=True)
+    if state["ready"]:
+        os.makedirs(READY_DIR, exist_ok=True)
+        with open(f"{ready_path(name)}.tmp", "w") as ready_file:
+            json.dump({"pid": os.getpid(), "version": state["version"], "steps": state["steps"], "errors": state["errors"]}, ready_file)
+        os.replace(f"{ready_path(name)}.tmp", ready_path(name))
+    return state
+
+
+def is_ready(name: str) -> bool:
+    """
+    A process is ready if its ready file exists and the process is alive.
+    """
+
+    try:
+        with open(ready_path(name)) as ready_file:
+            os.kill(json.load(ready_file)["pid"], 0)
+        return True
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def ready_names(prefix: str) -> list[str]:
+    if not os.path.isdir(READY_DIR):
+        return []
+    names = [name[:-len(".json")] for name in os.listdir(READY_DIR) if name.startswith(prefix) and name.endswith(".json")]
+    return [name for name in names if is_ready(name)]
+
+
+def wait_ready(names: list[str] = None, prefix: str = None, count: int = 0, timeout: float = WARMUP_TIMEOUT) -> bool:
+    """
+    Wait until the named processes (or count processes whose name starts with prefix) are ready.
+    """
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if names and all(is_ready(name) for name in names):
+            return True
+        if prefix is not None and len(ready_names(prefix)) >= count:
+            return True
+        time.sleep(1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Readiness of the worker processes (warm-up done)")
+    parser.add_argument("command", choices=["wait"])
+    parser.add_argument("--names", default="", help="Names of the processes, separated by commas (ex: worker-8501)")
+    parser.add_argument("--prefix", default=None, help="Prefix of the names of the processes (ex: api-)")
+    parser.add_argument("--count", type=int, default=1, help="Number of processes with the prefix")
+    parser.add_argument("--timeout", type=float, default=WARMUP_TIMEOUT, help="In seconds")
+    args = parser.parse_args()
+
+    names = [name for name in args.names.split(",") if name]
+    if wait_ready(names, args.prefix, args.count, args.timeout):
+        print("OK: ready.")
+    else:
+        print("ERROR: not ready (see the logs)!")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
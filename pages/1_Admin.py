@@ -9,7 +9,11 @@ from langchain.memory import ConversationBufferWindowMemory
 import os
 
 from modules.web_scraping_utils_v1 import scrape_commons_category, scrape_web_page_url
-from modules.utils_v1 import load_files_and_embed, delete_directory
+from modules.tracing_v1 import aggregate_spans, read_spans
+from modules.manifest_v1 import pending_files, read_manifest
+from modules.assistant_backend_v3 import instanciate_vector_db
+from modules.uploads_v1 import enqueue_ingest, ingest_status, save_upload
+from modules.index_store_v1 import build_index, collect_garbage, current_index_path, delete_legacy_index, list_versions, unpublish
 from config.config import *
 
 
@@ -56,7 +60,7 @@ if st.session_state.password_ok:
     # Side bar window: second page (Admin)  #
     # # # # # # # # # # # # # # # # # # # # #
     
-    options = ['Upload PDF Files', 'Upload JSON Files (Web Pages)', 'Scrape Web Pages', 'Scrape Web Pages from Wikimedia Commons', 'Embed Pages in DB', 'Model and Temperature', 'Upload File']
+    options = ['Upload PDF Files', 'Upload JSON Files (Web Pages)', 'Scrape Web Pages', 'Scrape Web Pages from Wikimedia Commons', 'Embed Pages in DB', 'Model and Temperature', 'Upload File', 'Latency Traces']
     choice = st.sidebar.radio("Make your choice: ", options)
 
     if choice == "Scrape Web Pages":
@@ -77,7 +81,7 @@ if st.session_state.password_ok:
 
     elif choice == "Model and Temperature":
         st.caption("Change the model and the temperature for the present chat session.")
-        model_list = [OPENAI_MENU, ANTHROPIC_MENU, VERTEXAI_MENU, OLLAMA_MENU]
+        model_list = [OPENAI_MENU, ANTHROPIC_MENU, VERTEXAI_MENU, OLLAMA_MENU, FAKE_MENU]
         st.session_state.model = st.selectbox('Model: ', model_list, DEFAULT_MENU_CHOICE)
         st.session_state.temperature = st.slider("Temperature: ", 0.0, 2.0, DEFAULT_TEMPERATURE)
         st.caption("OpenAI: 0-2, Anthropic: 0-1")
@@ -94,45 +98,44 @@ if st.session_state.password_ok:
         st.caption("Upload a file in the 'root' directory.")
         uploaded_file = st.file_uploader("Choose a file:")
         if uploaded_file is not None:
-            bytes_data = uploaded_file.getvalue()
-            file_name = uploaded_file.name
-            with open(file_name, "wb") as file:
-                file.write(bytes_data)
-            st.success(f"File '{file_name}' uploaded and saved successfully!")
+            path, sha256, size = save_upload(uploaded_file, ".")
+            st.success(f"File '{uploaded_file.name}' uploaded and saved successfully! ({size} bytes, sha256 {sha256[:12]})")
         else:
             st.warning("No file uploaded yet.")
 
     elif choice == "Upload PDF Files":
-        st.caption("Upload PDF files in the 'pdf_files' directory.")
+        st.caption("Upload PDF files in the 'pdf_files' directory. Each file is indexed when uploaded (AUTO_INDEX_UPLOADS).")
         uploaded_files = st.file_uploader("Choose PDF files:", type=["pdf"], accept_multiple_files=True)
         for uploaded_file in uploaded_files:
             if uploaded_file is not None:
-                bytes_data = uploaded_file.getvalue()
-                file_name = uploaded_file.name
-                with open(f"./pdf_files/{file_name}", "wb") as file:
-                    file.write(bytes_data)
-                st.success(f"File '{file_name}' uploaded and saved successfully!")
+                path, sha256, size = save_upload(uploaded_file, "./pdf_files")
+                st.success(f"File '{uploaded_file.name}' uploaded and saved successfully! ({size} bytes, sha256 {sha256[:12]})")
+                if AUTO_INDEX_UPLOADS and enqueue_ingest(path, sha256):
+                    st.write(f"File '{uploaded_file.name}' queued for indexing.")
             else:
-                st.warning("No file uploaded yet.")  
+                st.warning("No file uploaded yet.")
+        if AUTO_INDEX_UPLOADS and ingest_status():
+            st.write(ingest_status())
 
     elif choice == "Upload JSON Files (Web Pages)":
-        st.caption("Upload JSON files (Web Pages) in the 'json_files' directory.")
+        st.caption("Upload JSON files (Web Pages) in the 'json_files' directory. Each file is indexed when uploaded (AUTO_INDEX_UPLOADS).")
         uploaded_files = st.file_uploader("Choose JSON files:", type=["json"], accept_multiple_files=True)
         for uploaded_file in uploaded_files:
             if uploaded_file is not None:
-                bytes_data = uploaded_file.getvalue()
-                file_name = uploaded_file.name
-                with open(f"./json_files/{file_name}", "wb") as file:
-                    file.write(bytes_data)
-                st.success(f"File '{file_name}' uploaded and saved successfully!")
+                path, sha256, size = save_upload(uploaded_file, "./json_files")
+                st.success(f"File '{uploaded_file.name}' uploaded and saved successfully! ({size} bytes, sha256 {sha256[:12]})")
+                if AUTO_INDEX_UPLOADS and enqueue_ingest(path, sha256):
+                    st.write(f"File '{uploaded_file.name}' queued for indexing.")
             else:
-                st.warning("No file uploaded yet.")  
+                st.warning("No file uploaded yet.")
+        if AUTO_INDEX_UPLOADS and ingest_status():
+            st.write(ingest_status())
 
     elif choice == "Embed Pages in DB":
         # Embed data in Chroma DB
         # Load and index
 
-        st.caption('Embed in the vector DB all the web and pdf pages.')
+        st.caption('Embed in the vector DB all the web and pdf pages. The new index version is built aside, then published: the users are not interrupted.')
 
         JSON_FILES_DIR = "./json_files/"
         PDF_FILES_DIR = "./pdf_files/"
@@ -152,12 +155,20 @@ if st.session_state.password_ok:
             pdf_paths.append(pdf_path)
 
         if st.button("Start Embed"):
-            load_files_and_embed(json_paths, pdf_paths, embed=True)
-            st.write("Done!")
+            try:
+                version = build_index(json_paths, pdf_paths, log=st.write)
+                st.write(f"Done! Index version {version} published.")
+            except Exception as e:
+                st.write("Error: the index was not rebuilt, the published version is unchanged!")
+                st.write(f"Error: {e}")
 
         if st.button("Delete DB"):
-            delete_directory("./chromadb")
-            st.write("Done!")
+            unpublish()  # The versions are deleted when no process reads them anymore
+            collect_garbage()
+            if delete_legacy_index():
+                st.write("Done!")
+            else:
+                st.write(f"Error: {LEGACY_INDEX_PATH} is read by a worker, not deleted: click again when the answers are finished.")
 
         if st.button("Clear Memory and Streamlit Cache"):
             st.cache_data.clear()
@@ -167,19 +178,34 @@ if st.session_state.password_ok:
 
         if st.button("Files and DB Info"):
 
-            load_files_and_embed(json_paths, pdf_paths, embed=False)
+            # Statistics from the manifest maintained by the ingestion (no file is parsed)
+            index_path = current_index_path()
+            st.write(f"Index: {index_path}")
+            st.write(list_versions())
+            manifest = read_manifest(index_path)
+            totals = manifest["totals"]
+            st.write(f"Number of JSON and PDF files on disk: {len(json_paths) + len(pdf_paths)}")
+            st.write(f"Number of files embedded: {totals.get('files', 0)} (updated: {manifest.get('updated', 'never')})")
+            st.write(f"Number of web pages: {totals.get('records', 0)}, number of PDF pages: {totals.get('pages', 0)}")
+            st.write(f"Number of chunks: {totals.get('chunks', 0)} (embedded: {totals.get('embedded_chunks', 0)}), number of tokens: {totals.get('tokens', 0)}")
+            st.write(f"Number of duplicate web pages collapsed: {totals.get('duplicates', 0)}")
+            pending = pending_files(manifest, json_paths + pdf_paths)
+            st.write(f"Number of files pending (new, changed or not embedded): {len(pending)}")
+            if pending:
+                st.write(pending)
+            st.write("Index size per component (bytes):")
+            st.write(manifest["index_bytes"])
 
             try:
 
-                file_path = './chromadb/chroma.sqlite3'
-                file_size = os.path.getsize(file_path)
-                file_size = file_size / 1024  # In KB
-                if file_size > 144:
-                    st.write(f"DB size: {file_size} KB")
+                vector_db = instanciate_vector_db()
+                nbr_chunks = vector_db._collection.count()  # Live count of the collection
+                if nbr_chunks > 0:
+                    st.write(f"Number of chunks in the DB: {nbr_chunks}")
                 else:
-                    st.write(f"DB size: {file_size} KB. DB is empty!")
+                    st.write("DB is empty!")
 
-                path = './chromadb'
+                path = index_path
                 files = os.listdir(path)
                 st.write("DB path:")
                 st.write(files)
@@ -197,3 +223,11 @@ if st.session_state.password_ok:
 
             except Exception as e:
                 st.write(f"Error: {e}")
+
+    elif choice == "Latency Traces":
+        st.caption(f"Latency of each stage of the chain (last {TRACES_MAX_SPANS} spans of {TRACES_PATH}).")
+        spans = read_spans()
+        if spans:
+            st.table(aggregate_spans(spans))
+        else:
+            st.warning("No traces yet.")
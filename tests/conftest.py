@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+from modules import index_store_v1
+
+
+@pytest.fixture
+def index_root(tmp_path, monkeypatch):
+    """
+    Index versions, pointer and leases in a temporary directory.
+    """
+
+    root = str(tmp_path / "indexes")
+    monkeypatch.setattr(index_store_v1, "INDEX_ROOT", root)
+    monkeypatch.setattr(index_store_v1, "CURRENT_FILE", os.path.join(root, "CURRENT"))
+    monkeypatch.setattr(index_store_v1, "LEASES_DIR", os.path.join(root, "leases"))
+    monkeypatch.setattr(index_store_v1, "LEGACY_INDEX_PATH", str(tmp_path / "chromadb"))
+    return root
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_community")
+pytest.importorskip("streamlit")
+
+from langchain_core.documents import Document
+
+from modules.dedup_v1 import dedup_documents
+from modules.utils_v1 import document_urls
+
+TEMPLATE = " ".join(f"licence{i} template{i}" for i in range(200))  # Shared by all the Commons pages
+
+
+def page(url: str, title: str) -> Document:
+    text = f"{title} {TEMPLATE}"
+    return Document(page_content=json.dumps({"url": url, "text": text}), metadata={"source": "commons.json"})
+
+
+def test_pages_sharing_only_the_template_are_kept():
+    pages = [page(f"https://commons.wikimedia.org/wiki/File:{i}.jpg", " ".join(f"artwork{i} word{j}" for j in range(8))) for i in range(12)]
+
+    kept, dropped = dedup_documents(pages)
+
+    assert len(kept) == 12
+    assert dropped == []
+
+
+def test_collapsed_copies_keep_their_urls():
+    title = " ".join(f"portrait word{j}" for j in range(8))
+    pages = [page(f"https://commons.wikimedia.org/wiki/File:{i}.jpg", " ".join(f"artwork{i} word{j}" for j in range(8))) for i in range(11)]
+    pages = pages + [page("https://commons.wikimedia.org/wiki/File:Scan.jpg", title), page("https://commons.wikimedia.org/wiki/File:Scan_(cropped).jpg", title)]
+
+    kept, dropped = dedup_documents(pages)
+
+    assert dropped == [12]
+    assert document_urls(kept[-1]) == ["https://commons.wikimedia.org/wiki/File:Scan.jpg", "https://commons.wikimedia.org/wiki/File:Scan_(cropped).jpg"]
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_community")
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from modules.filters_v1 import FilteredVectorStoreRetriever
+
+
+class RecordingVectorStore(VectorStore):
+    """
+    Vector store returning one document and recording the filter of each search.
+    """
+
+    def __init__(self):
+        self.filters = []
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        return []
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        return cls()
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        self.filters.append(filter)
+        return [Document(page_content="page")]
+
+    async def asimilarity_search(self, query, k=4, filter=None, **kwargs):
+        self.filters.append(filter)
+        return [Document(page_content="page")]
+
+
+def test_ainvoke_applies_filters():
+    vectorstore = RecordingVectorStore()
+    retriever = FilteredVectorStoreRetriever(vectorstore=vectorstore, search_type="similarity", search_kwargs={"k": 5})
+    filters = {"institution": ["irpa"], "year_min": 1850, "year_max": 1900}
+
+    asyncio.run(retriever.ainvoke("question", config={"metadata": {"filters": filters}}))
+    retriever.invoke("question", config={"metadata": {"filters": filters}})
+
+    assert vectorstore.filters[0] is not None
+    assert vectorstore.filters[0] == vectorstore.filters[1]  # Same "where" filter on the async and sync paths
+
+
+def test_bm25_scores_only_the_filtered_chunks():
+    pytest.importorskip("rank_bm25")
+    from modules.filters_v1 import FilteredBM25Retriever
+
+    texts = ["portrait of leopold", "portrait of leopold engraving", "portrait of louise", "landscape of brussels"]
+    metadatas = [{"institution": "kbr", "year": 1831}, {"institution": "irpa", "year": 1840}, {"institution": "irpa", "year": 1835}, {"institution": "irpa"}]
+    retriever = FilteredBM25Retriever.from_texts(texts, metadatas=metadatas)
+    scored = []
+    get_batch_scores = retriever.vectorizer.get_batch_scores
+    retriever.vectorizer.get_batch_scores = lambda query, doc_ids: scored.append(doc_ids) or get_batch_scores(query, doc_ids)
+
+    documents = retriever.invoke("portrait leopold", config={"metadata": {"filters": {"institution": "irpa", "year_min": 1830}}})
+
+    assert scored == [[1, 2]]
+    assert [document.page_content for document in documents] == ["portrait of leopold engraving", "portrait of louise"]
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("rank_bm25")
+
+from modules import index_store_v1
+from modules.fake_providers_v1 import FakeEmbeddings
+from modules.manifest_v1 import read_manifest
+from config.config import EMBEDDING_DIMENSION
+
+
+def write_pages(path, count: int = 3) -> str:
+    pages = [{"url": f"https://example.org/page{i}", "metadata": {"og:title": f"Page {i}"},
+              "text": f"Portrait number {i} of Leopold I, engraving of {1830 + i * 7}"} for i in range(count)]
+    path.write_text(json.dumps(pages), encoding="utf-8")
+    return str(path)
+
+
+def test_build_index_publishes_a_version(tmp_path, index_root):
+    json_path = write_pages(tmp_path / "pages.json")
+    messages = []
+
+    version = index_store_v1.build_index([json_path], [], embedding_model=FakeEmbeddings(EMBEDDING_DIMENSION), log=messages.append)
+
+    assert index_store_v1.current_version() == version
+    assert read_manifest(index_store_v1.version_path(version))["files"][json_path]["embedded"]
+    assert any("JSON files" in str(message) for message in messages)
+
+
+def test_failed_build_is_not_published(tmp_path, index_root):
+    version = index_store_v1.build_index([write_pages(tmp_path / "pages.json")], [], embedding_model=FakeEmbeddings(EMBEDDING_DIMENSION))
+
+    with pytest.raises(RuntimeError):
+        index_store_v1.build_index([str(tmp_path / "missing.json")], [], embedding_model=FakeEmbeddings(EMBEDDING_DIMENSION))
+
+    assert index_store_v1.current_version() == version
+    assert sorted(name for name in os.listdir(index_root) if name.startswith("v")) == [version]
+
+
+def test_legacy_index_not_deleted_while_read(tmp_path, index_root):
+    legacy_path = tmp_path / "chromadb"  # LEGACY_INDEX_PATH of the fixture
+    legacy_path.mkdir()
+
+    with index_store_v1.lease(str(legacy_path)):
+        assert not index_store_v1.delete_legacy_index()
+        assert legacy_path.exists()
+
+    assert index_store_v1.delete_legacy_index()
+    assert not legacy_path.exists()
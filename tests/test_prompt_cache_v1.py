@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from modules.prompt_cache_v1 import CACHE_BREAKPOINTS, CachedPrefixChatPromptTemplate, mark_cache_control
+from config.config import CHAT_HISTORY_PROMPT, CONTEXT_PROMPT, SYSTEM_PROMPT
+
+PROMPT = CachedPrefixChatPromptTemplate(input_variables=["chat_history", "context", "input"], static_prompt=SYSTEM_PROMPT, dynamic_prompts=[CHAT_HISTORY_PROMPT, CONTEXT_PROMPT])
+HISTORY = [HumanMessage(content="Who was the first king of the Belgians?"), AIMessage(content="Leopold I.")]
+
+
+def test_only_the_chat_history_is_a_breakpoint():
+    messages = PROMPT.format_messages(chat_history=HISTORY, context="[]", input="And his wife?")
+
+    breakpoints = messages[0].additional_kwargs[CACHE_BREAKPOINTS]
+
+    assert len(breakpoints) == 1
+    assert messages[0].content[:breakpoints[0]].endswith("ai: Leopold I.\n")
+
+
+def test_prefix_of_a_turn_is_a_prefix_of_the_next_turn():
+    first = mark_cache_control(PROMPT.format_messages(chat_history=HISTORY, context="[1]", input="And his wife?"))
+    history = HISTORY + [HumanMessage(content="And his wife?"), AIMessage(content="Louise of Orleans.")]
+    second = mark_cache_control(PROMPT.format_messages(chat_history=history, context="[2]", input="Her portraits?"))
+
+    cached = "".join(block["text"] for block in first[0].content if "cache_control" in block)
+
+    assert cached and second[0].content[0]["text"].startswith(cached)
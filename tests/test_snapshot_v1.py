@@ -0,0 +1,61 @@
+import os
+import tarfile
+
+import pytest
+
+from modules import index_store_v1, snapshot_v1
+
+
+def published_version(files: dict) -> str:
+    version = index_store_v1.new_version()
+    for name, content in files.items():
+        path = os.path.join(index_store_v1.version_path(version), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as index_file:
+            index_file.write(content)
+    index_store_v1.publish(version)
+    return version
+
+
+FILES = {"chroma.sqlite3": b"sqlite" * 1000, "manifest.json": b"{}", "shards/0/vectors.npy": bytes(range(256)) * 100}
+
+
+def test_snapshot_round_trip(tmp_path, index_root):
+    source = published_version(FILES)
+    snapshot_path = str(tmp_path / "index.snapshot")
+
+    header = snapshot_v1.export_snapshot(snapshot_path)
+    version = snapshot_v1.import_snapshot(snapshot_path)
+
+    assert header["source_version"] == source
+    assert version != source and index_store_v1.current_version() == version
+    for name, content in FILES.items():
+        with open(os.path.join(index_store_v1.version_path(version), name), "rb") as index_file:
+            assert index_file.read() == content
+    assert not os.path.exists(os.path.join(index_store_v1.version_path(version), index_store_v1.BUILDING_MARKER))
+
+
+def test_snapshot_of_another_embedding_model_refused(tmp_path, index_root, monkeypatch):
+    source = published_version(FILES)
+    snapshot_path = str(tmp_path / "index.snapshot")
+    snapshot_v1.export_snapshot(snapshot_path)
+    monkeypatch.setattr(snapshot_v1, "EMBEDDING_MODEL", "another-embedding-model")
+
+    with pytest.raises(ValueError, match="another-embedding-model"):
+        snapshot_v1.import_snapshot(snapshot_path)
+
+    assert index_store_v1.current_version() == source
+    assert sorted(name for name in os.listdir(index_root) if name.startswith("v")) == [source]
+
+
+def test_truncated_snapshot_refused(tmp_path, index_root):
+    source = published_version(FILES)
+    snapshot_path = tmp_path / "index.snapshot"
+    snapshot_v1.export_snapshot(str(snapshot_path))
+    content = snapshot_path.read_bytes()
+    snapshot_path.write_bytes(content[:len(content) // 2])
+
+    with pytest.raises((OSError, ValueError, tarfile.TarError)):
+        snapshot_v1.import_snapshot(str(snapshot_path))
+
+    assert sorted(name for name in os.listdir(index_root) if name.startswith("v")) == [source]
@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("prometheus_client")
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.retrievers import BaseRetriever
+
+from modules.speculative_retriever_v1 import SpeculationCancelled, SpeculationCanceller, create_speculative_history_aware_retriever
+
+PROMPT = ChatPromptTemplate.from_messages([("system", "Reformulate"), MessagesPlaceholder("chat_history"), ("human", "{input}")])
+HISTORY = [HumanMessage(content="Who was the first king of the Belgians?"), AIMessage(content="Leopold I.")]
+
+
+class RecordingRetriever(BaseRetriever):
+    queries: list = []
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        self.queries.append(query)
+        return [Document(page_content=query)]
+
+
+def test_speculation_accepted_when_the_question_is_standalone():
+    retriever = RecordingRetriever(queries=[])
+    chain = create_speculative_history_aware_retriever(FakeListChatModel(responses=["Portraits of Leopold"]), retriever, PROMPT)
+
+    documents = chain.invoke({"input": "Show me portraits of Leopold", "chat_history": HISTORY})
+
+    assert retriever.queries == ["Show me portraits of Leopold"]
+    assert documents[0].page_content == "Show me portraits of Leopold"
+
+
+def test_speculation_rejected_when_the_history_is_needed():
+    retriever = RecordingRetriever(queries=[])
+    rewritten = "Portraits of the wife of Leopold I, Louise of Orleans"
+    chain = create_speculative_history_aware_retriever(FakeListChatModel(responses=[rewritten]), retriever, PROMPT)
+
+    documents = chain.invoke({"input": "And his wife?", "chat_history": HISTORY})
+
+    assert documents[0].page_content == rewritten
+
+
+def test_cancelled_speculation_stops_at_the_next_retriever():
+    canceller = SpeculationCanceller()
+    canceller.cancelled.set()
+
+    with pytest.raises(SpeculationCancelled):
+        RecordingRetriever(queries=[]).invoke("question", config={"callbacks": [canceller]})
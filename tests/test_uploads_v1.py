@@ -0,0 +1,66 @@
+import hashlib
+import io
+import queue
+import time
+
+import pytest
+
+from modules import index_store_v1, uploads_v1
+
+
+@pytest.fixture
+def ingest_jobs(index_root, monkeypatch):
+    """
+    Empty queue and jobs, and a new worker thread (it imports add_files when it starts).
+    """
+
+    monkeypatch.setattr(uploads_v1, "ingest_queue", queue.Queue())
+    monkeypatch.setattr(uploads_v1, "worker", {"thread": None})
+
+
+def wait_for_status(path: str, timeout: float = 5) -> str:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = uploads_v1.jobs.get(path, {}).get("status", "")
+        if status.startswith("done") or status.startswith("error"):
+            return status
+        time.sleep(0.01)
+    return status
+
+
+def test_upload_written_chunk_by_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads_v1, "UPLOAD_CHUNK_SIZE", 7)
+    content = b"[{\"url\": \"https://example.org\", \"text\": \"Portrait of Leopold I\"}]"
+    uploaded_file = io.BytesIO(content)
+    uploaded_file.name = "../pages.json"  # Only the file name is kept
+
+    path, sha256, size = uploads_v1.save_upload(uploaded_file, str(tmp_path))
+
+    assert path == str(tmp_path / "pages.json")
+    assert (tmp_path / "pages.json").read_bytes() == content
+    assert (sha256, size) == (hashlib.sha256(content).hexdigest(), len(content))
+    assert not (tmp_path / "pages.json.part").exists()
+
+
+def test_ingest_queued_once_per_content(tmp_path, ingest_jobs, monkeypatch):
+    batches = []
+    monkeypatch.setattr(index_store_v1, "add_files", lambda json_paths, pdf_paths, hashes=None: batches.append((json_paths, pdf_paths, hashes)) or "v1")
+    path = str(tmp_path / "pages.json")
+
+    assert uploads_v1.enqueue_ingest(path, "abc")
+    assert wait_for_status(path) == "done (v1)"
+    assert not uploads_v1.enqueue_ingest(path, "abc")  # Same content: not ingested again
+    assert batches == [([path], [], {path: "abc"})]
+
+
+def test_failed_ingest_can_be_queued_again(tmp_path, ingest_jobs, monkeypatch):
+    def add_files(json_paths, pdf_paths, hashes=None):
+        raise RuntimeError("embedding failed")
+
+    monkeypatch.setattr(index_store_v1, "add_files", add_files)
+    path = str(tmp_path / "pages.json")
+
+    assert uploads_v1.enqueue_ingest(path, "abc")
+    assert wait_for_status(path) == "error: embedding failed"
+    assert uploads_v1.enqueue_ingest(path, "abc")
+    wait_for_status(path)